@@ -0,0 +1,119 @@
+import argparse
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from harvest_monster_data import MONSTER_INDEX_PATH
+
+# Local stand-in for aidedd.org, serving the saved pages in aidedd_fixtures/ so the harvesters can be exercised
+# without hammering the real site:
+#   python aidedd_fixture_server.py --port 8765 --repeat 500
+#   python async_harvester.py --base-url http://127.0.0.1:8765
+# --repeat lists every fixture page that many times in the index (with a distinct query string), --delay adds latency
+# and --failure-rate answers that fraction of monster requests with a 503 to exercise retries.
+# Monster pages carry an ETag and Last-Modified and honour If-None-Match/If-Modified-Since, so edit or touch a fixture to
+# see a rerun pick it up.
+
+FIXTURE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aidedd_fixtures')
+MONSTER_PAGE_ROUTE = '/dnd/monstres.php'
+FIXTURE_NAME_REGEX = re.compile(r'^[a-z0-9\-]+$')
+
+
+class AideddFixtureRequestHandler(BaseHTTPRequestHandler):
+    fixture_directory = FIXTURE_DIRECTORY
+    repeat = 1
+    delay_seconds = 0.0
+    failure_rate = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if self.delay_seconds:
+            time.sleep(self.delay_seconds)
+        if url.path == MONSTER_INDEX_PATH:
+            self.send_page(self.build_index())
+        elif url.path == MONSTER_PAGE_ROUTE:
+            if random.random() < self.failure_rate:
+                self.send_error(503, 'Simulated failure')
+                return
+            fixture_name = parse_qs(url.query).get('vo', [''])[0]
+            fixture_location = os.path.join(self.fixture_directory, fixture_name + '.html')
+            if not FIXTURE_NAME_REGEX.match(fixture_name) or not os.path.exists(fixture_location):
+                self.send_error(404, 'Unknown monster: ' + fixture_name)
+                return
+            with open(fixture_location, 'rb') as fixture_file:
+                page = fixture_file.read()
+            etag = '"' + hashlib.sha1(page).hexdigest() + '"'
+            last_modified = formatdate(int(os.path.getmtime(fixture_location)), usegmt=True)
+            if_none_match = self.headers.get('If-None-Match')
+            if (if_none_match is not None and etag in if_none_match) \
+                    or (if_none_match is None and self.headers.get('If-Modified-Since') == last_modified):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_page(page, {'ETag': etag, 'Last-Modified': last_modified})
+        else:
+            self.send_error(404)
+
+    def build_index(self):
+        base_url = 'http://' + self.headers.get('Host', '127.0.0.1')
+        fixture_names = sorted(file_name[:-len('.html')] for file_name in os.listdir(self.fixture_directory)
+                               if file_name.endswith('.html'))
+        links = []
+        for copy in range(self.repeat):
+            suffix = '' if copy == 0 else '&amp;copy=' + str(copy)
+            for fixture_name in fixture_names:
+                links.append('<tr><td><a href="' + base_url + MONSTER_PAGE_ROUTE + '?vo=' + fixture_name + suffix
+                             + '">' + fixture_name + '</a></td></tr>')
+        return ('<!DOCTYPE html><html><body><table id="liste">\n' + '\n'.join(links)
+                + '\n</table></body></html>').encode('utf-8')
+
+    def send_page(self, page, headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AideddFixtureServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def start_fixture_server(port=0, repeat=1, delay_seconds=0.0, failure_rate=0.0, fixture_directory=FIXTURE_DIRECTORY):
+    # Serves from a background thread; port 0 picks a free port. Returns (server, base_url).
+    handler = type('ConfiguredAideddFixtureRequestHandler', (AideddFixtureRequestHandler,),
+                   {'repeat': repeat, 'delay_seconds': delay_seconds, 'failure_rate': failure_rate,
+                    'fixture_directory': fixture_directory})
+    server = AideddFixtureServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:' + str(server.server_address[1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve saved aidedd.org pages locally')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--delay', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, base_url = start_fixture_server(args.port, args.repeat, args.delay, args.failure_rate)
+    print('Serving aidedd fixtures on ' + base_url + MONSTER_INDEX_PATH)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,164 @@
+import re
+from html.parser import HTMLParser
+
+# A lightweight stand-in for BeautifulSoup when parsing aidedd.org monster pages. Only the <div class="bloc"> stat block
+# is ever looked at, so instead of building a tree for the whole page this slices the html at the stat block, feeds just
+# that to the stdlib's event based HTMLParser, and stops as soon as the block closes.
+# StatBlockNode implements the handful of BeautifulSoup methods parse_monster_from_aidedd_html uses (find, find_all,
+# get_text, contents, .h1, str()) with the same semantics, including str() serializing the way BeautifulSoup does, so
+# the parser produces identical monster data with either backend. benchmark_aidedd_parser.py checks that.
+
+# Serialized as <br/> and never given children, same as BeautifulSoup's html builders
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+                 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex',
+                 'nextid', 'spacer'}
+STAT_BLOCK_START_REGEX = re.compile(r'''<div\b[^>]*?\bclass\s*=\s*(?:"(?:[^"]*\s)?bloc(?:\s[^"]*)?"|'(?:[^']*\s)?bloc(?:\s[^']*)?'|bloc\b)''',
+                                    re.IGNORECASE)
+TEXT_ESCAPES = {ord('&'): '&amp;', ord('<'): '&lt;', ord('>'): '&gt;'}
+
+
+class StatBlockNode:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = {}
+        for key, value in attrs:
+            # Like BeautifulSoup: valueless attributes become '', class is a list, and a repeated attribute wins
+            self.attrs[key] = value.split() if key == 'class' and value is not None else (value or '')
+        self.contents = []
+
+    def __getattr__(self, name):
+        # node.h1 is the first h1 below node, as in BeautifulSoup
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.find(name)
+
+    def __matches(self, names, class_):
+        if self.name not in names:
+            return False
+        if class_ is None:
+            return True
+        classes = self.attrs.get('class', [])
+        return class_ in classes or class_ == ' '.join(classes)
+
+    def __descendants(self):
+        for child in self.contents:
+            if isinstance(child, StatBlockNode):
+                yield child
+                yield from child.__descendants()
+
+    def find_all(self, name, class_=None, recursive=True):
+        names = (name,) if isinstance(name, str) else name
+        candidates = self.__descendants() if recursive else (child for child in self.contents
+                                                             if isinstance(child, StatBlockNode))
+        return [node for node in candidates if node.__matches(names, class_)]
+
+    def find(self, name, class_=None):
+        names = (name,) if isinstance(name, str) else name
+        for node in self.__descendants():
+            if node.__matches(names, class_):
+                return node
+        return None
+
+    def get_text(self):
+        return ''.join(self.__strings())
+
+    @property
+    def text(self):
+        return self.get_text()
+
+    def __strings(self):
+        for child in self.contents:
+            if isinstance(child, StatBlockNode):
+                yield from child.__strings()
+            else:
+                yield child
+
+    def __str__(self):
+        serialized = []
+        self.__serialize(serialized)
+        return ''.join(serialized)
+
+    def __serialize(self, serialized):
+        serialized.append('<' + self.name)
+        for key, value in self.attrs.items():
+            if isinstance(value, list):
+                value = ' '.join(value)
+            serialized.append(' ' + key + '=' + quote_attribute_value(value))
+        if self.name in VOID_ELEMENTS:
+            serialized.append('/>')
+            return
+        serialized.append('>')
+        for child in self.contents:
+            if isinstance(child, StatBlockNode):
+                child.__serialize(serialized)
+            else:
+                serialized.append(child.translate(TEXT_ESCAPES))
+        serialized.append('</' + self.name + '>')
+
+
+def quote_attribute_value(value):
+    value = value.translate(TEXT_ESCAPES)
+    if '"' not in value:
+        return '"' + value + '"'
+    if "'" not in value:
+        return "'" + value + "'"
+    return '"' + value.replace('"', '&quot;') + '"'
+
+
+class StatBlockComplete(Exception):
+    pass
+
+
+class StatBlockBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stat_block = None
+        self.open_nodes = []
+
+    def handle_starttag(self, tag, attrs):
+        node = StatBlockNode(tag, attrs)
+        if self.stat_block is None:
+            self.stat_block = node
+        else:
+            self.open_nodes[-1].contents.append(node)
+        if tag in VOID_ELEMENTS:
+            return
+        self.open_nodes.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Close everything up to the most recent open tag with this name; a stray end tag is ignored
+        for depth in range(len(self.open_nodes) - 1, -1, -1):
+            if self.open_nodes[depth].name == tag:
+                del self.open_nodes[depth:]
+                if not self.open_nodes:
+                    raise StatBlockComplete()
+                return
+
+    def handle_data(self, data):
+        if not self.open_nodes:
+            return
+        contents = self.open_nodes[-1].contents
+        # Adjacent text is a single string in BeautifulSoup too, which matters for contents[0] and friends
+        if contents and isinstance(contents[-1], str):
+            contents[-1] += data
+        else:
+            contents.append(data)
+
+
+def parse_stat_block(monster_raw_html):
+    # Returns the <div class="bloc"> of an aidedd.org monster page as a StatBlockNode
+    stat_block_start = STAT_BLOCK_START_REGEX.search(monster_raw_html)
+    if stat_block_start is None:
+        raise Exception('No stat block found!')
+    builder = StatBlockBuilder()
+    try:
+        builder.feed(monster_raw_html[stat_block_start.start():])
+        builder.close()
+    except StatBlockComplete:
+        pass
+    return builder.stat_block
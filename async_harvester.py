@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+from harvest_cache import HarvestCheckpoint, ResponseCache, get_page_hash
+from harvest_monster_data import AIDEDD_BASE_URL, MONSTER_INDEX_PATH, PARSE_BACKENDS, get_urls_from_index_html, \
+    parse_monster_from_aidedd_html
+
+# Usage: python async_harvester.py [--base-url https://www.aidedd.org] [--output monster_data.json] [--concurrency 8]
+#                                  [--rate 4] [--limit N] [--parse-workers N] [--cache harvest_cache]
+#                                  [--checkpoint harvest_checkpoint.jsonl] [--resume] [--parse-backend stat_block]
+# Concurrent replacement for the sequential loop in harvest_monster_data.py. Pages are fetched through a bounded
+# connection pool, throttled by a token bucket (--rate requests/second, shared by every connection) rather than a fixed
+# sleep per page, retried with exponential backoff, and parsed in a process pool so BeautifulSoup doesn't stall the
+# event loop. Point --base-url at aidedd_fixture_server.py to try it locally.
+# Responses are cached on disk and revalidated with If-None-Match/If-Modified-Since, and every parsed monster is appended
+# to the checkpoint as soon as it's done, so a rerun only reparses pages whose html changed. --resume goes further and
+# doesn't request pages that are already in the checkpoint at all.
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+REQUEST_TIMEOUT_SECONDS = 30.0
+# Worth another try: the server is overloaded or asking us to slow down. Anything else (404, ...) won't get better.
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    # Allows bursts of up to `capacity` requests, then settles at `rate` requests per second
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HarvestError(Exception):
+    pass
+
+
+def get_backoff_seconds(attempt, retry_after=None):
+    # Full jitter, so workers that failed together don't all retry together
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+async def fetch_page(session, token_bucket, url, statistics, response_cache=None):
+    cached_page = response_cache.load(url) if response_cache is not None else None
+    headers = response_cache.get_conditional_headers(url) if cached_page is not None else {}
+    for attempt in range(MAX_ATTEMPTS):
+        await token_bucket.acquire()
+        retry_after = None
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and cached_page is not None:
+                    statistics['not_modified'] += 1
+                    return cached_page
+                if response.status == 200:
+                    page = await response.text()
+                    if response_cache is not None:
+                        response_cache.store(url, page, response.headers.get('ETag'),
+                                             response.headers.get('Last-Modified'))
+                    return page
+                if response.status not in RETRYABLE_STATUSES:
+                    raise HarvestError('HTTP ' + str(response.status) + ' for ' + url)
+                if response.headers.get('Retry-After', '').isdigit():
+                    retry_after = float(response.headers['Retry-After'])
+                failure = 'HTTP ' + str(response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            failure = type(e).__name__ + ': ' + str(e)
+        if attempt + 1 < MAX_ATTEMPTS:
+            statistics['retries'] += 1
+            await asyncio.sleep(get_backoff_seconds(attempt, retry_after))
+    raise HarvestError(failure + ' for ' + url + ' after ' + str(MAX_ATTEMPTS) + ' attempts')
+
+
+async def harvest_worker(session, token_bucket, parse_executor, url_queue, results, statistics, response_cache,
+                         checkpoint, parse_backend):
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            index, url = url_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        try:
+            monster_raw_html = await fetch_page(session, token_bucket, url, statistics, response_cache)
+            statistics['bytes'] += len(monster_raw_html)
+            page_hash = get_page_hash(monster_raw_html)
+            monster_data = checkpoint.get(url, page_hash) if checkpoint is not None else None
+            if monster_data is not None:
+                statistics['unchanged'] += 1
+            else:
+                monster_data = await loop.run_in_executor(parse_executor, parse_monster_from_aidedd_html,
+                                                          monster_raw_html, parse_backend)
+                if checkpoint is not None:
+                    checkpoint.append(url, page_hash, monster_data)
+            results[index] = monster_data
+            statistics['read'] += 1
+            print('Successfully read: ' + url)
+        except Exception as e:
+            statistics['failed'] += 1
+            statistics['failures'].append({'url': url, 'error': str(e)})
+            print('Error reading: ' + url)
+            if not isinstance(e, HarvestError):
+                traceback.print_exc()
+
+
+async def harvest(base_url=AIDEDD_BASE_URL, concurrency=8, rate=4.0, limit=None, parse_workers=None, urls=None,
+                  response_cache=None, checkpoint=None, resume=False, parse_backend='stat_block'):
+    # Returns (monster_json, statistics); monster_json is in index order and leaves out pages that failed
+    statistics = {'urls': 0, 'read': 0, 'failed': 0, 'retries': 0, 'bytes': 0, 'not_modified': 0, 'unchanged': 0,
+                  'skipped': 0, 'failures': []}
+    token_bucket = TokenBucket(rate)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS)
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        if urls is None:
+            urls = get_urls_from_index_html(await fetch_page(session, token_bucket, base_url + MONSTER_INDEX_PATH,
+                                                             statistics, response_cache), base_url)
+        if limit is not None:
+            urls = urls[:limit]
+        statistics['urls'] = len(urls)
+
+        url_queue = asyncio.Queue()
+        results = [None] * len(urls)
+        for index, url in enumerate(urls):
+            if resume and checkpoint is not None and checkpoint.get(url) is not None:
+                results[index] = checkpoint.get(url)
+                statistics['skipped'] += 1
+            else:
+                url_queue.put_nowait((index, url))
+        if not url_queue.empty():
+            with ProcessPoolExecutor(max_workers=parse_workers) as parse_executor:
+                await asyncio.gather(*[harvest_worker(session, token_bucket, parse_executor, url_queue, results,
+                                                      statistics, response_cache, checkpoint, parse_backend)
+                                       for _ in range(concurrency)])
+
+    statistics['elapsed_seconds'] = time.perf_counter() - start
+    statistics['pages_per_second'] = statistics['read'] / statistics['elapsed_seconds'] \
+        if statistics['elapsed_seconds'] > 0 else 0.0
+    return [monster_data for monster_data in results if monster_data is not None], statistics
+
+
+def print_statistics(statistics):
+    print('Read ' + str(statistics['read']) + '/' + str(statistics['urls']) + ' pages in '
+          + '{:.2f}'.format(statistics['elapsed_seconds']) + 's ('
+          + '{:.1f}'.format(statistics['pages_per_second']) + ' pages/sec, '
+          + str(statistics['retries']) + ' retries, ' + str(statistics['failed']) + ' failed)')
+    print(str(statistics['not_modified']) + ' not modified, ' + str(statistics['unchanged']) + ' unchanged, '
+          + str(statistics['skipped']) + ' skipped (already checkpointed)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Harvest monster data from aidedd.org concurrently')
+    parser.add_argument('--base-url', default=AIDEDD_BASE_URL)
+    parser.add_argument('--output', default='monster_data.json')
+    parser.add_argument('--concurrency', type=int, default=8, help='maximum open connections')
+    parser.add_argument('--rate', type=float, default=4.0, help='maximum requests per second')
+    parser.add_argument('--limit', type=int, help='only harvest the first N monsters in the index')
+    parser.add_argument('--parse-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--cache', default='harvest_cache', help='directory for cached responses')
+    parser.add_argument('--checkpoint', default='harvest_checkpoint.jsonl')
+    parser.add_argument('--parse-backend', choices=PARSE_BACKENDS, default='stat_block')
+    parser.add_argument('--resume', action='store_true', help="don't re-request pages that are already checkpointed")
+    args = parser.parse_args()
+
+    checkpoint = HarvestCheckpoint(args.checkpoint)
+    try:
+        monster_json, statistics = asyncio.run(harvest(args.base_url, args.concurrency, args.rate, args.limit,
+                                                       args.parse_workers, response_cache=ResponseCache(args.cache),
+                                                       checkpoint=checkpoint, resume=args.resume,
+                                                       parse_backend=args.parse_backend))
+    finally:
+        checkpoint.close()
+    with open(args.output, 'w') as output_file:
+        json.dump(monster_json, output_file, sort_keys=True, indent=4)
+    print_statistics(statistics)
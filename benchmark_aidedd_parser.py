@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from fractions import Fraction
+from html import escape
+
+from aidedd_fixture_server import FIXTURE_DIRECTORY
+from harvest_monster_data import MONSTER_PAGE_PATH, PARSE_BACKENDS, PSB_CONSTANT, parse_monster_from_aidedd_html
+
+# Usage: python benchmark_aidedd_parser.py [--fixtures aidedd_fixtures] [--harvested aidednd_data/monster_data.json]
+#                                          [--harvest-cache harvest_cache] [--sample N] [--repetitions 3]
+# Checks that every parse backend produces the same monster data for each page, then reports throughput. The pages are:
+#   the saved fixture pages
+#   every harvested monster (aidednd_data/monster_data.json) rendered back into an aidedd stat block, so the check
+#   covers everything the harvest ran into: saves, skills, resistance phrases, hover speeds, plus damage, multiattacks
+#   the monster pages in the harvester's response cache (see harvest_cache.ResponseCache), i.e. real aidedd pages, if
+#   there is one; the cache also holds the monster index, which isn't a stat block and is left out
+# A rendered page has to parse (with 'soup') back into exactly the monster it was rendered from, or it doesn't stand for
+# that monster and the check fails. --sample checks a random sample of the harvested and cached pages instead of all.
+
+ABILITY_SCORES = ['str', 'dex', 'con', 'int', 'wis', 'cha']
+NUMBER_NAMES = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten']
+
+
+def load_pages(fixture_directory):
+    pages = {}
+    for file_name in sorted(os.listdir(fixture_directory)):
+        if file_name.endswith('.html'):
+            with open(os.path.join(fixture_directory, file_name), 'r', encoding='utf-8') as page_file:
+                pages[file_name] = page_file.read()
+    return pages
+
+
+def load_cached_monster_pages(cache_location):
+    # Cached bodies are named after a hash of their url, so the url in each entry's metadata says what the page is
+    pages = {}
+    for file_name in sorted(os.listdir(cache_location)):
+        if not file_name.endswith('.json'):
+            continue
+        entry_location = os.path.join(cache_location, file_name[:-len('.json')])
+        try:
+            with open(entry_location + '.json', 'r') as metadata_file:
+                url = json.load(metadata_file)['url']
+            if MONSTER_PAGE_PATH not in url:
+                continue
+            with open(entry_location + '.html', 'r', encoding='utf-8') as page_file:
+                pages[url.split(MONSTER_PAGE_PATH, 1)[1]] = page_file.read()
+        except (OSError, ValueError, KeyError):
+            # A half-written entry is a cache miss to the harvester, so it's nothing to check here either
+            continue
+    return pages
+
+
+def load_harvested_monster_data(monster_data_location):
+    with open(monster_data_location, 'r', encoding='utf-8') as monster_data_file:
+        return {monster_datum['name']: monster_datum for monster_datum in json.load(monster_data_file)}
+
+
+def load_harvested_pages(monster_data_location):
+    # One rendered page per harvested monster, keyed by its name
+    return {name: render_aidedd_page(monster_datum)
+            for name, monster_datum in load_harvested_monster_data(monster_data_location).items()}
+
+
+def sample_pages(pages, sample_size, seed=42):
+    if sample_size is None or sample_size >= len(pages):
+        return pages
+    return {key: pages[key] for key in sorted(random.Random(seed).sample(sorted(pages), sample_size))}
+
+
+def render_aidedd_page(monster_datum):
+    # The inverse of parse_monster_from_aidedd_html, laid out like the pages in aidedd_fixtures
+    red = ('<strong>Armor Class</strong> ' + str(monster_datum['armor_class']) + '<br><strong>Hit Points</strong> '
+           + str(monster_datum['hit_points']) + '<br><strong>Speed</strong> '
+           + ', '.join(__render_speed(speed) for speed in monster_datum['movement_options']) + '<br>')
+    for ability_score in ABILITY_SCORES:
+        score = monster_datum['attributes'][ability_score]
+        red += ('<div class="carac"><strong>' + ability_score.upper() + '</strong><br>' + str(score) + ' ('
+                + format((score - 10) // 2, '+d') + ')</div>')
+    red += '<div class="sansSerifBold"></div>'
+    for key, label in (('saving_throws', 'Saving Throws'), ('skills', 'Skills')):
+        if key in monster_datum:
+            red += ('<strong>' + label + '</strong> '
+                    + ', '.join(name.capitalize() + ' ' + format(bonus, '+d')
+                                for name, bonus in monster_datum[key].items()) + '<br>')
+    for key, label in (('damage_vulnerabilities', 'Damage Vulnerabilities'),
+                       ('damage_resistances', 'Damage Resistances'),
+                       ('damage_immunities', 'Damage Immunities'),
+                       ('condition_immunities', 'Condition Immunities'),
+                       ('senses', 'Senses'),
+                       ('languages', 'Languages')):
+        if key in monster_datum:
+            red += '<strong>' + label + '</strong> ' + escape(__join_list(monster_datum[key]), False) + '<br>'
+    red += ('<strong>Challenge</strong> ' + str(Fraction(monster_datum['challenge']).limit_denominator(8))
+            + ' (0 XP)<br>')
+
+    paragraphs = [__render_paragraph(name, feature['description'])
+                  for name, feature in monster_datum['features'].items()]
+    paragraphs.append('<div class="rub">Actions</div>')
+    for action in monster_datum['actions'].values():
+        if action['type'] == 'multi_attack':
+            paragraphs.append(__render_paragraph('Multiattack', __render_multiattack(monster_datum['name'], action)))
+        else:
+            paragraphs.append(__render_paragraph(action['name'], __render_attack(action)))
+
+    return ('<!DOCTYPE html>\n<html lang="en">\n<head><meta charset="utf-8"><title>' + escape(monster_datum['name'])
+            + ' - Monsters - D&amp;D 5e</title></head>\n<body>\n<div class="col1">\n<div class="bloc"><h1>'
+            + escape(monster_datum['name'], False) + '</h1><div class="type">' + monster_datum['size'].capitalize()
+            + ' ' + escape(monster_datum['family'], False) + ', ' + monster_datum['alignment'] + '</div>\n'
+            + '<div class="red">' + red + '</div>\n<div class="sansSerif">\n' + '\n'.join(paragraphs)
+            + '\n</div></div>\n</div>\n</body>\n</html>\n')
+
+
+def __render_speed(speed):
+    text = ('' if speed['type'] == 'walk' else speed['type'] + ' ') + str(speed['speed']) + ' ft.'
+    return text + (' ' + speed['note'] if speed['note'] else '')
+
+
+def __join_list(entries):
+    # Bludgeoning, piercing, and slashing phrases are set apart with a semicolon, the way aidedd writes them
+    plain_entries = [entry for entry in entries if PSB_CONSTANT not in entry]
+    phrase_entries = [entry for entry in entries if PSB_CONSTANT in entry]
+    return '; '.join(([', '.join(plain_entries)] if plain_entries else []) + phrase_entries)
+
+
+def __render_paragraph(name, text):
+    return '<p><strong><em>' + escape(name, False) + '</em></strong>. ' + escape(text, False) + '</p>'
+
+
+def __render_attack(attack):
+    text = (attack['attack_type'].capitalize() + ' Weapon Attack: ' + format(attack['to_hit'], '+d') + ' to hit, reach '
+            + str(attack['reach']) + ' ft., ' + attack['target'] + '. Hit: ' + str(attack['expected_damage']) + ' ('
+            + attack['damage_string'] + ') ' + attack['damage_type'] + ' damage')
+    if 'secondary_damage_string' in attack:
+        text += (' plus ' + str(attack['secondary_expected_damage']) + ' (' + attack['secondary_damage_string'] + ') '
+                 + attack['secondary_damage_type'] + ' damage')
+    if not attack['additional']:
+        return text + '.'
+    # 'additional' is the text after the damage minus its two separator characters, cut short at the first character
+    # the attack regex doesn't take (e.g. the '+' in "(9d6 + 1)"). Every character it kept is one the regex takes, so
+    # it reads back the same whether or not it was cut short; a sentence starts after '. ', a clause after ', '
+    return text + ('. ' if attack['additional'][0].isupper() else ', ') + attack['additional']
+
+
+def __render_multiattack(name, multi_attack):
+    text = 'The ' + name.lower()
+    attacks = [attack for attack in multi_attack['attacks'] if not attack.get('optional')]
+    optional_attacks = [attack for attack in multi_attack['attacks'] if attack.get('optional')]
+    if optional_attacks:
+        text += ' can use its ' + optional_attacks[0]['attack'] + '. It then'
+    attack_sets = [attacks] + multi_attack.get('alternatives', [])
+    total = sum(attack['quantity'] for attack in attacks)
+    text += ' makes ' + NUMBER_NAMES[total] + ' attacks: '
+    return text + ', or '.join(' and '.join(NUMBER_NAMES[attack['quantity']] + ' with its ' + attack['attack']
+                                            for attack in attack_set) for attack_set in attack_sets) + '.'
+
+
+def check_equivalence(pages):
+    mismatches = 0
+    for page_name, page in pages.items():
+        expected = parse_monster_from_aidedd_html(page, 'soup')
+        for backend in PARSE_BACKENDS:
+            monster_data = parse_monster_from_aidedd_html(page, backend)
+            if monster_data != expected:
+                mismatches += 1
+                print('Mismatch in ' + page_name + ' (' + backend + '):')
+                print('    soup: ' + str(expected))
+                print('    ' + backend + ': ' + str(monster_data))
+    return mismatches
+
+
+def check_round_trip(harvested_pages, monster_data_location):
+    # Rendered pages that don't parse back into the harvested monster they came from
+    harvested_monster_data = load_harvested_monster_data(monster_data_location)
+    failures = 0
+    for name, page in harvested_pages.items():
+        if parse_monster_from_aidedd_html(page, 'soup') != harvested_monster_data[name]:
+            failures += 1
+            print('Rendered page for ' + name + " doesn't parse back into its harvested monster")
+    return failures
+
+
+def time_backend(backend, pages, repetitions):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        for page in pages.values():
+            parse_monster_from_aidedd_html(page, backend)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the aidedd parse backends agree, then time them')
+    parser.add_argument('--fixtures', default=FIXTURE_DIRECTORY)
+    parser.add_argument('--harvested', default='aidednd_data/monster_data.json',
+                        help='harvested monster data to render back into pages')
+    parser.add_argument('--harvest-cache', default='harvest_cache', help='response cache of a real harvest')
+    parser.add_argument('--sample', type=int, help='check this many harvested and cached pages (default: all)')
+    parser.add_argument('--repetitions', type=int, default=3)
+    args = parser.parse_args()
+
+    pages = {}
+    page_counts = []
+    round_trip_failures = 0
+    for label, location, load in (('fixture', args.fixtures, load_pages),
+                                  ('harvested', args.harvested, load_harvested_pages),
+                                  ('cached', args.harvest_cache, load_cached_monster_pages)):
+        if not os.path.exists(location):
+            continue
+        loaded_pages = load(location)
+        if label != 'fixture':
+            loaded_pages = sample_pages(loaded_pages, args.sample)
+        pages.update({label + ':' + page_name: page for page_name, page in loaded_pages.items()})
+        page_counts.append(str(len(loaded_pages)) + ' ' + label)
+        if label == 'harvested':
+            round_trip_failures = check_round_trip(loaded_pages, location)
+            print('Harvested monsters rendered: ' + str(len(loaded_pages)) + ', round trip failures: '
+                  + str(round_trip_failures))
+    if not pages:
+        raise Exception('No aidedd pages to benchmark')
+
+    mismatches = check_equivalence(pages) + round_trip_failures
+    print('Pages: ' + str(len(pages)) + ' (' + ', '.join(page_counts) + '), mismatches: ' + str(mismatches))
+
+    page_parses = len(pages) * args.repetitions
+    elapsed = {}
+    for backend in PARSE_BACKENDS:
+        elapsed[backend] = time_backend(backend, pages, args.repetitions)
+        print(backend + ': ' + format(page_parses / elapsed[backend], '.1f') + ' pages/sec ('
+              + format(elapsed[backend] / page_parses * 1e6, '.1f') + ' us/page)')
+    print('Speedup: ' + format(elapsed['soup'] / elapsed['stat_block'], '.2f') + 'x')
+    if mismatches:
+        sys.exit(1)
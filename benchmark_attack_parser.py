@@ -0,0 +1,142 @@
+import json
+import re
+import sys
+import time
+
+from dice_expression import get_dice_cache_statistics
+from five_e_tools_attack_parser import parse_attack_entry
+from monster_data_utilities import get_expected_damage_from_dice_string
+
+# Usage: python benchmark_attack_parser.py [5etools_data/beastiary.json] [repetitions]
+# Compares the single-pass attack tokenizer against the old four-regex chain, per monster.
+
+
+def legacy_attack_features(attack_entry):
+    # The regex chain FiveEToolsJSONWrapper.__get_attack_features used to run, kept verbatim as the baseline
+    attack_features = {}
+    attack_features['name'] = attack_entry['name']
+
+    to_hit_regex = r'{@hit ([0-9]+)}'
+    to_hit_result = re.search(to_hit_regex, attack_entry['entries'][0])
+    if to_hit_result:
+        attack_features['to_hit'] = int(to_hit_result.group(1))
+
+    attack_type_regex = r'{@atk ([A-z]+)}'
+    attack_type_result = re.search(attack_type_regex, attack_entry['entries'][0])
+    if attack_type_result:
+        attack_features['type'] = attack_type_result.group(1)
+
+    reach_regex = r'reach ([0-9]+)/?([0-9]+)? ft\.,'
+    reach_result = re.search(reach_regex, attack_entry['entries'][0])
+    if reach_result:
+        attack_features['range'] = int(reach_result.group(1))
+
+    damage_regex = r'(takes|or|plus|\{\@h\}) ?([0-9]+) ?(?:\(\{@damage ([d0-9\+\- ]+)\}(?: plus \{@damage ([d0-9\+\- ]+)\})?\))? ([A-z]+)? ?damage'
+    damage_results = re.findall(damage_regex, attack_entry['entries'][0])
+    if damage_results:
+        damage_entries = []
+        for damage_result in damage_results:
+            clause = damage_result[0]
+            if damage_result[2]:
+                expected_damage = get_expected_damage_from_dice_string(damage_result[2])
+            else:
+                expected_damage = int(damage_result[1])
+            if damage_result[3]:
+                expected_damage = expected_damage + get_expected_damage_from_dice_string(damage_result[3])
+            damage_entry = {
+                'expected_damage': expected_damage,
+                'damage_type': damage_result[4]
+            }
+            if clause == 'or':
+                if len(damage_entries) == 0:
+                    raise Exception('An attack damage entry has an or clause with no preceding entry: ' + attack_entry['entries'][0])
+                if damage_entries[-1]['expected_damage'] > damage_entry['expected_damage']:
+                    damage_entries[-1] = damage_entry
+            else:
+                damage_entries.append(damage_entry)
+        attack_features['damage_entries'] = damage_entries
+    return attack_features
+
+
+def load_monster_actions(monster_data_location):
+    with open(monster_data_location, 'r') as monster_data_file:
+        raw_monster_data = json.load(monster_data_file)
+    if isinstance(raw_monster_data, dict):
+        raw_monster_data = [raw_monster_data]
+    monster_actions = []
+    for raw_monster_datum in raw_monster_data:
+        actions = [action for action in raw_monster_datum.get('action', [])
+                   if 'entries' in action and action['entries'] and isinstance(action['entries'][0], str)]
+        if actions:
+            monster_actions.append(actions)
+    return monster_actions
+
+
+def load_regex_note_actions():
+    # Every example in regex_notes.md is an attack entry we've had trouble with at some point
+    with open('regex_notes.md', 'r') as regex_notes_file:
+        examples = [line.strip() for line in regex_notes_file if '{@' in line]
+    return [[{'name': 'Example ' + str(index), 'entries': [example]}] for index, example in enumerate(examples)]
+
+
+def time_parser(parser, monster_actions, repetitions):
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        for actions in monster_actions:
+            for action in actions:
+                parser(action)
+    return time.perf_counter() - start
+
+
+def check_equivalence(monster_actions):
+    mismatches = 0
+    for actions in monster_actions:
+        for action in actions:
+            try:
+                expected = legacy_attack_features(action)
+            except Exception:
+                continue
+            actual = parse_attack_entry(action)
+            actual.pop('dc', None)  # The legacy chain never extracted save DCs
+            if expected != actual:
+                mismatches += 1
+                print('Mismatch for ' + action['entries'][0])
+                print('  legacy: ' + str(expected))
+                print('  single: ' + str(actual))
+    return mismatches
+
+
+def skip_unparseable(monster_actions):
+    # Both parsers raise on the same malformed 'or' clauses; leave those out of the timing loop
+    parseable = []
+    for actions in monster_actions:
+        try:
+            for action in actions:
+                legacy_attack_features(action)
+            parseable.append(actions)
+        except Exception:
+            pass
+    return parseable
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        monster_actions = load_monster_actions(sys.argv[1])
+    else:
+        monster_actions = load_monster_actions('evaluate.json') + load_regex_note_actions()
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    monster_actions = skip_unparseable(monster_actions)
+    if not monster_actions:
+        raise Exception('No 5etools attack entries to benchmark')
+
+    mismatches = check_equivalence(monster_actions)
+    print('Monsters: ' + str(len(monster_actions)) + ', actions: ' + str(sum(map(len, monster_actions))))
+    print('Mismatches: ' + str(mismatches))
+
+    monster_parses = len(monster_actions) * repetitions
+    legacy_time = time_parser(legacy_attack_features, monster_actions, repetitions)
+    single_pass_time = time_parser(parse_attack_entry, monster_actions, repetitions)
+    print('Legacy regex chain: ' + format(legacy_time / monster_parses * 1e6, '.2f') + ' us/monster')
+    print('Single-pass tokenizer: ' + format(single_pass_time / monster_parses * 1e6, '.2f') + ' us/monster')
+    print('Speedup: ' + format(legacy_time / single_pass_time, '.2f') + 'x')
+    print('Dice cache: ' + str(get_dice_cache_statistics()))
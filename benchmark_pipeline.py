@@ -0,0 +1,239 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # Optional; memory is read from /proc/self/statm without it (and not reported at all elsewhere)
+    psutil = None
+
+from bestiary_stream import stream_monster_records_from_file
+from dice_expression import clear_dice_cache, get_dice_cache_statistics
+from feature_matrix import build_feature_matrix, build_record_feature_matrix
+from monster_data_utilities import get_expected_damage_from_dice_string
+from parallel_feature_matrix import build_feature_matrix_parallel
+from regression import fit_to_data, parse_monster_data_from_file
+from synthetic_bestiary import DIE_SIZES, write_bestiary
+
+# Usage: python benchmark_pipeline.py [--sizes 1000 10000 100000] [--fit-limit 10000] [--output benchmark.json]
+#                                     [--compare previous_benchmark.json]
+# Times each stage of the training pipeline on synthetic bestiaries (see synthetic_bestiary.py) and writes one JSON
+# report per run: {'commit', 'python', 'sizes': {size: {stage: {'seconds', 'items', 'items_per_second',
+# 'rss_delta_mb', 'peak_rss_delta_mb'}}}}, with the dice parser's stages under the 'dice' size. Run it on two commits
+# with the same arguments and --compare the reports to catch regressions.
+# Both memory numbers are relative to the resident set size when the stage started: rss_delta_mb is what the stage
+# left behind (its result included), peak_rss_delta_mb the most it used at any point, sampled every RSS_SAMPLE_SECONDS
+# on a background thread. Python doesn't always hand freed memory back to the OS, so a stage can inherit headroom from
+# an earlier one and report less than it allocated.
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+# MLPRegressor.fit is by far the slowest stage, so it only sees the first fit_limit monsters of each size
+DEFAULT_FIT_LIMIT = 10000
+DICE_STRING_COUNT = 100000
+# A ratio above this against the compared report is flagged
+REGRESSION_THRESHOLD = 1.1
+# Stages quicker than this in both reports are mostly timer noise, so they're shown but never flagged
+MIN_FLAGGED_SECONDS = 0.05
+RSS_SAMPLE_SECONDS = 0.005
+
+
+def get_rss_mb():
+    # The current resident set size, or None where there's no way to read it
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024.0 * 1024.0)
+    try:
+        with open('/proc/self/statm', 'r') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RSSSampler:
+    # Tracks the resident set size while a stage runs: at the start, at the end and the highest sample in between
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.start_rss = None
+        self.end_rss = None
+        self.peak_rss = None
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = get_rss_mb()
+        if self.start_rss is not None:
+            self.sampler = threading.Thread(target=self.__sample, name='rss-sampler', daemon=True)
+            self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if self.sampler is not None:
+            self.stopped.set()
+            self.sampler.join()
+            self.end_rss = get_rss_mb()
+            self.peak_rss = max(self.peak_rss, self.end_rss)
+        return False
+
+    def __sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, get_rss_mb())
+
+    def get_deltas(self):
+        # (rss_delta_mb, peak_rss_delta_mb), both None if the RSS couldn't be read
+        if self.end_rss is None:
+            return None, None
+        return round(self.end_rss - self.start_rss, 1), round(self.peak_rss - self.start_rss, 1)
+
+
+def run_stage(results, stage, items, function, *args):
+    # The pipeline prints per-monster progress and failures; none of that belongs in a benchmark
+    gc.collect()
+    with contextlib.redirect_stdout(io.StringIO()), RSSSampler() as rss_sampler:
+        start = time.perf_counter()
+        value = function(*args)
+        seconds = time.perf_counter() - start
+    item_count = items if isinstance(items, int) else items(value)
+    rss_delta, peak_rss_delta = rss_sampler.get_deltas()
+    results[stage] = {
+        'seconds': round(seconds, 4),
+        'items': item_count,
+        'items_per_second': round(item_count / seconds, 1) if seconds > 0 else None,
+        'rss_delta_mb': rss_delta,
+        'peak_rss_delta_mb': peak_rss_delta
+    }
+    line = '  ' + stage.ljust(30) + format(seconds, '9.3f') + 's ' + str(item_count).rjust(8) + ' items'
+    if rss_delta is not None:
+        line += format(rss_delta, '+9.1f') + 'MB (peak ' + format(peak_rss_delta, '+.1f') + 'MB)'
+    print(line)
+    return value
+
+
+def get_dice_strings(count):
+    # Roughly the spread of dice strings real stat blocks use: a few hundred distinct ones, heavily repeated
+    dice_strings = []
+    for index in range(count):
+        dice_count = index % 7 + 1
+        dice_faces = DIE_SIZES[index // 7 % len(DIE_SIZES)]
+        modifier = index // 35 % 9
+        dice_string = str(dice_count) + 'd' + str(dice_faces)
+        dice_strings.append(dice_string + ' + ' + str(modifier) if modifier else dice_string)
+    return dice_strings
+
+
+def get_expected_damages(dice_strings):
+    return [get_expected_damage_from_dice_string(dice_string) for dice_string in dice_strings]
+
+
+def get_features_arrays(monster_data):
+    features_arrays = []
+    for monster_datum in monster_data:
+        try:
+            features_arrays.append(monster_datum.get_features_array())
+        except Exception:
+            pass
+    return features_arrays
+
+
+def benchmark_size(size, fit_limit, seed, working_directory, workers=None):
+    print('Benchmarking ' + str(size) + ' monsters')
+    results = {}
+    bestiary_location = os.path.join(working_directory, 'bestiary_' + str(size) + '.json')
+    run_stage(results, 'generate', size, write_bestiary, bestiary_location, size, seed)
+
+    monster_data = run_stage(results, 'parse_monster_data', len, parse_monster_data_from_file, bestiary_location)
+    run_stage(results, 'get_features_array', len(monster_data), get_features_arrays, monster_data)
+    run_stage(results, 'build_feature_matrix', lambda matrix: len(matrix[0]), build_feature_matrix, monster_data)
+    run_stage(results, 'build_feature_matrix_parallel', lambda matrix: len(matrix[0]), build_feature_matrix_parallel,
+              monster_data, None, workers)
+    del monster_data
+
+    monster_records = run_stage(results, 'stream_monster_records', len,
+                                lambda location: list(stream_monster_records_from_file(location)), bestiary_location)
+    run_stage(results, 'build_record_matrix', lambda matrix: len(matrix[0]), build_record_feature_matrix,
+              monster_records)
+    run_stage(results, 'fit_to_data', min(size, fit_limit), fit_to_data, monster_records[:fit_limit])
+    del monster_records
+    os.remove(bestiary_location)
+    return results
+
+
+def benchmark_dice(dice_string_count):
+    print('Benchmarking ' + str(dice_string_count) + ' dice strings')
+    results = {}
+    dice_strings = get_dice_strings(dice_string_count)
+    clear_dice_cache()
+    # Cold is every distinct string parsed once plus cache hits for the repeats; warm is all hits
+    run_stage(results, 'dice_cold', dice_string_count, get_expected_damages, dice_strings)
+    run_stage(results, 'dice_warm', dice_string_count, get_expected_damages, dice_strings)
+    results['dice_warm']['cache'] = get_dice_cache_statistics()
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(previous_report, report, threshold=REGRESSION_THRESHOLD):
+    # Prints new/old seconds for every stage both reports have; returns the stages that got slower than threshold
+    regressions = []
+    print('Compared with ' + str(previous_report.get('commit')) + ' (new/old seconds):')
+    for size, stages in report['sizes'].items():
+        previous_stages = previous_report['sizes'].get(size, {})
+        for stage, result in stages.items():
+            if stage not in previous_stages or not previous_stages[stage]['seconds']:
+                continue
+            ratio = result['seconds'] / previous_stages[stage]['seconds']
+            flag = ''
+            if ratio > threshold and max(result['seconds'], previous_stages[stage]['seconds']) >= MIN_FLAGGED_SECONDS:
+                flag = '  REGRESSION'
+                regressions.append((size, stage, ratio))
+            print('  ' + size.rjust(8) + ' ' + stage.ljust(30) + format(ratio, '6.2f') + 'x' + flag)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the feature extraction and training pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--fit-limit', type=int, default=DEFAULT_FIT_LIMIT)
+    parser.add_argument('--dice-strings', type=int, default=DICE_STRING_COUNT)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, help='Processes for build_feature_matrix_parallel (default: all cores)')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='An earlier report to compare against')
+    args = parser.parse_args()
+
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'fit_limit': args.fit_limit,
+        'seed': args.seed,
+        'workers': args.workers or os.cpu_count(),
+        'sizes': {}
+    }
+    with tempfile.TemporaryDirectory() as working_directory:
+        for size in args.sizes:
+            report['sizes'][str(size)] = benchmark_size(size, args.fit_limit, args.seed, working_directory,
+                                                        args.workers)
+    report['sizes']['dice'] = benchmark_dice(args.dice_strings)
+
+    with open(args.output, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    print('Wrote report to: ' + args.output)
+
+    if args.compare:
+        with open(args.compare, 'r') as previous_report_file:
+            regressions = compare_reports(json.load(previous_report_file), report)
+        if regressions:
+            raise Exception(str(len(regressions)) + ' stage(s) regressed by more than '
+                            + format((REGRESSION_THRESHOLD - 1) * 100, '.0f') + '%')
@@ -0,0 +1,234 @@
+import argparse
+import gc
+import glob
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import msgpack
+except ImportError:  # Optional; the corpus falls back to pickle
+    msgpack = None
+
+from bestiary_stream import stream_monster_data
+from copy_resolver import get_monster_key
+
+# Usage: python bestiary_ingest.py [5etools_data] [--output 5etools_data/bestiary_corpus.msgpack] [--workers N]
+# Upstream 5etools ships one bestiary-<source>.json per book, each {"monster": [...]}. This finds all of them in a
+# directory, parses them across a process pool, drops repeated (name, source) monsters (the first file in name order
+# wins) and writes one binary corpus: msgpack if it's installed, pickle otherwise. The corpus records the size and
+# mtime of every file it was built from, so load_monster_data_from_directory only re-ingests when one changes, and
+# its index maps 'name|source' to the monster's position for single lookups (get_corpus_monster).
+# The monsters are stored raw; filtering and '_copy' resolution happen on load exactly as for a single file, so copies
+# can reference monsters from other books.
+# Each worker packs its file's monsters itself and sends back only those bytes and the monsters' keys, so the parent
+# dedups and indexes by key and writes the packed shards straight into the corpus without ever unpickling a monster.
+# Duplicates are left in their shard and skipped when the corpus is unpacked. --time-serial ingests a second time in
+# one process to check the pool is worth it.
+
+BESTIARY_FILE_PATTERN = 'bestiary-*.json'
+CORPUS_VERSION = 2
+CORPUS_FILE_NAME = 'bestiary_corpus.msgpack' if msgpack is not None else 'bestiary_corpus.pickle'
+SHARD_FORMAT = 'msgpack' if msgpack is not None else 'pickle'
+
+
+def find_bestiary_files(bestiary_directory):
+    return sorted(glob.glob(os.path.join(bestiary_directory, BESTIARY_FILE_PATTERN)))
+
+
+def get_file_signatures(bestiary_locations):
+    signatures = []
+    for bestiary_location in bestiary_locations:
+        bestiary_stat = os.stat(bestiary_location)
+        signatures.append([os.path.basename(bestiary_location), bestiary_stat.st_size, bestiary_stat.st_mtime_ns])
+    return signatures
+
+
+def get_bestiary_signature(monster_data_location):
+    # Changes whenever the bestiary does: the size and mtime of the combined file, or of every bestiary file in a
+    # directory (a directory's own mtime doesn't change when a file in it is edited in place)
+    if os.path.isdir(monster_data_location):
+        return ';'.join(name + ':' + str(size) + ':' + str(mtime_ns) for name, size, mtime_ns
+                        in get_file_signatures(find_bestiary_files(monster_data_location)))
+    bestiary_stat = os.stat(monster_data_location)
+    return str(bestiary_stat.st_size) + ':' + str(bestiary_stat.st_mtime_ns)
+
+
+def get_corpus_key(name, source):
+    return '|'.join(get_monster_key({'name': name, 'source': source}))
+
+
+def __read_bestiary_file(bestiary_location):
+    # Returns ([(name, source) key per monster], the monsters packed as SHARD_FORMAT)
+    with open(bestiary_location, 'r', encoding='utf-8') as bestiary_file:
+        bestiary = json.load(bestiary_file)
+    if isinstance(bestiary, list):  # A hand-combined file like beastiary.json
+        monsters = bestiary
+    else:
+        monsters = bestiary.get('monster', [])
+    if SHARD_FORMAT == 'msgpack':
+        shard = msgpack.packb(monsters, use_bin_type=True)
+    else:
+        shard = pickle.dumps(monsters, protocol=pickle.HIGHEST_PROTOCOL)
+    return ['|'.join(get_monster_key(raw_monster_datum)) for raw_monster_datum in monsters], shard
+
+
+def ingest_bestiary_files(bestiary_locations, workers=None):
+    # Returns (shards, duplicates, index, statistics): one packed shard per file, the positions in each shard of the
+    # monsters whose (name, source) an earlier file already had, and 'name|source' -> position among the kept monsters
+    start = time.perf_counter()
+    if workers == 1 or len(bestiary_locations) <= 1:
+        results = [__read_bestiary_file(bestiary_location) for bestiary_location in bestiary_locations]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(__read_bestiary_file, bestiary_locations))
+
+    shards = []
+    duplicates = []
+    index = {}
+    statistics = {'files': len(bestiary_locations), 'read': 0, 'duplicates': 0}
+    for monster_keys, shard in results:
+        shard_duplicates = []
+        for position, monster_key in enumerate(monster_keys):
+            if monster_key in index:
+                shard_duplicates.append(position)
+            else:
+                index[monster_key] = len(index)
+        shards.append(shard)
+        duplicates.append(shard_duplicates)
+        statistics['read'] += len(monster_keys)
+        statistics['duplicates'] += len(shard_duplicates)
+    statistics['kept'] = len(index)
+    statistics['seconds'] = time.perf_counter() - start
+    return shards, duplicates, index, statistics
+
+
+def build_corpus(shards, duplicates, index, file_signatures):
+    return {
+        'version': CORPUS_VERSION,
+        'files': file_signatures,
+        'shard_format': SHARD_FORMAT,
+        'shards': shards,
+        'duplicates': duplicates,
+        'index': index
+    }
+
+
+def unpack_corpus(corpus):
+    # Replaces the corpus's packed shards with its deduplicated 'monsters', in index order
+    monsters = []
+    for shard, shard_duplicates in zip(corpus.pop('shards'), corpus.pop('duplicates')):
+        if corpus['shard_format'] == 'msgpack':
+            shard_monsters = msgpack.unpackb(shard, raw=False, strict_map_key=False)
+        else:
+            shard_monsters = pickle.loads(shard)
+        if shard_duplicates:
+            skipped_positions = set(shard_duplicates)
+            shard_monsters = [raw_monster_datum for position, raw_monster_datum in enumerate(shard_monsters)
+                              if position not in skipped_positions]
+        monsters += shard_monsters
+    corpus['monsters'] = monsters
+    return corpus
+
+
+def get_corpus_monster(corpus, name, source):
+    # The raw monster from an unpacked corpus, or None
+    position = corpus['index'].get(get_corpus_key(name, source))
+    return corpus['monsters'][position] if position is not None else None
+
+
+def save_corpus(corpus_location, corpus):
+    with open(corpus_location + '.tmp', 'wb') as corpus_file:
+        if corpus_location.endswith('.msgpack'):
+            if msgpack is None:
+                raise Exception('msgpack is not installed; save the corpus as .pickle instead')
+            msgpack.pack(corpus, corpus_file, use_bin_type=True)
+        else:
+            pickle.dump(corpus, corpus_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(corpus_location + '.tmp', corpus_location)
+    print('Saved ' + str(len(corpus['index'])) + ' monsters to corpus: ' + str(corpus_location))
+
+
+def load_corpus(corpus_location, file_signatures=None):
+    # Returns the unpacked corpus (see unpack_corpus), or None if there's no usable one: missing, unreadable, another
+    # layout, packed with msgpack when it isn't installed, or (given file_signatures) built from different bestiary files
+    if not os.path.exists(corpus_location):
+        return None
+    if corpus_location.endswith('.msgpack') and msgpack is None:
+        return None
+    # Unpacking creates hundreds of thousands of dicts and lists, none of them garbage; letting the cyclic collector
+    # keep rescanning them more than doubles the load time
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(corpus_location, 'rb') as corpus_file:
+            if corpus_location.endswith('.msgpack'):
+                corpus = msgpack.unpack(corpus_file, raw=False, strict_map_key=False)
+            else:
+                corpus = pickle.load(corpus_file)
+        if corpus.get('version') != CORPUS_VERSION:
+            return None
+        if file_signatures is not None and corpus['files'] != file_signatures:
+            return None
+        if corpus['shard_format'] == 'msgpack' and msgpack is None:
+            return None
+        return unpack_corpus(corpus)
+    except Exception as e:
+        print('Failed to load corpus from ' + str(corpus_location) + ': ' + str(e))
+        return None
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def get_corpus(bestiary_directory, corpus_location=None, workers=None):
+    # The saved corpus if every bestiary file is unchanged since it was built, otherwise a freshly ingested one
+    corpus_location = corpus_location or os.path.join(bestiary_directory, CORPUS_FILE_NAME)
+    bestiary_locations = find_bestiary_files(bestiary_directory)
+    if not bestiary_locations:
+        raise Exception('No ' + BESTIARY_FILE_PATTERN + ' files in: ' + str(bestiary_directory))
+    file_signatures = get_file_signatures(bestiary_locations)
+    corpus = load_corpus(corpus_location, file_signatures)
+    if corpus is not None:
+        print('Loaded ' + str(len(corpus['monsters'])) + ' monsters from corpus: ' + corpus_location)
+        return corpus
+    shards, duplicates, index, statistics = ingest_bestiary_files(bestiary_locations, workers)
+    print_ingest_statistics(statistics)
+    corpus = build_corpus(shards, duplicates, index, file_signatures)
+    save_corpus(corpus_location, corpus)
+    return unpack_corpus(corpus)
+
+
+def print_ingest_statistics(statistics, label='Ingested'):
+    print(label + ' ' + str(statistics['read']) + ' monsters from ' + str(statistics['files']) + ' files in '
+          + format(statistics['seconds'], '.2f') + 's (' + str(statistics['duplicates']) + ' duplicates dropped)')
+
+
+def load_monster_data_from_directory(bestiary_directory, statistics=None, corpus_location=None, workers=None):
+    # Same FiveEToolsJSONWrappers as stream_monster_data_from_file gives for one combined file
+    corpus = get_corpus(bestiary_directory, corpus_location, workers)
+    return list(stream_monster_data(corpus['monsters'], statistics, progress_interval=0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge a directory of 5etools bestiary files into one corpus')
+    parser.add_argument('bestiary_directory', nargs='?', default='5etools_data')
+    parser.add_argument('--output', help='corpus location (default: ' + CORPUS_FILE_NAME + ' in the directory)')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--lookup', nargs=2, metavar=('NAME', 'SOURCE'), help='print one monster from the corpus')
+    parser.add_argument('--time-serial', action='store_true',
+                        help='ingest again in one process and compare the time with the pool')
+    args = parser.parse_args()
+
+    corpus = get_corpus(args.bestiary_directory, args.output, args.workers)
+    if args.lookup:
+        print(json.dumps(get_corpus_monster(corpus, *args.lookup), indent=2))
+    if args.time_serial:
+        bestiary_locations = find_bestiary_files(args.bestiary_directory)
+        pool_statistics = ingest_bestiary_files(bestiary_locations, args.workers)[3]
+        print_ingest_statistics(pool_statistics, 'Pool (' + str(args.workers or os.cpu_count()) + ' workers):')
+        serial_statistics = ingest_bestiary_files(bestiary_locations, 1)[3]
+        print_ingest_statistics(serial_statistics, 'Serial:')
+        print('Pool speedup: ' + format(serial_statistics['seconds'] / pool_statistics['seconds'], '.2f') + 'x')
@@ -0,0 +1,198 @@
+import json
+import re
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from copy_resolver import CopyResolver, get_monster_key
+from feature_matrix import get_parse_failure
+from five_e_tools_json_wrapper import FiveEToolsJSONWrapper
+from monster_record import MonsterRecord
+from pipeline_instrumentation import count, stage
+
+READ_CHUNK_SIZE = 1 << 20  # 1MB
+PROGRESS_INTERVAL = 1000
+
+SEPARATOR_REGEX = re.compile(r'[\s,]*')
+COPY_ENTRY_REGEX = re.compile(r'"_copy"\s*:\s*')
+# Enough text to hold a '"_copy":' split across two chunks
+COPY_ENTRY_OVERLAP = 64
+
+
+def iterate_raw_monster_data(monster_data_location, chunk_size=READ_CHUNK_SIZE):
+    # Yields the elements of a top-level json array one at a time, holding at most one chunk plus one monster of
+    # text in memory instead of the whole file and every parsed dict
+    decoder = json.JSONDecoder()
+    with open(monster_data_location, 'r', encoding='utf-8') as monster_data_file:
+        buffer = ''
+        position = 0
+        end_of_file = False
+        started = False
+        while True:
+            position = SEPARATOR_REGEX.match(buffer, position).end()
+            if position == len(buffer):
+                if end_of_file:
+                    raise Exception('Unexpected end of file in: ' + str(monster_data_location))
+                buffer, position, end_of_file = __read_chunk(monster_data_file, buffer, position, chunk_size)
+                continue
+            if not started:
+                if buffer[position] != '[':
+                    raise Exception('Expected a json array of monsters in: ' + str(monster_data_location))
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                with stage('json_decode'):
+                    raw_monster_datum, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Most likely the monster runs past the end of the buffer; anything else is a real error
+                if end_of_file:
+                    raise
+                buffer, position, end_of_file = __read_chunk(monster_data_file, buffer, position, chunk_size)
+                continue
+            yield raw_monster_datum
+
+
+def find_copy_targets(monster_data_location, chunk_size=READ_CHUNK_SIZE):
+    # The keys (see get_monster_key) of every monster some '_copy' points at. Scans the raw text and only decodes the
+    # '_copy' objects themselves, which is a lot cheaper than decoding the file twice.
+    decoder = json.JSONDecoder()
+    copy_targets = set()
+    with open(monster_data_location, 'r', encoding='utf-8') as monster_data_file:
+        buffer = ''
+        position = 0
+        end_of_file = False
+        while True:
+            copy_entry_match = COPY_ENTRY_REGEX.search(buffer, position)
+            if copy_entry_match is None:
+                if end_of_file:
+                    return copy_targets
+                # Keep the tail in case it's the start of a '"_copy":'
+                position = max(position, len(buffer) - COPY_ENTRY_OVERLAP)
+                buffer, position, end_of_file = __read_chunk(monster_data_file, buffer, position, chunk_size)
+                continue
+            try:
+                copy_entry, position = decoder.raw_decode(buffer, copy_entry_match.end())
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+                buffer, position, end_of_file = __read_chunk(monster_data_file, buffer, copy_entry_match.start(),
+                                                             chunk_size)
+                continue
+            if isinstance(copy_entry, dict) and 'name' in copy_entry:
+                copy_targets.add(get_monster_key(copy_entry))
+
+
+def __read_chunk(monster_data_file, buffer, position, chunk_size):
+    chunk = monster_data_file.read(chunk_size)
+    return buffer[position:] + chunk, 0, len(chunk) < chunk_size
+
+
+def stream_monster_data_from_file(monster_data_location, statistics=None, progress_interval=PROGRESS_INTERVAL,
+                                  resolve_copies=True):
+    # Filters while streaming, so rejected monsters are dropped as soon as they're read. Pass a dict as statistics to
+    # get the read/kept counts back once the generator is exhausted.
+    # '_copy' monsters can reference a base monster anywhere in the file, so they're resolved (and yielded) at the end.
+    # Only the base monsters they point at (found by find_copy_targets first) are held on to until then.
+    copy_targets = find_copy_targets(monster_data_location) if resolve_copies else None
+    return stream_monster_data(iterate_raw_monster_data(monster_data_location), statistics, progress_interval,
+                               resolve_copies, copy_targets)
+
+
+def stream_monster_data(raw_monster_data, statistics=None, progress_interval=PROGRESS_INTERVAL, resolve_copies=True,
+                        copy_targets=None):
+    # stream_monster_data_from_file over any iterable of raw monster dicts. copy_targets is the set of monster keys
+    # that '_copy' entries point at; without it every monster is kept as a possible base.
+    if statistics is None:
+        statistics = {}
+    statistics['read'] = 0
+    statistics['kept'] = 0
+    statistics['copies'] = 0
+    statistics['unresolved_copies'] = 0
+    copy_resolver = CopyResolver() if resolve_copies else None
+    deferred_copies = []
+    for raw_monster_datum in raw_monster_data:
+        statistics['read'] += 1
+        with stage('filter_monsters'):
+            monster_datum = FiveEToolsJSONWrapper(raw_monster_datum)
+            if copy_resolver is not None:
+                if copy_targets is None or get_monster_key(raw_monster_datum) in copy_targets:
+                    copy_resolver.add(raw_monster_datum)
+                if monster_datum.is_copy():
+                    deferred_copies.append(raw_monster_datum)
+            # We only want to include monsters with a challenge rating
+            keep = monster_datum.has_challenge_rating() and not monster_datum.is_copy()
+        if keep:
+            statistics['kept'] += 1
+            yield monster_datum
+        if progress_interval and statistics['read'] % progress_interval == 0:
+            print_progress(statistics)
+
+    for raw_monster_datum in deferred_copies:
+        try:
+            with stage('resolve_copies'):
+                monster_datum = FiveEToolsJSONWrapper(copy_resolver.resolve(raw_monster_datum))
+        except Exception as e:
+            print('Failed to resolve copy: ' + raw_monster_datum['name'] + '. Reason: ' + str(e))
+            statistics['unresolved_copies'] += 1
+            count('unresolved_copies')
+            continue
+        if monster_datum.has_challenge_rating():
+            statistics['kept'] += 1
+            statistics['copies'] += 1
+            yield monster_datum
+
+
+def stream_monster_records_from_file(monster_data_location, statistics=None, progress_interval=PROGRESS_INTERVAL,
+                                     failures=None):
+    # Same monsters as stream_monster_data_from_file, as compact MonsterRecords; each raw dict can be freed as soon as
+    # its record is made. See stream_monster_records for statistics['failed'] and failures.
+    if statistics is None:
+        statistics = {}
+    return stream_monster_records(stream_monster_data_from_file(monster_data_location, statistics, progress_interval),
+                                  statistics, failures)
+
+
+def stream_monster_records(monster_data, statistics=None, failures=None):
+    # MonsterRecords for any iterable of FiveEToolsJSONWrappers. Monsters that fail to parse are counted in
+    # statistics['failed'] and printed, or, with a list as failures, added to it as get_parse_failure entries (indexed
+    # by position in monster_data).
+    if statistics is None:
+        statistics = {}
+    statistics['failed'] = 0
+    for index, monster_datum in enumerate(monster_data):
+        try:
+            with stage('make_monster_records'):
+                monster_record = MonsterRecord.from_json(monster_datum.json_data)
+        except Exception as e:
+            statistics['failed'] += 1
+            count('parse_failures')
+            if failures is not None:
+                failures.append(get_parse_failure(index, monster_datum, e))
+            else:
+                print('Failed to parse: ' + monster_datum.name() + '. Reason: ' + str(type(e)) + ', ' + str(e))
+            continue
+        yield monster_record
+
+
+def print_progress(statistics):
+    progress = 'Streamed ' + str(statistics['read']) + ' monsters, kept ' + str(statistics['kept'])
+    peak_memory = get_peak_memory_mb()
+    if peak_memory is not None:
+        progress += ', peak memory ' + format(peak_memory, '.1f') + 'MB'
+    print(progress)
+
+
+def get_peak_memory_mb():
+    if resource is None:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+    if sys.platform == 'darwin':
+        return peak_memory / (1024.0 * 1024.0)
+    return peak_memory / 1024.0
@@ -0,0 +1,208 @@
+import re
+
+# 5etools describes a lot of monsters as a '_copy' of a base monster plus a set of '_mod' patches, e.g:
+# "_copy": {"name": "Goblin", "source": "MM", "_mod": {"action": {"mode": "replaceTxt", "replace": "goblin", "with": "boss"}}}
+# Resolved monsters are a new top level dict whose values are shared with the base monster; a patch only ever builds
+# new objects along the path it actually changes, so nothing is deep copied no matter how many variants a base has.
+
+# Props that hold text and should never be touched by a replaceTxt
+UNREPLACEABLE_KEYS = {'name', 'type', 'source'}
+
+
+class CopyResolver:
+    def __init__(self, raw_monster_data=()):
+        self.monster_index = {}
+        self.resolved_monsters = {}
+        self.resolving = set()
+        for raw_monster_datum in raw_monster_data:
+            self.add(raw_monster_datum)
+
+    def add(self, raw_monster_datum):
+        self.monster_index[get_monster_key(raw_monster_datum)] = raw_monster_datum
+
+    def resolve(self, raw_monster_datum):
+        if '_copy' not in raw_monster_datum:
+            return raw_monster_datum
+        monster_key = get_monster_key(raw_monster_datum)
+        # Deep copy chains (a copy of a copy of ...) only get resolved once per link
+        if monster_key in self.resolved_monsters:
+            return self.resolved_monsters[monster_key]
+        if monster_key in self.resolving:
+            raise Exception('Circular _copy chain at: ' + str(monster_key))
+
+        copy_entry = raw_monster_datum['_copy']
+        base_key = get_monster_key(copy_entry)
+        if base_key not in self.monster_index:
+            raise Exception('Unknown base monster for _copy: ' + str(base_key))
+        self.resolving.add(monster_key)
+        try:
+            base_monster_datum = self.resolve(self.monster_index[base_key])
+        finally:
+            self.resolving.discard(monster_key)
+
+        resolved_monster_datum = dict(base_monster_datum)
+        for key, value in raw_monster_datum.items():
+            if key != '_copy':
+                resolved_monster_datum[key] = value
+        for prop, mods in copy_entry.get('_mod', {}).items():
+            apply_mods(resolved_monster_datum, prop, mods)
+
+        self.resolved_monsters[monster_key] = resolved_monster_datum
+        return resolved_monster_datum
+
+
+def get_monster_key(monster_datum):
+    return monster_datum['name'].lower(), monster_datum.get('source', '').lower()
+
+
+def apply_mods(monster_datum, prop, mods):
+    if mods == 'remove':
+        monster_datum.pop(prop, None)
+        return
+    if not isinstance(mods, list):
+        mods = [mods]
+    for mod in mods:
+        mode = mod['mode']
+        if prop == '*':
+            # Text replacement across every prop of the monster
+            if mode != 'replaceTxt':
+                raise Exception('Unsupported _mod mode for *: ' + mode)
+            __apply_to_all_props(monster_datum, lambda value: replace_text(value, mod))
+        elif prop == '_':
+            # Monster level modes
+            if mode == 'scalarAddHit':
+                __apply_to_all_props(monster_datum, lambda value: __add_to_tags(value, HIT_TAG_REGEX, mod['scalar']))
+            elif mode == 'scalarAddDc':
+                __apply_to_all_props(monster_datum, lambda value: __add_to_tags(value, DC_TAG_REGEX, mod['scalar']))
+            else:
+                raise Exception('Unsupported _mod mode for _: ' + mode)
+        elif mode in ARRAY_MODES:
+            monster_datum[prop] = ARRAY_MODES[mode](list(monster_datum.get(prop, [])), mod)
+        elif mode == 'replaceTxt':
+            if prop in monster_datum:
+                monster_datum[prop] = replace_text(monster_datum[prop], mod)
+        elif mode == 'scalarAddProp':
+            monster_datum[prop] = __scalar_prop(monster_datum.get(prop, {}), mod,
+                                                lambda number: number + mod['scalar'])
+        elif mode == 'scalarMultProp':
+            monster_datum[prop] = __scalar_prop(monster_datum.get(prop, {}), mod,
+                                                lambda number: number * mod['scalar'])
+        else:
+            raise Exception('Unsupported _mod mode: ' + mode)
+
+
+def __as_list(items):
+    return items if isinstance(items, list) else [items]
+
+
+def __find_item(array, target):
+    # Items are matched by name (or by {'index': n}), the same way 5etools does
+    if isinstance(target, dict) and 'index' in target:
+        return target['index'] if target['index'] < len(array) else -1
+    for index, item in enumerate(array):
+        if item == target or isinstance(item, dict) and item.get('name') == target:
+            return index
+    return -1
+
+
+def __append_array(array, mod):
+    return array + __as_list(mod['items'])
+
+
+def __prepend_array(array, mod):
+    return __as_list(mod['items']) + array
+
+
+def __insert_array(array, mod):
+    return array[:mod['index']] + __as_list(mod['items']) + array[mod['index']:]
+
+
+def __append_if_not_exists_array(array, mod):
+    return array + [item for item in __as_list(mod['items']) if item not in array]
+
+
+def __remove_array(array, mod):
+    targets = __as_list(mod['names']) if 'names' in mod else __as_list(mod['items'])
+    for target in targets:
+        index = __find_item(array, target)
+        if index < 0:
+            raise Exception('Could not find item to remove: ' + str(target))
+        del array[index]
+    return array
+
+
+def __replace_array(array, mod, append_if_missing=False):
+    index = __find_item(array, mod['replace'])
+    if index < 0:
+        if append_if_missing:
+            return array + __as_list(mod['items'])
+        raise Exception('Could not find item to replace: ' + str(mod['replace']))
+    return array[:index] + __as_list(mod['items']) + array[index + 1:]
+
+
+ARRAY_MODES = {
+    'appendArr': __append_array,
+    'prependArr': __prepend_array,
+    'insertArr': __insert_array,
+    'appendIfNotExistsArr': __append_if_not_exists_array,
+    'removeArr': __remove_array,
+    'replaceArr': __replace_array,
+    'replaceOrAppendArr': lambda array, mod: __replace_array(array, mod, append_if_missing=True),
+}
+
+HIT_TAG_REGEX = re.compile(r'{@hit ([+\-]?[0-9]+)}')
+DC_TAG_REGEX = re.compile(r'{@dc ([0-9]+)}')
+JS_GROUP_REFERENCE_REGEX = re.compile(r'\$([0-9])')
+
+
+def replace_text(value, mod):
+    # 5etools patterns are javascript regexes; the common subset (including $1 style group references) maps straight
+    # onto python's re
+    flags = re.IGNORECASE if 'i' in mod.get('flags', '') else 0
+    pattern = re.compile(mod['replace'], flags)
+    replacement = JS_GROUP_REFERENCE_REGEX.sub(r'\\g<\1>', mod['with'])
+    return __map_strings(value, lambda text: pattern.sub(replacement, text))
+
+
+def __add_to_tags(value, tag_regex, scalar):
+    def add_scalar(tag):
+        return tag.group(0).replace(tag.group(1), str(int(tag.group(1)) + scalar))
+    return __map_strings(value, lambda text: tag_regex.sub(add_scalar, text))
+
+
+def __apply_to_all_props(monster_datum, function):
+    for key in list(monster_datum.keys()):
+        if key not in UNREPLACEABLE_KEYS:
+            monster_datum[key] = function(monster_datum[key])
+
+
+def __map_strings(value, function):
+    # Rebuilds only the containers whose strings actually change; everything else stays shared with the base monster
+    if isinstance(value, str):
+        mapped = function(value)
+        return value if mapped == value else mapped
+    if isinstance(value, list):
+        mapped = [__map_strings(item, function) for item in value]
+        return value if all(new is old for new, old in zip(mapped, value)) else mapped
+    if isinstance(value, dict):
+        mapped = {key: item if key in UNREPLACEABLE_KEYS else __map_strings(item, function)
+                  for key, item in value.items()}
+        return value if all(mapped[key] is item for key, item in value.items()) else mapped
+    return value
+
+
+def __scalar_prop(value, mod, operation):
+    # e.g: {"mode": "scalarAddProp", "prop": "*", "scalar": 2} on "save" turns "+3" into "+5"
+    updated = dict(value)
+    keys = list(updated.keys()) if mod['prop'] == '*' else [mod['prop']]
+    for key in keys:
+        if key not in updated:
+            continue
+        number = updated[key]
+        if isinstance(number, str):
+            new_number = int(operation(int(number)))
+            updated[key] = ('+' if new_number >= 0 else '') + str(new_number)
+        elif isinstance(number, (int, float)):
+            new_number = operation(number)
+            updated[key] = int(new_number) if mod.get('floor') else new_number
+    return updated
@@ -0,0 +1,183 @@
+# Damage immunities/resistances/vulnerabilities and condition immunities as integer bitmasks, one bit per entry of
+# global_type_dict / global_condition_dict. A monster is three damage masks and one condition mask (see
+# FiveEToolsJSONWrapper.damage_modifier_masks and MonsterRecord); none of them are training columns yet.
+# Works on both the aidedd.org lists ('fire', 'bludgeoning, piercing, and slashing from nonmagical attacks', ...) and
+# the 5etools immune/resist/vulnerable/conditionImmune fields.
+
+GLOBAL_TYPE_LIST = [
+    'acid',
+    'bludgeoning',
+    'bludgeoning-nonmagical',
+    'bludgeoning-nonmagical-nonsilvered',
+    'bludgeoning-nonmagical-nonadamantine',
+    'cold',
+    'damage from spells',
+    'fire',
+    'force',
+    'lightning',
+    'necrotic',
+    'piercing',
+    'piercing-nonmagical',
+    'piercing-magical',
+    'piercing-nonmagical-nonsilvered',
+    'piercing-nonmagical-nonadamantine',
+    'poison',
+    'psychic',
+    'radiant',
+    'slashing',
+    'slashing-nonmagical',
+    'slashing-nonmagical-nonsilvered',
+    'slashing-nonmagical-nonadamantine',
+    'thunder',
+]
+GLOBAL_CONDITION_LIST = [
+    'blinded',
+    'charmed',
+    'deafened',
+    'exhaustion',
+    'frightened',
+    'grappled',
+    'paralyzed',
+    'petrified',
+    'poisoned',
+    'prone',
+    'restrained',
+    'stunned',
+    'unconscious',
+    # Anything else 5etools lists ('disease', ...); kept as one bit rather than failing the monster. Always last, and
+    # never a feature column (see CONDITION_FEATURE_COUNT)
+    'other',
+]
+# The condition immunity feature columns (monster_data_utilities.get_condition_immunity_feature_array): every condition
+# but 'other'
+CONDITION_FEATURE_COUNT = len(GLOBAL_CONDITION_LIST) - 1
+global_type_dict = {damage_type: index for index, damage_type in enumerate(GLOBAL_TYPE_LIST)}
+global_condition_dict = {condition: index for index, condition in enumerate(GLOBAL_CONDITION_LIST)}
+
+# Feature values, as convert_damage_type_lists_to_feature_array has always produced them
+VULNERABLE_VALUE = 0
+NORMAL_VALUE = 1
+RESISTANT_VALUE = 2
+IMMUNE_VALUE = 3
+
+PHYSICAL_DAMAGE_TYPES = ('bludgeoning', 'piercing', 'slashing')
+
+
+class UnrecognizedDamageTypeError(Exception):
+    pass
+
+
+def __get_types_mask(damage_types):
+    mask = 0
+    for damage_type in damage_types:
+        mask |= 1 << global_type_dict[damage_type]
+    return mask
+
+
+def __build_phrase_masks():
+    # Every plain damage type maps to its own bit; the long physical damage phrases map to the bits they imply
+    phrase_masks = {damage_type: 1 << index for damage_type, index in global_type_dict.items()}
+    phrase_masks['piercing from magic weapons wielded by good creatures'] = 1 << global_type_dict['piercing-magical']
+    for suffix, phrases in (
+            ('-nonmagical-nonsilvered', ("bludgeoning, piercing, and slashing from nonmagical attacks that aren't "
+                                         "silvered",
+                                         'bludgeoning, piercing, and slashing from nonmagical attacks not made with '
+                                         'silvered weapons')),
+            ('-nonmagical-nonadamantine', ("bludgeoning, piercing, and slashing from nonmagical attacks that aren't "
+                                           "adamantine",)),
+            ('-nonmagical', ('bludgeoning, piercing, and slashing from nonmagical attacks',))):
+        for phrase in phrases:
+            phrase_masks[phrase] = __get_types_mask(damage_type + suffix for damage_type in PHYSICAL_DAMAGE_TYPES)
+    phrase_masks["piercing and slashing from nonmagical attacks that aren't adamantine"] = \
+        __get_types_mask(['piercing-nonmagical', 'slashing-nonmagical'])
+    return phrase_masks
+
+
+# Normalized phrase -> bitmask. Phrases that aren't in here yet go through __get_phrase_mask_by_rules once and are
+# then remembered, so the substring checks run once per distinct phrase rather than once per monster.
+phrase_mask_dict = __build_phrase_masks()
+
+
+def get_damage_types_mask(damage_types):
+    mask = 0
+    for damage_type in damage_types:
+        phrase_mask = phrase_mask_dict.get(damage_type)
+        if phrase_mask is None:
+            phrase_mask = __get_phrase_mask_by_rules(damage_type)
+            phrase_mask_dict[damage_type] = phrase_mask
+        mask |= phrase_mask
+    return mask
+
+
+def __get_phrase_mask_by_rules(damage_type):
+    # The substring rules convert_damage_type_list_to_feature_array used per entry, for wordings the table lacks
+    if 'bludgeoning, piercing, and slashing' in damage_type:
+        if "nonmagical attacks that aren't silvered" in damage_type \
+                or 'bludgeoning, piercing, and slashing from nonmagical attacks not made with silvered weapons' \
+                in damage_type:
+            suffix = '-nonmagical-nonsilvered'
+        elif "bludgeoning, piercing, and slashing from nonmagical attacks that aren't adamantine" in damage_type:
+            suffix = '-nonmagical-nonadamantine'
+        elif 'bludgeoning, piercing, and slashing from nonmagical attacks' in damage_type \
+                or 'nonmagical bludgeoning, piercing, and slashing from' in damage_type:
+            suffix = '-nonmagical'
+        else:
+            return 0
+        return __get_types_mask(damage_type + suffix for damage_type in PHYSICAL_DAMAGE_TYPES)
+    if "piercing and slashing from nonmagical attacks that aren't adamantine" in damage_type:
+        # Thanks, xorn. If stuff like this keeps happening, then parse out the types and the modifiers
+        return __get_types_mask(['piercing-nonmagical', 'slashing-nonmagical'])
+    if damage_type not in global_type_dict:
+        raise UnrecognizedDamageTypeError('Unrecognized damage type: ' + damage_type)
+    return 1 << global_type_dict[damage_type]
+
+
+def get_condition_mask(conditions):
+    mask = 0
+    for condition in conditions:
+        mask |= 1 << global_condition_dict.get(condition, global_condition_dict['other'])
+    return mask
+
+
+def get_five_e_tools_damage_types_mask(entries, key):
+    # key is 'immune', 'resist' or 'vulnerable'. Entries are plain damage types or groups like
+    # {"resist": ["bludgeoning", "piercing", "slashing"], "note": "from nonmagical attacks that aren't silvered"}
+    mask = 0
+    for entry in entries or ():
+        if isinstance(entry, str):
+            mask |= get_damage_types_mask([entry])
+        elif isinstance(entry, dict) and key in entry:
+            note = (entry.get('preNote', '') + ' ' + entry.get('note', '')).lower()
+            mask |= __get_noted_damage_types_mask(entry[key], key, note)
+        # Anything else ({"special": "..."}) is prose we can't encode
+    return mask
+
+
+def __get_noted_damage_types_mask(entries, key, note):
+    mask = 0
+    for entry in entries:
+        if not isinstance(entry, str):
+            mask |= get_five_e_tools_damage_types_mask([entry], key)
+        elif entry in PHYSICAL_DAMAGE_TYPES and 'nonmagical' in note:
+            if 'silvered' in note:
+                mask |= 1 << global_type_dict[entry + '-nonmagical-nonsilvered']
+            elif 'adamantine' in note:
+                mask |= 1 << global_type_dict[entry + '-nonmagical-nonadamantine']
+            else:
+                mask |= 1 << global_type_dict[entry + '-nonmagical']
+        elif entry == 'piercing' and 'magic' in note:
+            mask |= 1 << global_type_dict['piercing-magical']
+        else:
+            mask |= get_damage_types_mask([entry])
+    return mask
+
+
+def get_five_e_tools_condition_mask(entries):
+    # Entries are condition names or groups like {"conditionImmune": ["charmed"], "note": "while in true form"}
+    mask = 0
+    for entry in entries or ():
+        if isinstance(entry, str):
+            mask |= get_condition_mask([entry])
+        elif isinstance(entry, dict) and 'conditionImmune' in entry:
+            mask |= get_five_e_tools_condition_mask(entry['conditionImmune'])
+    return mask
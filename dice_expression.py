@@ -0,0 +1,58 @@
+from collections import namedtuple
+from functools import lru_cache
+import re
+
+# Stat blocks reuse the same few hundred dice strings ('2d6 + 4', '1d8 + 3', ...) across thousands of monsters, so
+# every expression is parsed once into a DiceExpression and kept in a bounded LRU cache.
+DICE_CACHE_SIZE = 4096
+
+# One term of a dice expression, optionally preceded by its operator, e.g: '2d6', '+ 4', 'plus 1d8', '- 1'
+DICE_TERM_REGEX = re.compile(r' *(?:(\+|-|plus) *)?(?:([0-9]+)d([0-9]+)|([0-9]+)) *')
+
+# dice_terms is a tuple of (count, faces) pairs; subtracted dice have a negative count
+DiceExpression = namedtuple('DiceExpression', ['dice_terms', 'flat_modifier', 'expected_value'])
+
+
+@lru_cache(maxsize=DICE_CACHE_SIZE)
+def parse_dice_expression(dice_string):
+    dice_terms = []
+    flat_modifier = 0
+    expected_value = 0.0
+    position = 0
+    while position < len(dice_string):
+        term = DICE_TERM_REGEX.match(dice_string, position)
+        # Every term after the first one needs an operator joining it to the previous term
+        if not term or term.end() == position or (position > 0 and not term.group(1)):
+            raise Exception('Unknown dice string format: ' + dice_string)
+        sign = -1 if term.group(1) == '-' else 1
+        if term.group(4) is not None:
+            flat_modifier += sign * int(term.group(4))
+        else:
+            dice_count = sign * int(term.group(2))
+            dice_faces = int(term.group(3))
+            dice_terms.append((dice_count, dice_faces))
+            expected_value += dice_count * (dice_faces + 1) / 2.0
+        position = term.end()
+    if position == 0:
+        raise Exception('Unknown dice string format: ' + dice_string)
+    return DiceExpression(tuple(dice_terms), flat_modifier, expected_value + flat_modifier)
+
+
+def get_expected_value(dice_string):
+    return parse_dice_expression(dice_string).expected_value
+
+
+def get_dice_cache_statistics():
+    cache_info = parse_dice_expression.cache_info()
+    lookups = cache_info.hits + cache_info.misses
+    return {
+        'hits': cache_info.hits,
+        'misses': cache_info.misses,
+        'size': cache_info.currsize,
+        'max_size': cache_info.maxsize,
+        'hit_rate': cache_info.hits / lookups if lookups else 0.0
+    }
+
+
+def clear_dice_cache():
+    parse_dice_expression.cache_clear()
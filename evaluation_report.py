@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+from bestiary_ingest import get_bestiary_signature
+from feature_matrix import FEATURE_COUNT, FEATURE_EXTRACTOR_VERSION, HP_COLUMN, build_feature_matrix
+from feature_store import FeatureStore
+from model_store import load_model_artifact
+from regression import parse_monster_data_from_file
+
+# Usage: python evaluation_report.py [--model model_artifacts/regressor.pkl] [--bestiary 5etools_data/beastiary.json]
+#                                    [--diff <model version or report path>] [--plot plots.png]
+# Scores every monster in the bestiary with a saved model once and keeps the result as a columnar .npz per model
+# version (evaluation_reports/<version>.npz): name, source, actual CR, predicted CR, error, damage per round and the
+# feature row. Plots and diffs between model versions read those columns instead of re-extracting and re-predicting.
+# The model version is the start of a hash of the fitted regressor itself, so two models trained on the same data
+# (other hyperparameters, an incremental update and a refit) get separate reports. A report is rebuilt if the
+# bestiary (the file, or any bestiary file in a directory) has changed since it was written.
+
+EVALUATION_REPORT_VERSION = 1
+REPORT_DIRECTORY = 'evaluation_reports'
+MODEL_VERSION_LENGTH = 12
+# Monsters listed by a diff, biggest change in error first
+DIFF_MONSTER_COUNT = 20
+
+
+def get_model_version(model_artifact):
+    regressor_bytes = pickle.dumps(model_artifact['regressor'], protocol=pickle.HIGHEST_PROTOCOL)
+    return hashlib.sha1(regressor_bytes).hexdigest()[:MODEL_VERSION_LENGTH]
+
+
+def get_report_location(model_version, report_directory=REPORT_DIRECTORY):
+    return os.path.join(report_directory, model_version + '.npz')
+
+
+def build_evaluation_report(regressor, monster_data, model_version, bestiary_signature='', feature_store=None):
+    monster_features, monster_crs, monster_indices = build_feature_matrix(monster_data, feature_store)
+    cr_predictions = regressor.predict(monster_features).astype(np.float32) if len(monster_features) \
+        else np.zeros(0, dtype=np.float32)
+    return {
+        'version': np.asarray(EVALUATION_REPORT_VERSION),
+        'feature_schema_version': np.asarray(FEATURE_EXTRACTOR_VERSION),
+        'model_version': np.asarray(model_version),
+        'bestiary_signature': np.asarray(bestiary_signature),
+        'names': np.asarray([monster_data[index].name() for index in monster_indices], dtype=str),
+        'sources': np.asarray([str(monster_data[index].json_data.get('source', '')) for index in monster_indices],
+                              dtype=str),
+        'crs': monster_crs,
+        'predictions': cr_predictions,
+        'errors': cr_predictions - monster_crs,
+        'damage': np.asarray([monster_data[index].get_damage_from_attacks() for index in monster_indices],
+                             dtype=np.float32),
+        'features': monster_features
+    }
+
+
+def save_evaluation_report(report_location, report):
+    directory = os.path.dirname(report_location)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(report_location + '.tmp', 'wb') as report_file:
+        np.savez_compressed(report_file, **report)
+    os.replace(report_location + '.tmp', report_location)
+    print('Saved evaluation report to: ' + str(report_location))
+
+
+def load_evaluation_report(report_location, bestiary_signature=None):
+    # Returns None if there's no usable report: missing, another layout or feature schema, or (given a
+    # bestiary_signature) made from a different bestiary file
+    if not os.path.exists(report_location):
+        return None
+    with np.load(report_location) as report_file:
+        report = {key: report_file[key] for key in report_file.files}
+    if int(report['version']) != EVALUATION_REPORT_VERSION \
+            or int(report['feature_schema_version']) != FEATURE_EXTRACTOR_VERSION:
+        return None
+    if bestiary_signature is not None and str(report['bestiary_signature']) != bestiary_signature:
+        return None
+    return report
+
+
+def get_evaluation_report(model_artifact, monster_data_location, report_directory=REPORT_DIRECTORY,
+                          feature_store=None):
+    # The saved report for this model and bestiary, or a new one (parsing the bestiary only in that case)
+    model_version = get_model_version(model_artifact)
+    report_location = get_report_location(model_version, report_directory)
+    bestiary_signature = get_bestiary_signature(monster_data_location)
+    report = load_evaluation_report(report_location, bestiary_signature)
+    if report is not None:
+        print('Loaded evaluation report from: ' + report_location)
+        return report
+    monster_data = parse_monster_data_from_file(monster_data_location)
+    report = build_evaluation_report(model_artifact['regressor'], monster_data, model_version, bestiary_signature,
+                                     feature_store)
+    save_evaluation_report(report_location, report)
+    return report
+
+
+def get_mean_absolute_error(report):
+    return float(np.mean(np.abs(report['errors']))) if len(report['errors']) else 0.0
+
+
+def diff_evaluation_reports(old_report, new_report, monster_count=DIFF_MONSTER_COUNT):
+    # Joins the two reports on (name, source). Returns the summary and the monsters whose absolute error moved most.
+    old_rows = {key: row for row, key in enumerate(zip(old_report['names'].tolist(), old_report['sources'].tolist()))}
+    new_rows = {key: row for row, key in enumerate(zip(new_report['names'].tolist(), new_report['sources'].tolist()))}
+    shared_keys = [key for key in new_rows if key in old_rows]
+    old_shared_rows = np.asarray([old_rows[key] for key in shared_keys], dtype=np.intp)
+    new_shared_rows = np.asarray([new_rows[key] for key in shared_keys], dtype=np.intp)
+    old_errors = old_report['errors'][old_shared_rows]
+    new_errors = new_report['errors'][new_shared_rows]
+    error_changes = np.abs(new_errors) - np.abs(old_errors)
+    biggest_changes = np.argsort(-np.abs(error_changes), kind='stable')[:monster_count]
+    return {
+        'old_model_version': str(old_report['model_version']),
+        'new_model_version': str(new_report['model_version']),
+        'old_mean_absolute_error': get_mean_absolute_error(old_report),
+        'new_mean_absolute_error': get_mean_absolute_error(new_report),
+        'shared': len(shared_keys),
+        'added': len(new_rows) - len(shared_keys),
+        'removed': len(old_rows) - len(shared_keys),
+        'improved': int(np.sum(error_changes < 0)),
+        'worsened': int(np.sum(error_changes > 0)),
+        'monsters': [{'name': shared_keys[row][0],
+                      'source': shared_keys[row][1],
+                      'cr': float(new_report['crs'][new_shared_rows[row]]),
+                      'old_prediction': float(old_report['predictions'][old_shared_rows[row]]),
+                      'new_prediction': float(new_report['predictions'][new_shared_rows[row]])}
+                     for row in biggest_changes]
+    }
+
+
+def print_diff(diff):
+    print('Model ' + diff['old_model_version'] + ' -> ' + diff['new_model_version'])
+    print('Mean absolute error: ' + format(diff['old_mean_absolute_error'], '.4f') + ' -> '
+          + format(diff['new_mean_absolute_error'], '.4f'))
+    print(str(diff['shared']) + ' monsters in both (' + str(diff['improved']) + ' improved, ' + str(diff['worsened'])
+          + ' worsened), ' + str(diff['added']) + ' added, ' + str(diff['removed']) + ' removed')
+    for monster in diff['monsters']:
+        print('  ' + (monster['name'] + ' (' + monster['source'] + ')').ljust(48) + 'CR ' + format(monster['cr'], 'g')
+              + ': ' + format(monster['old_prediction'], '.2f') + ' -> ' + format(monster['new_prediction'], '.2f'))
+
+
+def render_evaluation_report(report, output_location=None):
+    from render_data import render_plots  # render_data imports this module
+    render_plots(report['names'].tolist(), report['crs'], report['predictions'], report['features'][:, HP_COLUMN],
+                 report['damage'], output_location)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score the bestiary with a saved model and keep the results')
+    parser.add_argument('--model', default='model_artifacts/regressor.pkl')
+    parser.add_argument('--bestiary', default='5etools_data/beastiary.json')
+    parser.add_argument('--feature-cache', default='feature_cache')
+    parser.add_argument('--reports', default=REPORT_DIRECTORY)
+    parser.add_argument('--diff', help='a model version (or report path) to compare this model against')
+    parser.add_argument('--plot', help='save the accuracy plots here (.png, .svg, ...)')
+    args = parser.parse_args()
+
+    model_artifact = load_model_artifact(args.model)
+    if model_artifact is None:
+        raise Exception('No usable model at: ' + args.model + '; train one with regression.py first')
+    feature_store = FeatureStore(args.feature_cache, FEATURE_EXTRACTOR_VERSION, FEATURE_COUNT)
+    evaluation_report = get_evaluation_report(model_artifact, args.bestiary, args.reports, feature_store)
+    print('Model ' + str(evaluation_report['model_version']) + ': ' + str(len(evaluation_report['names']))
+          + ' monsters, mean absolute error ' + format(get_mean_absolute_error(evaluation_report), '.4f'))
+    if args.diff:
+        old_report_location = args.diff if args.diff.endswith('.npz') else get_report_location(args.diff, args.reports)
+        old_report = load_evaluation_report(old_report_location)
+        if old_report is None:
+            raise Exception('No usable evaluation report at: ' + old_report_location)
+        print_diff(diff_evaluation_reports(old_report, evaluation_report))
+    if args.plot:
+        render_evaluation_report(evaluation_report, args.plot)
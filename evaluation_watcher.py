@@ -0,0 +1,148 @@
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import struct
+import sys
+import time
+
+# Watches candidate monster files and calls back only when a file's content actually changes. On Linux this blocks on
+# inotify, so an idle watcher costs nothing; elsewhere it falls back to cheap mtime/size polling. Either way bursts of
+# editor writes (truncate, write, rename, ...) are debounced into a single callback.
+
+DEBOUNCE_SECONDS = 0.2
+POLL_INTERVAL_SECONDS = 0.5
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+class InotifyEventSource:
+    # Watches directories rather than files: most editors save by writing a new file and renaming it over the old
+    # one, which silently ends a watch on the file itself
+    def __init__(self, directories):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.file_descriptor = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.file_descriptor < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+        for directory in directories:
+            watch_descriptor = self.libc.inotify_add_watch(self.file_descriptor, os.fsencode(directory),
+                                                           INOTIFY_MASK)
+            if watch_descriptor < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for ' + directory)
+            self.directories[watch_descriptor] = directory
+
+    def wait(self, timeout):
+        # Returns the set of paths touched within timeout (None blocks until something happens)
+        readable, _, _ = select.select([self.file_descriptor], [], [], timeout)
+        if not readable:
+            return set()
+        events = os.read(self.file_descriptor, INOTIFY_READ_SIZE)
+        touched_paths = set()
+        offset = 0
+        while offset < len(events):
+            watch_descriptor, mask, cookie, name_length = INOTIFY_EVENT_HEADER.unpack_from(events, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = events[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            if name and watch_descriptor in self.directories:
+                touched_paths.add(os.path.join(self.directories[watch_descriptor], os.fsdecode(name)))
+        return touched_paths
+
+    def close(self):
+        os.close(self.file_descriptor)
+
+
+class PollingEventSource:
+    def __init__(self, directories):
+        self.directories = directories
+        self.file_stats = self.__stat_files()
+
+    def __stat_files(self):
+        file_stats = {}
+        for directory in self.directories:
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    stat = entry.stat()
+                    file_stats[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return file_stats
+
+    def wait(self, timeout):
+        time.sleep(POLL_INTERVAL_SECONDS if timeout is None else min(timeout, POLL_INTERVAL_SECONDS))
+        file_stats = self.__stat_files()
+        touched_paths = {path for path, stat in file_stats.items() if self.file_stats.get(path) != stat}
+        self.file_stats = file_stats
+        return touched_paths
+
+    def close(self):
+        pass
+
+
+def create_event_source(directories):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyEventSource(directories)
+        except (OSError, AttributeError) as e:
+            print('inotify unavailable (' + str(e) + '); falling back to polling')
+    return PollingEventSource(directories)
+
+
+class EvaluationWatcher:
+    # watch_location is either a single json file or a directory of them
+    def __init__(self, watch_location, on_change, debounce_seconds=DEBOUNCE_SECONDS):
+        self.on_change = on_change
+        self.debounce_seconds = debounce_seconds
+        if os.path.isdir(watch_location):
+            self.directory = os.path.abspath(watch_location)
+            self.watched_file = None
+        else:
+            self.directory = os.path.dirname(os.path.abspath(watch_location))
+            self.watched_file = os.path.abspath(watch_location)
+        self.content_hashes = {}
+
+    def is_watched(self, path):
+        if self.watched_file is not None:
+            return path == self.watched_file
+        return path.endswith('.json')
+
+    def check(self, path):
+        # Calls on_change only when the bytes on disk differ from the last evaluated version
+        try:
+            with open(path, 'rb') as watched_file:
+                content = watched_file.read()
+        except FileNotFoundError:
+            self.content_hashes.pop(path, None)
+            return
+        content_hash = hashlib.sha1(content).hexdigest()
+        if self.content_hashes.get(path) == content_hash:
+            return
+        self.content_hashes[path] = content_hash
+        self.on_change(path, content)
+
+    def watch_forever(self):
+        event_source = create_event_source([self.directory])
+        try:
+            # Evaluate everything that's already there once, then wait for changes
+            for entry in sorted(os.scandir(self.directory), key=lambda entry: entry.name):
+                if entry.is_file() and self.is_watched(entry.path):
+                    self.check(entry.path)
+            while True:
+                touched_paths = event_source.wait(None)
+                # Debounce: keep collecting until the directory has been quiet for a moment
+                while touched_paths:
+                    more_touched_paths = event_source.wait(self.debounce_seconds)
+                    if not more_touched_paths:
+                        break
+                    touched_paths |= more_touched_paths
+                for path in sorted(touched_paths):
+                    if self.is_watched(path):
+                        self.check(path)
+        finally:
+            event_source.close()
@@ -0,0 +1,217 @@
+import sys
+import traceback
+
+import numpy as np
+
+from feature_store import get_content_hash
+from pipeline_instrumentation import count, stage
+
+# Batch equivalent of FiveEToolsJSONWrapper.get_features_array. Columns, in order:
+# armor class, hp, spellcasting to hit, spellcasting dc, six saves, six trait one-hots
+# Bump the version whenever the columns or the way they're extracted change; it invalidates every FeatureStore.
+FEATURE_EXTRACTOR_VERSION = 1
+ATTRIBUTES = ['str', 'dex', 'con', 'int', 'wis', 'cha']
+TRAIT_FEATURES = ['Legendary Resistances', 'Magic Resistance', 'Pack Tactics', 'Regeneration', 'Pack Tactics',
+                  'Fey Ancestry']
+ARMOR_CLASS_COLUMN = 0
+HP_COLUMN = 1
+SPELLCASTING_TO_HIT_COLUMN = 2
+SPELLCASTING_DC_COLUMN = 3
+SAVE_COLUMNS = slice(4, 4 + len(ATTRIBUTES))
+TRAIT_COLUMNS = slice(SAVE_COLUMNS.stop, SAVE_COLUMNS.stop + len(TRAIT_FEATURES))
+FEATURE_COUNT = TRAIT_COLUMNS.stop
+
+
+def __build_trait_column_dict():
+    # 'Pack Tactics' is in there twice, so a trait can light up more than one column
+    trait_columns = {}
+    for index, trait in enumerate(TRAIT_FEATURES):
+        trait_columns.setdefault(trait, []).append(TRAIT_COLUMNS.start + index)
+    return trait_columns
+
+
+trait_column_dict = __build_trait_column_dict()
+# One bit per distinct trait, for MonsterRecord.trait_mask
+trait_bit_dict = {trait: 1 << bit for bit, trait in enumerate(trait_column_dict)}
+
+
+def build_feature_matrix(monster_data, feature_store=None, failures=None):
+    # Returns (features, crs, monster_indices); monster_indices maps each row back into monster_data, since monsters
+    # that fail to parse or have a CR of 0 are left out.
+    # With a FeatureStore, monsters whose json hasn't changed reuse their stored row and skip extraction entirely.
+    # Pass a list as failures to get a get_parse_failure entry per failed monster instead of printed tracebacks.
+    monster_indices = []
+    crs = []
+    hps = []
+    spellcasting_to_hits = []
+    spellcasting_dcs = []
+    attributes = []
+    # The ragged and sparse parts (armor class entries, stated saves, traits) are flattened into (row, column, value)
+    # lists and scattered into the matrix in one go
+    armor_class_rows = []
+    armor_class_values = []
+    save_rows = []
+    save_columns = []
+    save_values = []
+    trait_rows = []
+    trait_columns = []
+    stored_rows = []
+    stored_features = []
+    new_rows = []
+    new_content_hashes = []
+
+    # Pass 1: pull the raw values out of each monster's json. This is the only per-monster Python work.
+    for index, monster_datum in enumerate(monster_data):
+        content_hash = None
+        try:
+            challenge_rating = monster_datum.challenge_rating()
+            if challenge_rating <= 0:
+                continue
+            if feature_store is not None:
+                content_hash = get_content_hash(monster_datum.json_data)
+                if feature_store.has_failed(content_hash):
+                    continue
+                stored_feature_row = feature_store.lookup(content_hash)
+                if stored_feature_row is not None:
+                    row = __append_placeholder_row(monster_indices, crs, hps, spellcasting_to_hits,
+                                                   spellcasting_dcs, attributes, index, challenge_rating)
+                    stored_rows.append(row)
+                    stored_features.append(stored_feature_row)
+                    continue
+            json_data = monster_datum.json_data
+            monster_armor_classes = __get_armor_class_values(json_data)
+            monster_stated_saves = __get_stated_saves(json_data)
+            monster_hp = json_data['hp']['average']
+            monster_attributes = [json_data[attribute] for attribute in ATTRIBUTES]
+            monster_spellcasting_to_hit = monster_datum.get_spellcasting_to_hit()
+            monster_spellcasting_dc = monster_datum.get_spellcasting_dc()
+            # get_features_array parses the attacks too, and monsters whose attacks don't parse have always been
+            # left out of the training data
+            monster_datum.get_damage_from_attacks()
+        except Exception as e:
+            count('parse_failures')
+            with stage('report_parse_failure'):
+                if failures is not None:
+                    failures.append(get_parse_failure(index, monster_datum, e))
+                else:
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    print('Failed to parse: ' + str(monster_datum.json_data))
+                    print('Reason: ' + str(exc_type) + ', ' + str(e))
+                    traceback.print_exc()
+                if content_hash is not None:
+                    feature_store.add_failure(content_hash)
+            continue
+
+        row = len(monster_indices)
+        monster_indices.append(index)
+        crs.append(challenge_rating)
+        hps.append(monster_hp)
+        spellcasting_to_hits.append(monster_spellcasting_to_hit)
+        spellcasting_dcs.append(monster_spellcasting_dc)
+        attributes.append(monster_attributes)
+        armor_class_rows += [row] * len(monster_armor_classes)
+        armor_class_values += monster_armor_classes
+        for column, save in monster_stated_saves:
+            save_rows.append(row)
+            save_columns.append(column)
+            save_values.append(save)
+        for trait in monster_datum.get_traits():
+            for column in trait_column_dict.get(trait, ()):
+                trait_rows.append(row)
+                trait_columns.append(column)
+        if content_hash is not None:
+            new_rows.append(row)
+            new_content_hashes.append(content_hash)
+
+    # Pass 2: column-wise work over every monster at once
+    with stage('vectorize_features'):
+        features = np.zeros((len(monster_indices), FEATURE_COUNT), dtype=np.float32)
+        np.maximum.at(features[:, ARMOR_CLASS_COLUMN],
+                      np.asarray(armor_class_rows, dtype=np.intp),
+                      np.asarray(armor_class_values, dtype=np.float32))
+        features[:, HP_COLUMN] = hps
+        features[:, SPELLCASTING_TO_HIT_COLUMN] = spellcasting_to_hits
+        features[:, SPELLCASTING_DC_COLUMN] = spellcasting_dcs
+        # Saves default to the attribute modifier unless the stat block states them
+        saves = np.floor((np.asarray(attributes, dtype=np.float32).reshape(-1, len(ATTRIBUTES)) - 10) / 2.0)
+        saves[np.asarray(save_rows, dtype=np.intp), np.asarray(save_columns, dtype=np.intp)] = save_values
+        features[:, SAVE_COLUMNS] = saves
+        features[np.asarray(trait_rows, dtype=np.intp), np.asarray(trait_columns, dtype=np.intp)] = 1
+
+        if stored_rows:
+            features[np.asarray(stored_rows, dtype=np.intp)] = stored_features
+        for row, content_hash in zip(new_rows, new_content_hashes):
+            feature_store.add(content_hash, features[row])
+
+    return features, np.asarray(crs, dtype=np.float32), np.asarray(monster_indices, dtype=np.intp)
+
+
+def get_parse_failure(index, monster_datum, exception):
+    # One entry of a structured failure report; call it from the except block so the traceback is still current
+    json_data = monster_datum.json_data
+    return {
+        'index': index,
+        'name': json_data.get('name') if isinstance(json_data, dict) else None,
+        'source': json_data.get('source') if isinstance(json_data, dict) else None,
+        'error_type': type(exception).__name__,
+        'message': str(exception),
+        'traceback': traceback.format_exc()
+    }
+
+
+def build_record_feature_matrix(monster_records):
+    # Same (features, crs, monster_indices) as build_feature_matrix, from MonsterRecords. Everything was extracted when
+    # the records were made (records that failed never got made), so this is column copies only.
+    monster_indices = [index for index, record in enumerate(monster_records) if record.challenge_rating > 0]
+    records = [monster_records[index] for index in monster_indices]
+    features = np.zeros((len(records), FEATURE_COUNT), dtype=np.float32)
+    features[:, ARMOR_CLASS_COLUMN] = [record.armor_class for record in records]
+    features[:, HP_COLUMN] = [record.hp for record in records]
+    features[:, SPELLCASTING_TO_HIT_COLUMN] = [record.spellcasting_to_hit for record in records]
+    features[:, SPELLCASTING_DC_COLUMN] = [record.spellcasting_dc for record in records]
+    if records:
+        features[:, SAVE_COLUMNS] = np.asarray([record.saves for record in records], dtype=np.float32)
+    trait_masks = np.asarray([record.trait_mask for record in records], dtype=np.int64)
+    for trait, columns in trait_column_dict.items():
+        features[:, columns] = ((trait_masks & trait_bit_dict[trait]) != 0)[:, np.newaxis]
+    crs = np.asarray([record.challenge_rating for record in records], dtype=np.float32)
+    return features, crs, np.asarray(monster_indices, dtype=np.intp)
+
+
+def __append_placeholder_row(monster_indices, crs, hps, spellcasting_to_hits, spellcasting_dcs, attributes, index,
+                             challenge_rating):
+    # Stored rows still need a slot in every column list; the real values are copied over after pass 2
+    row = len(monster_indices)
+    monster_indices.append(index)
+    crs.append(challenge_rating)
+    hps.append(0)
+    spellcasting_to_hits.append(0)
+    spellcasting_dcs.append(0)
+    attributes.append([10] * len(ATTRIBUTES))
+    return row
+
+
+def __get_armor_class_values(json_data):
+    # Same rules as FiveEToolsJSONWrapper.armor_class, minus the max
+    armor_class_values = []
+    for ac_entry in json_data['ac']:
+        if isinstance(ac_entry, int):
+            armor_class_values.append(ac_entry)
+        elif isinstance(ac_entry, dict):
+            if 'ac' in ac_entry:
+                armor_class_values.append(ac_entry['ac'])
+        else:
+            raise Exception('Unrecognized armor class entry: ' + str(ac_entry))
+    return armor_class_values
+
+
+def __get_stated_saves(json_data):
+    stated_saves = []
+    if 'save' in json_data:
+        for column, attribute in enumerate(ATTRIBUTES):
+            if attribute in json_data['save']:
+                save_string = json_data['save'][attribute]
+                if save_string[0] not in ('+', '-'):
+                    raise Exception('Unrecognized save format: ' + save_string)
+                stated_saves.append((column, int(save_string)))
+    return stated_saves
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+INDEX_FILE_NAME = 'index.json'
+FEATURES_FILE_NAME = 'features.f32'
+FAILED_ROW = -1
+# Rows that no monster has looked up since the store was opened (edited or removed monsters) are dropped on save once
+# they're more than this fraction of the store
+MAX_ORPHANED_FRACTION = 0.25
+
+
+def get_content_hash(json_data):
+    # No sort_keys: it almost doubles the cost, and key order only changes when a monster is actually edited anyway
+    # (a reordered but otherwise identical monster is just a cache miss)
+    return hashlib.sha1(json.dumps(json_data).encode('utf-8')).hexdigest()
+
+
+class FeatureStore:
+    # Maps the content hash of a monster's json to its feature row, so unchanged monsters never get re-extracted.
+    # Rows live in a memory-mapped file of raw float32s next to a json index of hash -> row. Monsters that failed
+    # extraction are remembered too (as FAILED_ROW), so their tracebacks aren't reprinted every run.
+    # Saving only appends the new rows to the file, until enough rows are orphaned that it's worth compacting.
+    # The store is thrown away whenever the extractor version or feature count it was built with changes.
+    def __init__(self, store_location, extractor_version, feature_count):
+        self.store_location = store_location
+        self.extractor_version = extractor_version
+        self.feature_count = feature_count
+        self.rows = {}
+        self.features = np.zeros((0, feature_count), dtype=np.float32)
+        self.pending_features = []
+        self.seen_hashes = set()
+        self.hits = 0
+        self.misses = 0
+        self.__load()
+
+    def __load(self):
+        index_location = os.path.join(self.store_location, INDEX_FILE_NAME)
+        features_location = os.path.join(self.store_location, FEATURES_FILE_NAME)
+        if not os.path.exists(index_location) or not os.path.exists(features_location):
+            return
+        with open(index_location, 'r') as index_file:
+            index = json.load(index_file)
+        if index['version'] != self.extractor_version or index['feature_count'] != self.feature_count:
+            print('Feature store at ' + str(self.store_location) + ' is from feature extractor version '
+                  + str(index['version']) + '; rebuilding')
+            return
+        self.rows = index['rows']
+        self.features = self.__map_features(features_location, index['row_count'])
+
+    def __map_features(self, features_location, row_count):
+        if row_count == 0:
+            return np.zeros((0, self.feature_count), dtype=np.float32)
+        return np.memmap(features_location, dtype=np.float32, mode='r', shape=(row_count, self.feature_count))
+
+    def lookup(self, content_hash):
+        # Returns the stored feature row, or None if the monster is new (or known to fail; see has_failed)
+        self.seen_hashes.add(content_hash)
+        row = self.rows.get(content_hash)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if row == FAILED_ROW:
+            return None
+        if row < len(self.features):
+            return self.features[row]
+        return self.pending_features[row - len(self.features)]
+
+    def has_failed(self, content_hash):
+        self.seen_hashes.add(content_hash)
+        return self.rows.get(content_hash) == FAILED_ROW
+
+    def add(self, content_hash, feature_row):
+        self.seen_hashes.add(content_hash)
+        self.rows[content_hash] = len(self.features) + len(self.pending_features)
+        self.pending_features.append(np.array(feature_row, dtype=np.float32))
+
+    def add_failure(self, content_hash):
+        self.seen_hashes.add(content_hash)
+        self.rows[content_hash] = FAILED_ROW
+
+    def save(self):
+        os.makedirs(self.store_location, exist_ok=True)
+        index_location = os.path.join(self.store_location, INDEX_FILE_NAME)
+        features_location = os.path.join(self.store_location, FEATURES_FILE_NAME)
+        row_count = len(self.features) + len(self.pending_features)
+        live_rows = {row for content_hash, row in self.rows.items()
+                     if row != FAILED_ROW and content_hash in self.seen_hashes}
+        orphaned_row_count = row_count - len(live_rows)
+        # A run that looked nothing up (e.g. one that reused a saved model) says nothing about which rows are orphaned
+        if self.seen_hashes and orphaned_row_count > MAX_ORPHANED_FRACTION * row_count:
+            self.__compact(features_location, sorted(live_rows))
+            print('Feature store: dropped ' + str(orphaned_row_count) + ' orphaned rows')
+        elif self.pending_features or not os.path.exists(features_location):
+            self.__append(features_location)
+        with open(index_location + '.tmp', 'w') as index_file:
+            json.dump({'version': self.extractor_version,
+                       'feature_count': self.feature_count,
+                       'row_count': len(self.features),
+                       'rows': self.rows}, index_file)
+        os.replace(index_location + '.tmp', index_location)
+        print('Feature store: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses, '
+              + str(len(self.features)) + ' rows')
+
+    def __append(self, features_location):
+        # Only the new rows are written. The index is saved after the rows, so anything past the stored row count is
+        # left over from an interrupted save and gets overwritten.
+        stored_row_count = len(self.features)
+        # Drop the memory map before changing the file underneath it (Windows won't allow otherwise)
+        self.features = None
+        with open(features_location, 'ab') as features_file:
+            features_file.truncate(stored_row_count * self.feature_count * np.dtype(np.float32).itemsize)
+            for feature_row in self.pending_features:
+                features_file.write(feature_row.tobytes())
+        self.features = self.__map_features(features_location, stored_row_count + len(self.pending_features))
+        self.pending_features = []
+
+    def __compact(self, features_location, live_rows):
+        # Rewrites the file with just the rows seen since the store was opened and renumbers the index to match;
+        # unseen failures are forgotten too
+        features = np.concatenate([np.asarray(self.features, dtype=np.float32).reshape(-1, self.feature_count)]
+                                  + [feature_row.reshape(1, -1) for feature_row in self.pending_features])
+        features = features[np.asarray(live_rows, dtype=np.intp)]
+        new_rows = {row: new_row for new_row, row in enumerate(live_rows)}
+        self.rows = {content_hash: row if row == FAILED_ROW else new_rows[row]
+                     for content_hash, row in self.rows.items() if content_hash in self.seen_hashes}
+        self.features = None
+        with open(features_location + '.tmp', 'wb') as features_file:
+            features_file.write(features.tobytes())
+        os.replace(features_location + '.tmp', features_location)
+        self.features = self.__map_features(features_location, len(features))
+        self.pending_features = []
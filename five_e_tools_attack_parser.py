@@ -0,0 +1,72 @@
+import re
+
+from monster_data_utilities import get_expected_damage_from_dice_string
+
+# One compiled pattern for the whole 5etools attack tag grammar, so each action string is scanned exactly once.
+# Every alternative starts with one of '{', 'o', 'p', 't' or 'r' and is then confirmed with a lookbehind; leading with a
+# single character class lets the regex engine skip straight to candidate positions instead of trying every branch at
+# every character, which is what made a naive alternation slower than the four separate searches it replaces.
+# The damage branch is the damage regex from regex_notes.md; the clause is recovered from the lead character.
+# Note: The 'takes' clause literally only exists for the Fire Giant Dreadnought, for an action that isn't even
+# an attack, so the or clause doesn't blow up. Probably should get rid of it from the regex, this is a dirty
+# hack!
+ATTACK_TOKEN_REGEX = re.compile(
+    r'(?P<lead>[{optr])(?:'
+    r'@(?<=\{@)(?:hit (?P<to_hit>[0-9]+)\}|atk (?P<type>[A-z]+)\}|dc (?P<dc>[0-9]+)\})'
+    r'|each(?<=reach) (?P<range>[0-9]+)/?(?:[0-9]+)? ft\.,'
+    r'|(?:@(?<=\{@)h\}|r(?<=or)|lus(?<=plus)|akes(?<=takes)) ?(?P<stated_damage>[0-9]+) ?'
+    r'(?:\(\{@damage (?P<dice>[d0-9\+\- ]+)\}(?: plus \{@damage (?P<secondary_dice>[d0-9\+\- ]+)\})?\))?'
+    r' (?P<damage_type>[A-z]+)? ?damage)')
+
+DAMAGE_CLAUSES = {'{': '{@h}', 'o': 'or', 'p': 'plus', 't': 'takes'}
+
+
+def parse_attack_entry(attack_entry):
+    attack_features = {'name': attack_entry['name']}
+    entry_string = attack_entry['entries'][0]
+
+    damage_entries = []
+    # findall hands back plain tuples, which is much cheaper than pulling named groups off match objects
+    for lead, to_hit, attack_type, dc, attack_range, stated_damage, dice, secondary_dice, damage_type \
+            in ATTACK_TOKEN_REGEX.findall(entry_string):
+        if stated_damage:
+            __add_damage_entry(damage_entries, DAMAGE_CLAUSES[lead], stated_damage, dice, secondary_dice, damage_type,
+                               entry_string)
+        # Only the first tag of each kind counts, e.g: '{@hit 0} to hit ({@hit 4} to hit with shillelagh)'
+        elif to_hit:
+            if 'to_hit' not in attack_features:
+                attack_features['to_hit'] = int(to_hit)
+        elif attack_type:
+            if 'type' not in attack_features:
+                attack_features['type'] = attack_type
+        elif dc:
+            if 'dc' not in attack_features:
+                attack_features['dc'] = int(dc)
+        elif 'range' not in attack_features:
+            attack_features['range'] = int(attack_range)  # Just ignore the range with disadvantage
+
+    if damage_entries:
+        attack_features['damage_entries'] = damage_entries
+    return attack_features
+
+
+def __add_damage_entry(damage_entries, clause, stated_damage, dice, secondary_dice, damage_type, entry_string):
+    if dice:  # There is a damage dice string; use that!
+        expected_damage = get_expected_damage_from_dice_string(dice)
+    else:  # Default to the stated damage otherwise
+        expected_damage = int(stated_damage)
+    if secondary_dice:  # There is a secondary damage dice string; add it!
+        expected_damage = expected_damage + get_expected_damage_from_dice_string(secondary_dice)
+    damage_entry = {
+        'expected_damage': expected_damage,
+        'damage_type': damage_type
+    }
+    # If clause is 'or' and the expected damage is higher than the previous entry, replace previous entry
+    # e.g: 14 ({@damage 2d6 + 7}) slashing damage, or 17 ({@damage 2d6 + 10}) slashing damage while raging
+    if clause == 'or':
+        if len(damage_entries) == 0:
+            raise Exception('An attack damage entry has an or clause with no preceding entry: ' + entry_string)
+        if damage_entries[-1]['expected_damage'] > damage_entry['expected_damage']:
+            damage_entries[-1] = damage_entry
+    else:
+        damage_entries.append(damage_entry)
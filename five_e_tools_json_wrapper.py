@@ -1,19 +1,22 @@
 import math
-import re
 
-from monster_data_utilities import get_expected_damage_from_dice_string
+from damage_type_encoder import get_five_e_tools_condition_mask, get_five_e_tools_damage_types_mask
+from five_e_tools_attack_parser import parse_attack_entry
+from multiattack_grammar import get_damage_per_round, parse_multiattack
+from pipeline_instrumentation import instrument_class
+from spellcasting_analyzer import analyze_spellcasting
 
 
 class FiveEToolsJSONWrapper:
     def __init__(self, json_data):
         self.json_data = json_data
+        self.spellcasting_analysis = None
 
     def has_challenge_rating(self):
         return 'cr' in self.json_data and self.json_data['cr'] != 'Unknown'
 
     def is_copy(self):
-        # TODO: Currently we don't support parsing copies
-        # Find some way to inject the base monster (and add that logic to a layer above)
+        # Copies need their base monster injected before they're usable; see CopyResolver
         return '_copy' in self.json_data
 
     def armor_class(self):
@@ -85,23 +88,19 @@ class FiveEToolsJSONWrapper:
             return float(cr_text)
 
     def get_spellcasting_dc(self):
-        return self.__get_spellcasting_feature(r'{@dc ([0-9]+)}')
+        return self.get_spellcasting()['dc']
 
     def get_spellcasting_to_hit(self):
-        return self.__get_spellcasting_feature(r'{@hit ([0-9]+)}')
+        return self.get_spellcasting()['to_hit']
 
     def get_spellcasting_level(self):
-        return self.__get_spellcasting_feature(r'([0-9]+)(nd|rd|th)-level spellcaster')
-
-    def __get_spellcasting_feature(self, regex):
-        feature_value = 0
-        if 'spellcasting' in self.json_data:
-            for spellcasting in self.json_data['spellcasting']:
-                spellcasting_string = str(spellcasting['headerEntries'])
-                spellcasting_feature = re.search(regex, spellcasting_string)
-                if spellcasting_feature:
-                    feature_value = int(spellcasting_feature.group(1))
-        return feature_value
+        return self.get_spellcasting()['caster_level']
+
+    def get_spellcasting(self):
+        # Every spellcasting feature comes out of one walk over the spellcasting entries; see spellcasting_analyzer
+        if self.spellcasting_analysis is None:
+            self.spellcasting_analysis = analyze_spellcasting(self.json_data.get('spellcasting'))
+        return self.spellcasting_analysis
 
     def get_traits(self):
         if 'traitTags' in self.json_data:
@@ -109,6 +108,15 @@ class FiveEToolsJSONWrapper:
         else:
             return []
 
+    def damage_modifier_masks(self):
+        # (immune, resist, vulnerable) bitmasks over global_type_dict; see damage_type_encoder
+        return (get_five_e_tools_damage_types_mask(self.json_data.get('immune'), 'immune'),
+                get_five_e_tools_damage_types_mask(self.json_data.get('resist'), 'resist'),
+                get_five_e_tools_damage_types_mask(self.json_data.get('vulnerable'), 'vulnerable'))
+
+    def condition_immunity_mask(self):
+        return get_five_e_tools_condition_mask(self.json_data.get('conditionImmune'))
+
     def get_features_array(monster_data):
         features = [
             monster_data.armor_class(),
@@ -141,69 +149,38 @@ class FiveEToolsJSONWrapper:
         return feature_array
 
     def get_damage_from_attacks(self):
+        # Expected damage per round if every attack hits: the multiattack if there is one we understand, otherwise the
+        # single best attack
+        attacks, multi_attack = self.get_attacks()
+        return get_damage_per_round(attacks, multi_attack)
+
+    def get_attacks(self):
+        # Returns ([(name, to_hit, expected damage per hit), ...], multiattack or None) for the actions we understand
         # What kind of creature has no actions? The super cool 'Guardian Portrait'!
         if 'action' not in self.json_data:
-            return 0
+            return [], None
 
-        # Get all attacks we actually understand
+        attacks = []
+        multi_attack = None
         for action in self.json_data['action']:
             attack_features = self.__get_attack_features(action)
-
-        if 'actionTags' in self.json_data and 'Multiattack' in self.json_data['actionTags']:
-            # Determine the kinds of attacks we're looking at
-            return
+            if action['name'].lower() == 'multiattack':
+                multi_attack = parse_multiattack(' '.join(entry for entry in action['entries']
+                                                          if isinstance(entry, str)))
+            elif 'to_hit' in attack_features and 'damage_entries' in attack_features:
+                attacks.append((attack_features['name'], attack_features['to_hit'],
+                                sum(damage_entry['expected_damage']
+                                    for damage_entry in attack_features['damage_entries'])))
+        return attacks, multi_attack
 
     def __get_attack_features(self, attack_entry):
-        attack_features = {}
-        attack_features['name'] = attack_entry['name']
-
         #if len(attack_entry['entries']) > 1:
         #    print('Found an attack entry with multiple elements: ' + str(attack_entry))
-
-        to_hit_regex = r'{@hit ([0-9]+)}'
-        to_hit_result = re.search(to_hit_regex, attack_entry['entries'][0])
-        if to_hit_result:
-            attack_features['to_hit'] = int(to_hit_result.group(1))
-
-        attack_type_regex = r'{@atk ([A-z]+)}'
-        attack_type_result = re.search(attack_type_regex, attack_entry['entries'][0])
-        if attack_type_result:
-            attack_features['type'] = attack_type_result.group(1)
-
-        reach_regex = r'reach ([0-9]+)/?([0-9]+)? ft\.,'
-        reach_result = re.search(reach_regex, attack_entry['entries'][0])
-        if reach_result:
-            attack_features['range'] = int(reach_result.group(1)) # Just ignore the range with disadvantage
-
-        # Note: The 'takes' clause literally only exists for the Fire Giant Dreadnought, for an action that isn't even
-        # an attack, so the or clause doesn't blow up. Probably should get rid of it from the regex, this is a dirty
-        # hack!
-        damage_regex = r'(takes|or|plus|\{\@h\}) ?([0-9]+) ?(?:\(\{@damage ([d0-9\+\- ]+)\}(?: plus \{@damage ([d0-9\+\- ]+)\})?\))? ([A-z]+)? ?damage'
-        damage_results = re.findall(damage_regex, attack_entry['entries'][0])
-        if damage_results:
-            damage_entries = []
-            for damage_result in damage_results:
-                clause = damage_result[0]
-                if damage_result[2]:  # There is a damage dice string; use that!
-                    expected_damage = get_expected_damage_from_dice_string(damage_result[2])
-                else: # Default to the stated damage otherwise
-                    expected_damage = int(damage_result[1])
-                if damage_result[3]: # There is a secondary damage dice string; add it!
-                    expected_damage = expected_damage + get_expected_damage_from_dice_string(damage_result[3])
-                damage_entry = {
-                    'expected_damage': expected_damage,
-                    'damage_type': damage_result[4]
-                }
-                # If clause is 'or' and the expected damage is higher than the previous entry, replace previous entry
-                # e.g: 14 ({@damage 2d6 + 7}) slashing damage, or 17 ({@damage 2d6 + 10}) slashing damage while raging
-                if clause == 'or':
-                    if len(damage_entries) == 0:
-                        raise Exception('An attack damage entry has an or clause with no preceding entry: ' + attack_entry['entries'][0])
-                    if damage_entries[-1]['expected_damage'] > damage_entry['expected_damage']:
-                        damage_entries[-1] = damage_entry
-                else:
-                    damage_entries.append(damage_entry)
-            attack_features['damage_entries'] = damage_entries
-        return attack_features
+        return parse_attack_entry(attack_entry)
 
 
+# Only timed when pipeline_instrumentation is on
+instrument_class(FiveEToolsJSONWrapper, [
+    'armor_class', 'hp', 'attributes', 'saves', 'save', 'challenge_rating', 'get_spellcasting', 'get_traits',
+    'damage_modifier_masks', 'condition_immunity_mask', 'get_features_array', 'get_damage_from_attacks', 'get_attacks',
+    '_FiveEToolsJSONWrapper__get_traits_array', '_FiveEToolsJSONWrapper__get_attack_features'])
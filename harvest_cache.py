@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+
+# On-disk state that lets a harvest be interrupted and rerun cheaply:
+#   ResponseCache keeps the last body and validators (ETag/Last-Modified) for every URL, so reruns send conditional
+#   requests and the server can answer 304 instead of resending the page.
+#   HarvestCheckpoint is an append-only JSON Lines file of parsed monsters, written as each page finishes. A crash loses
+#   at most the pages that were in flight, and pages whose html hasn't changed are never reparsed.
+
+
+def get_page_hash(page):
+    return hashlib.sha1(page.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_location):
+        self.cache_location = cache_location
+        os.makedirs(cache_location, exist_ok=True)
+
+    def __get_entry_location(self, url):
+        return os.path.join(self.cache_location, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def get_conditional_headers(self, url):
+        metadata = self.__load_metadata(url)
+        if metadata is None:
+            return {}
+        headers = {}
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        return headers
+
+    def load(self, url):
+        # Returns the cached body, or None if there isn't one
+        if self.__load_metadata(url) is None:
+            return None
+        try:
+            with open(self.__get_entry_location(url) + '.html', 'r', encoding='utf-8') as page_file:
+                return page_file.read()
+        except OSError:
+            return None
+
+    def store(self, url, page, etag=None, last_modified=None):
+        # Body first, then metadata: a crash in between leaves a body without metadata, which is just a cache miss
+        entry_location = self.__get_entry_location(url)
+        with open(entry_location + '.html.tmp', 'w', encoding='utf-8') as page_file:
+            page_file.write(page)
+        os.replace(entry_location + '.html.tmp', entry_location + '.html')
+        with open(entry_location + '.json.tmp', 'w') as metadata_file:
+            json.dump({'url': url, 'etag': etag, 'last_modified': last_modified}, metadata_file)
+        os.replace(entry_location + '.json.tmp', entry_location + '.json')
+
+    def __load_metadata(self, url):
+        try:
+            with open(self.__get_entry_location(url) + '.json', 'r') as metadata_file:
+                metadata = json.load(metadata_file)
+        except (OSError, ValueError):
+            return None
+        # Guard against the (very unlikely) hash collision
+        return metadata if metadata.get('url') == url else None
+
+
+class HarvestCheckpoint:
+    # Each line is {"url": ..., "page_hash": ..., "monster": {...}}; when a page is reparsed the newer line wins
+    def __init__(self, checkpoint_location):
+        self.checkpoint_location = checkpoint_location
+        self.records = {}
+        self.__load()
+        self.checkpoint_file = open(checkpoint_location, 'a', encoding='utf-8')
+        if self.__ends_mid_line():
+            # The last write was cut short; start on a fresh line so the next record isn't glued onto it
+            self.checkpoint_file.write('\n')
+
+    def __ends_mid_line(self):
+        if not os.path.getsize(self.checkpoint_location):
+            return False
+        with open(self.checkpoint_location, 'rb') as checkpoint_file:
+            checkpoint_file.seek(-1, os.SEEK_END)
+            return checkpoint_file.read(1) != b'\n'
+
+    def __load(self):
+        if not os.path.exists(self.checkpoint_location):
+            return
+        with open(self.checkpoint_location, 'r', encoding='utf-8') as checkpoint_file:
+            for line in checkpoint_file:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; that page simply gets parsed again
+                    continue
+                self.records[record['url']] = record
+        print('Loaded ' + str(len(self.records)) + ' harvested monsters from: ' + str(self.checkpoint_location))
+
+    def get(self, url, page_hash=None):
+        # Returns the checkpointed monster for url (only if it was parsed from this exact page, given page_hash)
+        record = self.records.get(url)
+        if record is None or (page_hash is not None and record['page_hash'] != page_hash):
+            return None
+        return record['monster']
+
+    def append(self, url, page_hash, monster_data):
+        record = {'url': url, 'page_hash': page_hash, 'monster': monster_data}
+        self.records[url] = record
+        self.checkpoint_file.write(json.dumps(record, sort_keys=True) + '\n')
+        self.checkpoint_file.flush()
+
+    def close(self):
+        self.checkpoint_file.close()
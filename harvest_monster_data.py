@@ -1,4 +1,6 @@
+from aidedd_stat_block import parse_stat_block
 from bs4 import BeautifulSoup
+from multiattack_grammar import parse_multiattack
 from functools import reduce
 import json
 import re
@@ -6,18 +8,40 @@ import requests
 import time
 import traceback
 
+AIDEDD_BASE_URL = 'https://www.aidedd.org'
+MONSTER_INDEX_PATH = '/dnd-filters/monsters.php'
+MONSTER_PAGE_PATH = '/dnd/monstres.php?vo='
+
+# 'soup' builds a BeautifulSoup tree of the whole page; 'stat_block' only parses the stat block (see aidedd_stat_block)
+# and is several times faster. Both produce the same monster data.
+PARSE_BACKENDS = ('soup', 'stat_block')
+
+# An action paragraph, optionally with a second ('plus') damage clause, e.g:
+# Bite. Melee Weapon Attack: +4 to hit, reach 5 ft., one target. Hit: 7 (2d4 + 2) piercing damage.
+AIDEDD_ATTACK_REGEX = re.compile(
+    r'''([A-z]+). ([A-z]+) Weapon Attack: ([+\-0-9]+) to hit, reach ([0-9]+) ft., ([A-z ]+). Hit: ([0-9]+) \(([ d+\-0-9]+)\) ([A-z ]+) damage'''
+    r'''(?: plus ([0-9]+) \(([ d+\-0-9]+)\) ([A-z ]+) damage)?([\(\)\.,' 0-9A-z ]+)''')
+
 PSB_CONSTANT = 'bludgeoning, piercing, and slashing'
 PSB_CONSTANT_ALTER = 'bludgeoning, piercing and slashing'  # specially made for the tarrasque
 
 
 # Currently takes session as a parameter... this should be a managed object which internally maintains a session
-def parse_monster_from_aidedd_link(session, url):
+def parse_monster_from_aidedd_link(session, url, backend='soup'):
+    return parse_monster_from_aidedd_html(session.get(url).text, backend)
+
+
+def parse_monster_from_aidedd_html(monster_raw_html, backend='soup'):
     monster_data = {}
 
-    monster_raw_html = session.get(url).text
-    monster_html = BeautifulSoup(monster_raw_html, 'html.parser')
     # 'bloc' is specific to aidedd.org
-    stat_block = monster_html.find_all('div', class_='bloc')[0]
+    if backend == 'stat_block':
+        stat_block = parse_stat_block(monster_raw_html)
+    elif backend == 'soup':
+        monster_html = BeautifulSoup(monster_raw_html, 'html.parser')
+        stat_block = monster_html.find_all('div', class_='bloc')[0]
+    else:
+        raise Exception('Unknown parse backend: ' + str(backend))
 
     monster_data['name'] = stat_block.h1.get_text()
 
@@ -121,79 +145,31 @@ def parse_monster_from_aidedd_link(session, url):
                     'description': ''.join(
                         map(lambda x: x.text if getattr(x, "text", None) else x, feature_html.contents[1:]))[2:]}
             elif phase == 2:
-                complex_attack_regex = '''([A-z]+). ([A-z]+) Weapon Attack: ([+\-0-9]+) to hit, reach ([0-9]+) ft., ([A-z ]+). Hit: ([0-9]+) \(([ d+\-0-9]+)\) ([A-z ]+) damage plus ([0-9]+) \(([ d+\-0-9]+)\) ([A-z ]+) damage([\(\)\.,' 0-9A-z ]+)'''
-                complex_attack_attributes = re.search(complex_attack_regex, feature_html.text)
-                if complex_attack_attributes:
+                attack_attributes = AIDEDD_ATTACK_REGEX.search(feature_html.text)
+                # TODO: support limited use actions (e.g Enlarge (one per short or long rest))
+                # TODO: attack type can also be 'Melee or Ranged Weapon Attack' but we only expect one word right now...
+                if attack_attributes:
                     attack = {'type': 'attack'}
-                    attack['name'] = complex_attack_attributes.group(1)
-                    attack['attack_type'] = complex_attack_attributes.group(2).lower()
-                    attack['to_hit'] = int(complex_attack_attributes.group(3))
-                    attack['reach'] = int(complex_attack_attributes.group(4))
-                    attack['target'] = complex_attack_attributes.group(5)
-                    attack['expected_damage'] = int(complex_attack_attributes.group(6))
-                    attack['damage_string'] = complex_attack_attributes.group(7)
-                    attack['damage_type'] = complex_attack_attributes.group(8)
-                    attack['secondary_expected_damage'] = int(complex_attack_attributes.group(9))
-                    attack['secondary_damage_string'] = complex_attack_attributes.group(10)
-                    attack['secondary_damage_type'] = complex_attack_attributes.group(11)
-                    attack['additional'] = complex_attack_attributes.group(12)[2:]
+                    attack['name'] = attack_attributes.group(1)
+                    attack['attack_type'] = attack_attributes.group(2).lower()
+                    attack['to_hit'] = int(attack_attributes.group(3))
+                    attack['reach'] = int(attack_attributes.group(4))
+                    attack['target'] = attack_attributes.group(5)
+                    attack['expected_damage'] = int(attack_attributes.group(6))
+                    attack['damage_string'] = attack_attributes.group(7)
+                    attack['damage_type'] = attack_attributes.group(8)
+                    if attack_attributes.group(9):
+                        attack['secondary_expected_damage'] = int(attack_attributes.group(9))
+                        attack['secondary_damage_string'] = attack_attributes.group(10)
+                        attack['secondary_damage_type'] = attack_attributes.group(11)
+                    attack['additional'] = attack_attributes.group(12)[2:]
                     monster_actions[attack['name'].lower()] = attack
-                else:
-                    attack_regex = '''([A-z]+). ([A-z]+) Weapon Attack: ([+\-0-9]+) to hit, reach ([0-9]+) ft., ([A-z ]+). Hit: ([0-9]+) \(([ d+\-0-9]+)\) ([A-z ]+) damage([\(\)\.,' 0-9A-z ]+)'''
-                    attack_attributes = re.search(attack_regex, feature_html.text)
-                    # TODO: support limited use actions (e.g Enlarge (one per short or long rest))
-                    # TODO: attack type can also be 'Melee or Ranged Weapon Attack' but we only expect one word right now...
-                    if attack_attributes:
-                        attack = {'type': 'attack'}
-                        attack['name'] = attack_attributes.group(1)
-                        attack['attack_type'] = attack_attributes.group(2).lower()
-                        attack['to_hit'] = int(attack_attributes.group(3))
-                        attack['reach'] = int(attack_attributes.group(4))
-                        attack['target'] = attack_attributes.group(5)
-                        attack['expected_damage'] = int(attack_attributes.group(6))
-                        attack['damage_string'] = attack_attributes.group(7)
-                        attack['damage_type'] = attack_attributes.group(8)
-                        attack['additional'] = attack_attributes.group(9)[2:]
-                        monster_actions[attack['name'].lower()] = attack
 
-                # Parse multi-attacks... there's three, no four, formats I've seen so far
-                # TODO: Abstract these into functions to avoid namespace pollution
-                simple_multi_attack_regex = '''Multiattack. The [A-z ]+ makes ([A-z]+) ([A-z]+) attacks.'''
-                simple_multi_attack_attributes = re.search(simple_multi_attack_regex, feature_html.text)
-                if simple_multi_attack_attributes:
-                    multi_attack = {'type': 'multi_attack', 'attacks': []}
-                    multi_attack['attacks'].append({
-                        'quantity': number_string_to_number(simple_multi_attack_attributes.group(1)),
-                        'attack': simple_multi_attack_attributes.group(2)})
-                    monster_actions['multi_attack'] = multi_attack
-                    # TODO: Split on commas and then parse each attack individually
-                complex_multi_attack_regex = '''Multiattack. The [A-z ]+ makes [A-z]+ attacks: ([A-z]+) with its ([A-z]+) and ([A-z]+) with its ([A-z]+)'''
-                complex_multi_attack_attributes = re.search(complex_multi_attack_regex, feature_html.text)
-                if complex_multi_attack_attributes:
-                    multi_attack = {'type': 'multi_attack', 'attacks': []}
-                    multi_attack['attacks'].append({
-                        'quantity': number_string_to_number(complex_multi_attack_attributes.group(1)),
-                        'attack': complex_multi_attack_attributes.group(2)})
-                    multi_attack['attacks'].append({
-                        'quantity': number_string_to_number(complex_multi_attack_attributes.group(3)),
-                        'attack': complex_multi_attack_attributes.group(4)})
-                    monster_actions['multi_attack'] = multi_attack
-                    # TODO: Split on commas and then parse each attack individually
-                really_complex_multi_attack_regex = '''Multiattack. The [A-z ]+ can use its ([A-z ]+). It then makes [A-z]+ attacks: ([A-z]+) with its ([A-z]+) and ([A-z]+) with its ([A-z]+)'''
-                really_complex_multi_attack_attributes = re.search(really_complex_multi_attack_regex, feature_html.text)
-                if really_complex_multi_attack_attributes:
-                    multi_attack = {'type': 'multi_attack', 'attacks': []}
-                    multi_attack['attacks'].append({
-                        'quantity': 1,
-                        'optional': True,
-                        'attack': really_complex_multi_attack_attributes.group(1)})
-                    multi_attack['attacks'].append({
-                        'quantity': number_string_to_number(really_complex_multi_attack_attributes.group(2)),
-                        'attack': really_complex_multi_attack_attributes.group(3)})
-                    multi_attack['attacks'].append({
-                        'quantity': number_string_to_number(really_complex_multi_attack_attributes.group(4)),
-                        'attack': really_complex_multi_attack_attributes.group(5)})
-                    monster_actions['multi_attack'] = multi_attack
+                # Every multiattack format we know of is handled by the grammar in multiattack_grammar
+                if feature_html.text.startswith('Multiattack'):
+                    multi_attack = parse_multiattack(feature_html.text)
+                    if multi_attack:
+                        monster_actions['multi_attack'] = multi_attack
 
     monster_data['features'] = monster_features
     monster_data['actions'] = monster_actions
@@ -205,36 +181,22 @@ def parse_monster_from_aidedd_link(session, url):
     return monster_data
 
 
-def number_string_to_number(number_string):
-    if number_string == 'one':
-        return 1
-    elif number_string == 'two':
-        return 2
-    elif number_string == 'three':
-        return 3
-    elif number_string == 'four':
-        return 4
-    elif number_string == 'five':
-        return 5
-    elif number_string == 'six':
-        return 6
-    else:
-        return Exception('Unrecognized number: ' + number_string)
-
-
-def get_urls_to_query(session):
+def get_urls_to_query(session, base_url=AIDEDD_BASE_URL):
     # return ['https://www.aidedd.org/dnd/monstres.php?vo=kuo-toa']
     #         'https://www.aidedd.org/dnd/monstres.php?vo=kuo-toa-archpriest',
     #         'https://www.aidedd.org/dnd/monstres.php?vo=kuo-toa-whip',
     #         'https://www.aidedd.org/dnd/monstres.php?vo=spy',
     #         'https://www.aidedd.org/dnd/monstres.php?vo=yuan-ti-pureblood']
     # Just get all of the links we can actually query from aidedd.org
-    url = 'https://www.aidedd.org/dnd-filters/monsters.php'
-    monster_index_html = BeautifulSoup(session.get(url).text, 'html.parser')
+    return get_urls_from_index_html(session.get(base_url + MONSTER_INDEX_PATH).text, base_url)
+
+
+def get_urls_from_index_html(monster_index_raw_html, base_url=AIDEDD_BASE_URL):
+    monster_index_html = BeautifulSoup(monster_index_raw_html, 'html.parser')
     urls = []
     for a_block in monster_index_html.find_all('a'):
         potential_url = a_block['href']
-        if 'https://www.aidedd.org/dnd/monstres.php?vo=' in potential_url:
+        if base_url + MONSTER_PAGE_PATH in potential_url:
             urls.append(potential_url)
     return urls
 
@@ -0,0 +1,188 @@
+import os
+import time
+
+import numpy as np
+
+from feature_matrix import FEATURE_COUNT, FEATURE_EXTRACTOR_VERSION
+from model_store import get_training_fingerprint, load_model_artifact, save_model_artifact
+
+# Keeps a saved regressor up to date as monsters are added, edited or removed, without refitting from scratch.
+# Next to the model artifact sits a training snapshot (<artifact>.snapshot.npz): the key ((name, source)) and content
+# hash of every monster the model was trained on, plus the training matrix itself. A new training set is diffed
+# against it and only the delta is trained on with partial_fit, mixed with a replay sample of unchanged monsters so
+# the rest of the bestiary isn't forgotten. A full refit still happens when:
+#     there's no snapshot, or the feature schema changed since it was written
+#     more than MAX_CHANGED_FRACTION of the monsters changed (partial_fit can't unlearn removed monsters, so they
+#     count too)
+#     any feature column's mean moved by more than MAX_FEATURE_DRIFT standard deviations
+#     the updated model scores more than MAX_SCORE_DROP below the previous one on the new training set
+# Bump the snapshot version if its layout changes.
+
+TRAINING_SNAPSHOT_VERSION = 1
+MAX_CHANGED_FRACTION = 0.1
+MAX_FEATURE_DRIFT = 0.25
+MAX_SCORE_DROP = 0.02
+INCREMENTAL_EPOCHS = 50
+# Unchanged monsters replayed per changed monster in each partial_fit batch
+REPLAY_RATIO = 4
+
+
+def get_snapshot_key(monster_record):
+    # copy_resolver.get_monster_key of the record's json, without inflating it
+    return monster_record.name.lower() + '|' + (monster_record.source or '').lower()
+
+
+def get_snapshot_location(model_artifact_location):
+    return model_artifact_location + '.snapshot.npz'
+
+
+def save_training_snapshot(model_artifact_location, monster_keys, content_hashes, monster_features, monster_crs,
+                           score, full_fit_seconds):
+    snapshot_location = get_snapshot_location(model_artifact_location)
+    with open(snapshot_location + '.tmp', 'wb') as snapshot_file:
+        np.savez(snapshot_file,
+                 version=TRAINING_SNAPSHOT_VERSION,
+                 feature_schema_version=FEATURE_EXTRACTOR_VERSION,
+                 feature_count=FEATURE_COUNT,
+                 monster_keys=np.asarray(monster_keys, dtype=str),
+                 content_hashes=np.asarray(content_hashes, dtype=str),
+                 features=monster_features,
+                 crs=monster_crs,
+                 score=score,
+                 full_fit_seconds=full_fit_seconds)
+    os.replace(snapshot_location + '.tmp', snapshot_location)
+
+
+def load_training_snapshot(model_artifact_location):
+    # Returns None unless there's a snapshot written for the current snapshot layout and feature schema
+    snapshot_location = get_snapshot_location(model_artifact_location)
+    if not os.path.exists(snapshot_location):
+        return None
+    with np.load(snapshot_location) as snapshot_file:
+        snapshot = {key: snapshot_file[key] for key in snapshot_file.files}
+    if int(snapshot['version']) != TRAINING_SNAPSHOT_VERSION \
+            or int(snapshot['feature_schema_version']) != FEATURE_EXTRACTOR_VERSION \
+            or int(snapshot['feature_count']) != FEATURE_COUNT:
+        return None
+    return snapshot
+
+
+def get_training_delta(snapshot, monster_keys, content_hashes):
+    # Returns (added, changed, removed, unchanged_rows); added and changed are row numbers into the new training set,
+    # removed is keys, unchanged_rows are rows in the new training set whose monster is exactly as it was
+    snapshot_hashes = dict(zip(snapshot['monster_keys'].tolist(), snapshot['content_hashes'].tolist()))
+    added = []
+    changed = []
+    unchanged_rows = []
+    for row, (monster_key, content_hash) in enumerate(zip(monster_keys, content_hashes)):
+        snapshot_hash = snapshot_hashes.get(monster_key)
+        if snapshot_hash is None:
+            added.append(row)
+        elif snapshot_hash != content_hash:
+            changed.append(row)
+        else:
+            unchanged_rows.append(row)
+    removed = sorted(set(snapshot_hashes) - set(monster_keys))
+    return added, changed, removed, unchanged_rows
+
+
+def get_feature_drift(previous_features, monster_features):
+    # Largest shift of any column's mean, in standard deviations of the previous training set
+    if len(previous_features) == 0 or len(monster_features) == 0:
+        return float('inf')
+    standard_deviations = previous_features.std(axis=0)
+    standard_deviations[standard_deviations == 0] = 1.0
+    return float(np.max(np.abs(monster_features.mean(axis=0) - previous_features.mean(axis=0)) / standard_deviations))
+
+
+def update_regressor(monster_features, monster_crs, monster_keys, content_hashes, model_artifact_location,
+                     fit_regressor, model_key=None, regressor_parameters=None):
+    # Returns the regressor for this training set: the saved one if nothing changed, the saved one updated with
+    # partial_fit if little changed, otherwise fit_regressor(monster_features, monster_crs) from scratch.
+    # monster_keys (see get_snapshot_key) and content_hashes line up with the rows of monster_features. The model
+    # artifact is saved under model_key (see model_store.get_model_key). regressor_parameters are the get_params() of
+    # the regressor fit_regressor builds; a saved model with other hyperparameters is never updated, only replaced.
+    start = time.perf_counter()
+    model_artifact = load_model_artifact(model_artifact_location)
+    snapshot = load_training_snapshot(model_artifact_location) if model_artifact is not None else None
+    full_refit_reason = None
+    if snapshot is None:
+        full_refit_reason = 'no training snapshot for this feature schema'
+    elif not hasattr(model_artifact['regressor'], 'partial_fit'):
+        full_refit_reason = type(model_artifact['regressor']).__name__ + ' has no partial_fit'
+    elif regressor_parameters is not None and model_artifact['regressor'].get_params() != regressor_parameters:
+        full_refit_reason = 'hyperparameters changed'
+    else:
+        added, changed, removed, unchanged_rows = get_training_delta(snapshot, monster_keys, content_hashes)
+        print('Training delta: ' + str(len(added)) + ' added, ' + str(len(changed)) + ' changed, '
+              + str(len(removed)) + ' removed')
+        changed_fraction = (len(added) + len(changed) + len(removed)) / max(len(snapshot['monster_keys']), 1)
+        feature_drift = get_feature_drift(snapshot['features'], monster_features)
+        if not added and not changed and not removed:
+            print('Training set unchanged; using model from: ' + str(model_artifact_location))
+            if model_key is not None and model_artifact.get('model_key') != model_key:
+                save_model_artifact(model_artifact_location, model_artifact['regressor'],
+                                    model_artifact['training_fingerprint'], model_artifact['fit_seconds'],
+                                    model_artifact['training_size'], model_key)
+            return model_artifact['regressor']
+        if changed_fraction > MAX_CHANGED_FRACTION:
+            full_refit_reason = format(changed_fraction * 100, '.1f') + '% of monsters changed'
+        elif feature_drift > MAX_FEATURE_DRIFT:
+            full_refit_reason = 'feature means drifted by ' + format(feature_drift, '.2f') + ' standard deviations'
+        else:
+            regressor = model_artifact['regressor']
+            __partial_fit(regressor, monster_features, monster_crs, added + changed, unchanged_rows)
+            score = regressor.score(monster_features, monster_crs)
+            previous_score = float(snapshot['score'])
+            if score < previous_score - MAX_SCORE_DROP:
+                full_refit_reason = 'incremental update scored ' + format(score, '.4f') + ' against ' \
+                                    + format(previous_score, '.4f') + ' before'
+            else:
+                seconds = time.perf_counter() - start
+                full_fit_seconds = float(snapshot['full_fit_seconds'])
+                print('Incremental update took ' + format(seconds, '.2f') + 's against '
+                      + format(full_fit_seconds, '.2f') + 's for the last full fit (saved '
+                      + format(full_fit_seconds - seconds, '.2f') + 's); score ' + format(score, '.4f'))
+                __save(model_artifact_location, regressor, monster_features, monster_crs, monster_keys,
+                       content_hashes, score, seconds, full_fit_seconds, model_key)
+                return regressor
+
+    print('Full refit: ' + full_refit_reason)
+    start = time.perf_counter()
+    regressor = fit_regressor(monster_features, monster_crs)
+    full_fit_seconds = time.perf_counter() - start
+    __save(model_artifact_location, regressor, monster_features, monster_crs, monster_keys, content_hashes,
+           regressor.score(monster_features, monster_crs), full_fit_seconds, full_fit_seconds, model_key)
+    return regressor
+
+
+def __partial_fit(regressor, monster_features, monster_crs, delta_rows, unchanged_rows):
+    # Removals alone leave nothing to train on; partial_fit can't unlearn them
+    if not delta_rows:
+        return
+    # MLPRegressor refuses partial_fit while early_stopping is set, and an early stopped fit leaves best_loss_ unset
+    early_stopping = getattr(regressor, 'early_stopping', False)
+    if early_stopping:
+        regressor.set_params(early_stopping=False)
+    if getattr(regressor, 'best_loss_', 0) is None:
+        regressor.best_loss_ = min(regressor.loss_curve_) if regressor.loss_curve_ else np.inf
+    random_state = np.random.RandomState(42)
+    delta_rows = np.asarray(delta_rows, dtype=np.intp)
+    unchanged_rows = np.asarray(unchanged_rows, dtype=np.intp)
+    replay_count = min(len(unchanged_rows), len(delta_rows) * REPLAY_RATIO)
+    try:
+        for epoch in range(INCREMENTAL_EPOCHS):
+            rows = np.concatenate([delta_rows, random_state.choice(unchanged_rows, replay_count, replace=False)])
+            random_state.shuffle(rows)
+            regressor.partial_fit(monster_features[rows], monster_crs[rows])
+    finally:
+        if early_stopping:
+            regressor.set_params(early_stopping=True)
+
+
+def __save(model_artifact_location, regressor, monster_features, monster_crs, monster_keys, content_hashes, score,
+           fit_seconds, full_fit_seconds, model_key):
+    save_model_artifact(model_artifact_location, regressor, get_training_fingerprint(monster_features, monster_crs),
+                        fit_seconds, len(monster_features), model_key)
+    save_training_snapshot(model_artifact_location, monster_keys, content_hashes, monster_features, monster_crs, score,
+                           full_fit_seconds)
@@ -0,0 +1,81 @@
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+# Usage: python prediction_server.py & python load_test_prediction_server.py --concurrency 32 --requests 2000
+# Fires concurrent /predict requests (evaluate.json by default) and reports throughput and latency percentiles.
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_load_test(url, request_body, concurrency, request_count):
+    latencies = []
+    server_latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [request_count]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                request = urllib.request.Request(url, data=request_body, headers={'Content-Type': 'application/json'})
+                with urllib.request.urlopen(request) as response:
+                    body = json.loads(response.read())
+                latency = time.perf_counter() - start
+                with lock:
+                    latencies.append(latency * 1000.0)
+                    server_latencies.append(body['latency_ms'])
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    server_latencies.sort()
+    return {
+        'requests': request_count,
+        'errors': len(errors),
+        'concurrency': concurrency,
+        'elapsed_seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms_p50': percentile(latencies, 0.50),
+        'latency_ms_p95': percentile(latencies, 0.95),
+        'latency_ms_p99': percentile(latencies, 0.99),
+        'server_latency_ms_p50': percentile(server_latencies, 0.50),
+        'server_latency_ms_p99': percentile(server_latencies, 0.99),
+        'first_error': errors[0] if errors else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the CR prediction server')
+    parser.add_argument('--url', default='http://127.0.0.1:8080/predict')
+    parser.add_argument('--monster', default='evaluate.json')
+    parser.add_argument('--batch-size', type=int, default=1, help='monsters per request')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    with open(args.monster, 'r') as monster_file:
+        monster = json.load(monster_file)
+    request_body = json.dumps(monster if args.batch_size == 1 else [monster] * args.batch_size).encode('utf-8')
+
+    print(json.dumps(run_load_test(args.url, request_body, args.concurrency, args.requests), indent=4))
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+
+from feature_matrix import FEATURE_COUNT, FEATURE_EXTRACTOR_VERSION
+
+# Trained regressors are saved together with everything needed to decide whether they're still valid: the feature
+# schema they were trained against, a fingerprint of the exact training matrix and a model key (see get_model_key)
+# that can be checked before the bestiary is even parsed. Bump the artifact version if the layout of the artifact
+# itself changes.
+MODEL_ARTIFACT_VERSION = 1
+
+
+def get_training_fingerprint(monster_features, monster_crs):
+    fingerprint = hashlib.sha1()
+    fingerprint.update(str(monster_features.shape).encode('utf-8'))
+    fingerprint.update(monster_features.tobytes())
+    fingerprint.update(monster_crs.tobytes())
+    return fingerprint.hexdigest()
+
+
+def get_model_key(bestiary_signature, regressor_parameters):
+    # Everything a fitted model depends on that's known up front: the bestiary file(s) (see
+    # bestiary_ingest.get_bestiary_signature), the feature schema and the regressor's hyperparameters
+    model_key = [bestiary_signature, FEATURE_EXTRACTOR_VERSION, FEATURE_COUNT, regressor_parameters]
+    return hashlib.sha1(json.dumps(model_key, sort_keys=True, default=repr).encode('utf-8')).hexdigest()
+
+
+def save_model_artifact(model_artifact_location, regressor, training_fingerprint, fit_seconds, training_size,
+                        model_key=None):
+    model_artifact = {
+        'artifact_version': MODEL_ARTIFACT_VERSION,
+        'feature_schema_version': FEATURE_EXTRACTOR_VERSION,
+        'feature_count': FEATURE_COUNT,
+        'model_key': model_key,
+        'training_fingerprint': training_fingerprint,
+        'training_size': training_size,
+        'fit_seconds': fit_seconds,
+        'trained_at': time.time(),
+        'regressor': regressor
+    }
+    directory = os.path.dirname(model_artifact_location)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(model_artifact_location + '.tmp', 'wb') as model_artifact_file:
+        pickle.dump(model_artifact, model_artifact_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(model_artifact_location + '.tmp', model_artifact_location)
+    print('Saved model to: ' + str(model_artifact_location))
+    return model_artifact
+
+
+def load_model_artifact(model_artifact_location, model_key=None):
+    # Returns None if there's no usable artifact: missing, unreadable, built for another artifact/feature schema, or
+    # (given a model_key) fitted for a different bestiary or hyperparameters
+    if not os.path.exists(model_artifact_location):
+        return None
+    try:
+        with open(model_artifact_location, 'rb') as model_artifact_file:
+            model_artifact = pickle.load(model_artifact_file)
+    except Exception as e:
+        print('Failed to load model from ' + str(model_artifact_location) + ': ' + str(e))
+        return None
+    if model_artifact.get('artifact_version') != MODEL_ARTIFACT_VERSION \
+            or model_artifact.get('feature_schema_version') != FEATURE_EXTRACTOR_VERSION \
+            or model_artifact.get('feature_count') != FEATURE_COUNT:
+        print('Model at ' + str(model_artifact_location) + ' was built for another feature schema; ignoring it')
+        return None
+    if model_key is not None and model_artifact.get('model_key') != model_key:
+        return None
+    return model_artifact
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import KFold
+from sklearn.neural_network import MLPRegressor
+
+from feature_matrix import FEATURE_COUNT, FEATURE_EXTRACTOR_VERSION, build_feature_matrix
+from feature_store import FeatureStore
+from regression import parse_monster_data_from_file
+
+# Usage: python model_sweep.py [--bestiary 5etools_data/beastiary.json] [--folds 5] [--workers N] [--output sweep.json]
+# Scores every regressor configuration in SWEEP_GRID with k-fold cross validation across a process pool, and prints a
+# table ranked by mean R^2. The feature matrix is put in shared memory once; workers map it instead of receiving a
+# pickled copy with every task.
+
+REGRESSORS = {
+    'LinearRegression': LinearRegression,
+    'RandomForestRegressor': RandomForestRegressor,
+    'MLPRegressor': MLPRegressor,
+}
+
+SWEEP_GRID = [
+    ('LinearRegression', {}),
+    ('RandomForestRegressor', {'n_estimators': 100, 'random_state': 42}),
+    ('RandomForestRegressor', {'n_estimators': 300, 'random_state': 42}),
+    ('RandomForestRegressor', {'n_estimators': 300, 'max_depth': 12, 'random_state': 42}),
+    # The first one is what fit_regressor trains today
+    ('MLPRegressor', {'max_iter': 100000, 'alpha': 0.01, 'random_state': 42, 'early_stopping': True}),
+    ('MLPRegressor', {'max_iter': 100000, 'alpha': 0.001, 'random_state': 42, 'early_stopping': True}),
+    ('MLPRegressor', {'max_iter': 100000, 'alpha': 0.1, 'random_state': 42, 'early_stopping': True}),
+    ('MLPRegressor', {'max_iter': 100000, 'alpha': 0.01, 'hidden_layer_sizes': (64, 64), 'random_state': 42,
+                      'early_stopping': True}),
+]
+
+# Set once per worker process by __attach_shared_matrix
+worker_state = {}
+
+
+def __share_array(array):
+    shared_block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shared_block.buf)[:] = array
+    return shared_block, (shared_block.name, array.shape, array.dtype.str)
+
+
+def __attach_shared_matrix(features_description, crs_description, fold_count):
+    for key, (name, shape, dtype) in (('features', features_description), ('crs', crs_description)):
+        shared_block = shared_memory.SharedMemory(name=name)
+        worker_state[key + '_block'] = shared_block  # Keep the mapping alive for the life of the worker
+        worker_state[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shared_block.buf)
+    # Every worker derives the same folds, so only (configuration, fold number) needs to be sent per task
+    worker_state['folds'] = list(KFold(n_splits=fold_count, shuffle=True, random_state=42)
+                                 .split(worker_state['features']))
+
+
+def __score_fold(task):
+    configuration_index, fold_index = task
+    regressor_name, parameters = SWEEP_GRID[configuration_index]
+    train_indices, test_indices = worker_state['folds'][fold_index]
+    features = worker_state['features']
+    crs = worker_state['crs']
+
+    start = time.perf_counter()
+    regressor = REGRESSORS[regressor_name](**parameters).fit(features[train_indices], crs[train_indices])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = regressor.predict(features[test_indices])
+    predict_seconds = time.perf_counter() - start
+
+    residual = np.sum((crs[test_indices] - predictions) ** 2)
+    total = np.sum((crs[test_indices] - np.mean(crs[test_indices])) ** 2)
+    score = 1.0 - residual / total if total > 0 else 0.0
+    return configuration_index, float(score), fit_seconds, predict_seconds / len(test_indices)
+
+
+def run_sweep(monster_features, monster_crs, fold_count=5, workers=None):
+    features_block, features_description = __share_array(np.ascontiguousarray(monster_features))
+    crs_block, crs_description = __share_array(np.ascontiguousarray(monster_crs))
+    try:
+        tasks = [(configuration_index, fold_index)
+                 for configuration_index in range(len(SWEEP_GRID)) for fold_index in range(fold_count)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=__attach_shared_matrix,
+                                 initargs=(features_description, crs_description, fold_count)) as executor:
+            fold_results = list(executor.map(__score_fold, tasks))
+    finally:
+        for shared_block in (features_block, crs_block):
+            shared_block.close()
+            shared_block.unlink()
+
+    results = []
+    for configuration_index, (regressor_name, parameters) in enumerate(SWEEP_GRID):
+        scores, fit_seconds, predict_seconds = zip(*[fold_result[1:] for fold_result in fold_results
+                                                     if fold_result[0] == configuration_index])
+        results.append({
+            'regressor': regressor_name,
+            'parameters': {key: value if not isinstance(value, tuple) else list(value)
+                           for key, value in parameters.items()},
+            'mean_score': float(np.mean(scores)),
+            'std_score': float(np.std(scores)),
+            'mean_fit_seconds': float(np.mean(fit_seconds)),
+            'predict_us_per_monster': float(np.mean(predict_seconds)) * 1e6
+        })
+    results.sort(key=lambda result: result['mean_score'], reverse=True)
+    return results
+
+
+def print_results(results):
+    print('{:<4} {:<22} {:>8} {:>7} {:>9} {:>11}  {}'.format(
+        'rank', 'regressor', 'score', 'std', 'fit (s)', 'predict us', 'parameters'))
+    for rank, result in enumerate(results, start=1):
+        parameters = {key: value for key, value in result['parameters'].items() if key != 'random_state'}
+        print('{:<4} {:<22} {:>8.4f} {:>7.4f} {:>9.2f} {:>11.2f}  {}'.format(
+            rank, result['regressor'], result['mean_score'], result['std_score'], result['mean_fit_seconds'],
+            result['predict_us_per_monster'], parameters))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cross validated sweep over regressors and hyperparameters')
+    parser.add_argument('--bestiary', default='5etools_data/beastiary.json')
+    parser.add_argument('--feature-cache', default='feature_cache')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', help='also write the ranked results to this json file')
+    args = parser.parse_args()
+
+    feature_store = FeatureStore(args.feature_cache, FEATURE_EXTRACTOR_VERSION, FEATURE_COUNT)
+    monster_features, monster_crs, _ = build_feature_matrix(parse_monster_data_from_file(args.bestiary),
+                                                            feature_store)
+    feature_store.save()
+    print('Sweeping ' + str(len(SWEEP_GRID)) + ' configurations x ' + str(args.folds) + ' folds over '
+          + str(len(monster_features)) + ' monsters')
+
+    results = run_sweep(monster_features, monster_crs, args.folds, args.workers)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
@@ -1,22 +1,15 @@
 import math
 import re
 
+from damage_type_encoder import CONDITION_FEATURE_COUNT, IMMUNE_VALUE, NORMAL_VALUE, RESISTANT_VALUE, \
+    VULNERABLE_VALUE, get_condition_mask, get_damage_types_mask, global_type_dict
+from dice_expression import get_expected_value
 
 
 def get_expected_damage_from_dice_string(dice_string):
-    dice_string_regex = r'([0-9]+)d([0-9]+) ?([\+|\-] [0-9]+)?'
-    dice_result = re.search(dice_string_regex, dice_string)
-    if dice_result:
-        dice_multiplier = int(dice_result.group(1))
-        dice_faces = int(dice_result.group(2))
-        # Isn't this nuts? Conventional scope rules blanche at this!
-        if dice_result.lastindex > 2:
-            flat_modifier = int(dice_result.group(3).translate(str.maketrans('', '', ' +'))) # clean number; '+ 5' -> '5'
-        else:
-            flat_modifier = 0
-        return dice_multiplier * (dice_faces + 1 / 2.0) + flat_modifier
-    else:
-        raise Exception('Unknown dice string  format: ' + dice_string)
+    # e.g: '2d6 + 4' -> 11.0, '1d6 + 4 plus 1d8' -> 12.0
+    return get_expected_value(dice_string)
+
 
 # --------------------------
 
@@ -24,49 +17,27 @@ def get_expected_damage_from_dice_string(dice_string):
 
 
 def convert_damage_type_lists_to_feature_array(immunity_type_list, resistance_type_list, vulnerability_type_list):
-    feature_array = [1] * len(global_type_dict.keys())
-    immunity_features = convert_damage_type_list_to_feature_array(immunity_type_list)
-    resistance_features = convert_damage_type_list_to_feature_array(resistance_type_list)
-    vulnerability_features = convert_damage_type_list_to_feature_array(vulnerability_type_list)
-    for i in range(0, len(feature_array)):
-        if immunity_features[i] == 1:
-            feature_array[i] = 3
-        elif vulnerability_features[i] == 1:
-            feature_array[i] = 0
-        elif resistance_features[i] == 1:
-            feature_array[i] = 2
-    return feature_array
+    # 3 = immune, 2 = resistant, 1 = normal, 0 = vulnerable, per entry of global_type_dict; immune beats vulnerable
+    # beats resistant
+    immunity_mask = get_damage_types_mask(immunity_type_list)
+    resistance_mask = get_damage_types_mask(resistance_type_list)
+    vulnerability_mask = get_damage_types_mask(vulnerability_type_list)
+    features = []
+    for index in range(len(global_type_dict)):
+        if (immunity_mask >> index) & 1:
+            features.append(IMMUNE_VALUE)
+        elif (vulnerability_mask >> index) & 1:
+            features.append(VULNERABLE_VALUE)
+        elif (resistance_mask >> index) & 1:
+            features.append(RESISTANT_VALUE)
+        else:
+            features.append(NORMAL_VALUE)
+    return features
 
 
 def convert_damage_type_list_to_feature_array(type_list):
-    feature_array = [0] * len(global_type_dict.keys())
-    for damage_type in type_list:
-        if damage_type == 'piercing from magic weapons wielded by good creatures':
-            # This damage type is incredibly rare, so just consider it piercing from magic weapons
-            damage_type = 'piercing-magical'
-
-        if 'bludgeoning, piercing, and slashing' in damage_type:
-            if '''nonmagical attacks that aren't silvered''' in damage_type \
-                    or '''bludgeoning, piercing, and slashing from nonmagical attacks not made with silvered weapons''' in damage_type:
-                feature_array[global_type_dict['bludgeoning-nonmagical-nonsilvered']] = 1
-                feature_array[global_type_dict['piercing-nonmagical-nonsilvered']] = 1
-                feature_array[global_type_dict['slashing-nonmagical-nonsilvered']] = 1
-            elif '''bludgeoning, piercing, and slashing from nonmagical attacks that aren't adamantine''' in damage_type:
-                feature_array[global_type_dict['bludgeoning-nonmagical-nonadamantine']] = 1
-                feature_array[global_type_dict['piercing-nonmagical-nonadamantine']] = 1
-                feature_array[global_type_dict['slashing-nonmagical-nonadamantine']] = 1
-            elif '''bludgeoning, piercing, and slashing from nonmagical attacks''' in damage_type \
-                    or 'nonmagical bludgeoning, piercing, and slashing from' in damage_type:
-                feature_array[global_type_dict['bludgeoning-nonmagical']] = 1
-                feature_array[global_type_dict['piercing-nonmagical']] = 1
-                feature_array[global_type_dict['slashing-nonmagical']] = 1
-        elif '''piercing and slashing from nonmagical attacks that aren't adamantine''' in damage_type:
-            # Thanks, xorn. If stuff like this keeps happening, then parse out the types and the modifiers
-            feature_array[global_type_dict['piercing-nonmagical']] = 1
-            feature_array[global_type_dict['slashing-nonmagical']] = 1
-        else:
-            feature_array[global_type_dict[damage_type]] = 1
-    return feature_array
+    mask = get_damage_types_mask(type_list)
+    return [(mask >> index) & 1 for index in range(len(global_type_dict))]
 
 
 def get_saving_throw_feature_array(monster_data):
@@ -115,8 +86,14 @@ def get_spellcasting_feature_array(monster_data):
 
 
 def __get_expected_damage_from_attack(attack):
-    damage = attack['expected_damage']
-    if 'secondary_expected_damage' in attack:
+    # Prefer the dice strings over the stated (rounded down) damage
+    if 'damage_string' in attack:
+        damage = get_expected_damage_from_dice_string(attack['damage_string'])
+    else:
+        damage = attack['expected_damage']
+    if 'secondary_damage_string' in attack:
+        damage += get_expected_damage_from_dice_string(attack['secondary_damage_string'])
+    elif 'secondary_expected_damage' in attack:
         damage += attack['secondary_expected_damage']
     return damage
 
@@ -171,72 +148,8 @@ def get_attack_features(monster_data):
     return [maximum_expected_damage]
 
 
-def __build_global_type_dict():
-    # TODO: move this to a constant
-    global_type_list = [
-        'acid',
-        'bludgeoning',
-        'bludgeoning-nonmagical',
-        'bludgeoning-nonmagical-nonsilvered',
-        'bludgeoning-nonmagical-nonadamantine',
-        'cold',
-        'damage from spells',
-        'fire',
-        'force',
-        'lightning',
-        'necrotic',
-        'piercing',
-        'piercing-nonmagical',
-        'piercing-magical',
-        'piercing-nonmagical-nonsilvered',
-        'piercing-nonmagical-nonadamantine',
-        'poison',
-        'psychic',
-        'radiant',
-        'slashing',
-        'slashing-nonmagical',
-        'slashing-nonmagical-nonsilvered',
-        'slashing-nonmagical-nonadamantine',
-        'thunder',
-    ]
-    type_dict = {}
-    for index, damage_type in enumerate(global_type_list):
-        type_dict[damage_type] = index
-    return type_dict
-
-
-global_type_dict = __build_global_type_dict()
 
 
 def get_condition_immunity_feature_array(monster_data):
-    feature_array = [0] * len(global_condition_dict.keys())
-    if 'condition_immunities' in monster_data:
-        for condition in monster_data['condition_immunities']:
-            feature_array[global_condition_dict[condition]] = 1
-    return feature_array
-
-
-def __build_global_condition_dict():
-    # TODO: move this to a constant
-    global_condition_list = [
-        'blinded',
-        'charmed',
-        'deafened',
-        'exhaustion',
-        'frightened',
-        'grappled',
-        'paralyzed',
-        'petrified',
-        'poisoned',
-        'prone',
-        'restrained',
-        'stunned',
-        'unconscious',
-    ]
-    condition_dict = {}
-    for index, condition_type in enumerate(global_condition_list):
-        condition_dict[condition_type] = index
-    return condition_dict
-
-
-global_condition_dict = __build_global_condition_dict()
+    mask = get_condition_mask(monster_data.get('condition_immunities', ()))
+    return [(mask >> index) & 1 for index in range(CONDITION_FEATURE_COUNT)]
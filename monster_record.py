@@ -0,0 +1,85 @@
+import hashlib
+import json
+import zlib
+from array import array
+
+from damage_type_encoder import UnrecognizedDamageTypeError
+from feature_matrix import ATTRIBUTES, TRAIT_FEATURES, trait_bit_dict
+from five_e_tools_json_wrapper import FiveEToolsJSONWrapper
+from multiattack_grammar import get_damage_per_round
+
+# A monster reduced to what the feature pipeline actually reads, extracted once from the raw 5etools json.
+# FiveEToolsJSONWrapper keeps the whole raw dict alive (fluff, entries text, skills, spell lists...) and re-walks it on
+# every accessor; a MonsterRecord is a handful of slots plus the raw json as a compressed blob, which is only inflated
+# if something asks for json_data. At tens of thousands of monsters that's the difference between the dicts dominating
+# memory and not.
+# regression.py trains on records (see regression.parse_monster_records_from_file); the reports and plots that need more
+# of the stat block than this still use FiveEToolsJSONWrappers.
+
+
+class MonsterRecord:
+    __slots__ = ('name', 'source', 'challenge_rating', 'armor_class', 'hp', 'attributes', 'saves',
+                 'spellcasting_to_hit', 'spellcasting_dc', 'trait_mask', 'attacks', 'damage_per_round',
+                 'damage_masks', 'condition_immunity_mask', 'content_hash', 'packed_json')
+
+    @classmethod
+    def from_json(cls, json_data):
+        # Raises if the monster can't be parsed, exactly where FiveEToolsJSONWrapper.get_features_array would, so the
+        # records make the same training matrix
+        monster_datum = FiveEToolsJSONWrapper(json_data)
+        record = cls()
+        record.name = monster_datum.name()
+        record.source = json_data.get('source')
+        record.challenge_rating = monster_datum.challenge_rating()
+        record.armor_class = monster_datum.armor_class()
+        record.hp = monster_datum.hp()
+        record.attributes = array('h', monster_datum.attributes())
+        record.saves = array('h', monster_datum.saves())
+        record.spellcasting_to_hit = monster_datum.get_spellcasting_to_hit()
+        record.spellcasting_dc = monster_datum.get_spellcasting_dc()
+        record.trait_mask = get_trait_mask(monster_datum.get_traits())
+        attacks, multi_attack = monster_datum.get_attacks()
+        record.attacks = tuple(attacks)
+        record.damage_per_round = get_damage_per_round(attacks, multi_attack)
+        # Not training columns, so a damage type we can't encode leaves the damage masks as None instead of dropping
+        # the monster. Unknown conditions already land on the 'other' bit.
+        try:
+            record.damage_masks = monster_datum.damage_modifier_masks()
+        except UnrecognizedDamageTypeError:
+            record.damage_masks = None
+        record.condition_immunity_mask = monster_datum.condition_immunity_mask()
+        serialized_json = json.dumps(json_data).encode('utf-8')
+        record.content_hash = hashlib.sha1(serialized_json).hexdigest()  # Same as feature_store.get_content_hash
+        record.packed_json = zlib.compress(serialized_json)
+        return record
+
+    @property
+    def json_data(self):
+        # Inflated on every access and never kept, so records stay small
+        return json.loads(zlib.decompress(self.packed_json))
+
+    # attribute = ['str', 'dex', 'con', 'int', 'wis', 'cha']
+    def attribute(self, attribute):
+        return self.attributes[ATTRIBUTES.index(attribute)]
+
+    def has_trait(self, trait):
+        return bool(self.trait_mask & trait_bit_dict.get(trait, 0))
+
+    def get_features_array(self):
+        # Same row as FiveEToolsJSONWrapper.get_features_array
+        features = [self.armor_class, self.hp, self.spellcasting_to_hit, self.spellcasting_dc]
+        features += self.saves.tolist()
+        features += [1 if self.has_trait(trait) else 0 for trait in TRAIT_FEATURES]
+        return features
+
+    def __repr__(self):
+        return 'MonsterRecord(' + repr(self.name) + ', ' + repr(self.source) + ', cr=' \
+            + str(self.challenge_rating) + ')'
+
+
+def get_trait_mask(traits):
+    trait_mask = 0
+    for trait in traits:
+        trait_mask |= trait_bit_dict.get(trait, 0)
+    return trait_mask
+
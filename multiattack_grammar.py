@@ -0,0 +1,132 @@
+import re
+
+# One compiled grammar for multiattack descriptions, shared by the aidedd.org harvester and the 5etools wrapper:
+#   The wolf makes two bite attacks.
+#   The goblin boss makes two attacks with its scimitar.
+#   The owlbear makes two attacks: one with its beak and one with its claws.
+#   The dragon can use its Frightful Presence. It then makes three attacks: one with its bite and two with its claws.
+#   The ettin makes two attacks: one with its battleaxe and one with its morningstar, or two with its javelins.
+#   The scout makes two melee attacks or two ranged attacks.
+# Any number of clauses is picked up in one findall, and ', or' starts an alternative set of attacks, as does an 'or'
+# between two counted attacks.
+# 5etools tags ({@spell fireball}, {@item longsword|phb}, ...) are reduced to their display text first; attack labels
+# ({@atk mw}, {@h}) are dropped.
+
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+    'once': 1, 'twice': 2, 'three times': 3, 'four times': 4
+}
+# Longest first, so 'three times' wins over 'three'
+NUMBER_PATTERN = '(?:' + '|'.join(sorted(map(re.escape, NUMBER_WORDS), key=len, reverse=True)) + r'|[0-9]+)\b'
+
+TAG_REGEX = re.compile(r'\{@(?P<tag>[a-zA-Z]+)(?: (?P<text>[^|}]*))?[^}]*\}')
+# Tags whose display text is a label ('Melee Weapon Attack:', 'Hit:') rather than part of the sentence
+DROPPED_TAGS = {'atk', 'h'}
+MULTIATTACK_REGEX = re.compile(
+    r'(?:can use its (?P<optional>[^.]+?)\. (?:It|They) then )?'
+    r'(?:makes (?P<count>' + NUMBER_PATTERN + r') (?P<kind>[A-Za-z\' ]*?)attacks?'
+    r'|attacks (?P<repeat>' + NUMBER_PATTERN + r'))'
+    r'(?::(?P<clauses>[^.]+)| with (?:its|his|her|their) (?P<weapon>[A-Za-z\' ]+?)(?=[.,;]| or |$))?',
+    re.IGNORECASE)
+CLAUSE_REGEX = re.compile(
+    r'(?P<separator>,? or )?\b(?P<quantity>' + NUMBER_PATTERN + r') with (?:its|his|her|their) '
+    r'(?P<attack>[A-Za-z\' ]+?)(?=,| and | or |\.|;|$)',
+    re.IGNORECASE)
+ALTERNATIVE_REGEX = re.compile(
+    r',? or (?:makes )?(?P<count>' + NUMBER_PATTERN + r') (?P<kind>[A-Za-z\' ]*?)attacks?'
+    r'(?: with (?:its|his|her|their) (?P<weapon>[A-Za-z\' ]+?)(?=[.,;]| or |$))?',
+    re.IGNORECASE)
+# Attacks that don't name a specific action ('two melee attacks') count as the monster's best attack
+GENERIC_ATTACK_KINDS = {'', 'melee', 'ranged', 'weapon', 'melee weapon', 'ranged weapon', 'natural'}
+
+
+def number_string_to_number(number_string):
+    number_string = number_string.lower()
+    if number_string.isdigit():
+        return int(number_string)
+    if number_string not in NUMBER_WORDS:
+        raise Exception('Unrecognized number: ' + number_string)
+    return NUMBER_WORDS[number_string]
+
+
+def strip_tags(text):
+    return TAG_REGEX.sub(__get_tag_display_text, text)
+
+
+def __get_tag_display_text(tag):
+    if tag.group('tag').lower() in DROPPED_TAGS:
+        return ''
+    return tag.group('text') or ''
+
+
+def parse_multiattack(text):
+    # Returns {'type': 'multi_attack', 'attacks': [...]} (plus 'alternatives', a list of attack lists, if there is an
+    # 'or'), or None if the text isn't a multiattack we understand
+    text = strip_tags(text)
+    multi_attack_attributes = MULTIATTACK_REGEX.search(text)
+    if multi_attack_attributes is None:
+        return None
+    optional, count, kind, repeat, clauses, weapon = multi_attack_attributes.group(
+        'optional', 'count', 'kind', 'repeat', 'clauses', 'weapon')
+
+    attack_sets = [[]]
+    if optional:
+        attack_sets[0].append({'quantity': 1, 'optional': True, 'attack': optional})
+    if clauses:
+        for separator, quantity, attack in CLAUSE_REGEX.findall(clauses):
+            if separator and attack_sets[-1]:
+                attack_sets.append([])
+            attack_sets[-1].append({'quantity': number_string_to_number(quantity), 'attack': attack.strip()})
+        if not any(attack_sets):
+            return None
+    else:
+        attack = weapon if weapon else (kind or '').strip()
+        attack_sets[0].append({'quantity': number_string_to_number(count or repeat), 'attack': attack})
+        alternative = ALTERNATIVE_REGEX.match(text, multi_attack_attributes.end())
+        while alternative is not None:
+            attack = alternative.group('weapon') or alternative.group('kind').strip()
+            attack_sets.append([{'quantity': number_string_to_number(alternative.group('count')), 'attack': attack}])
+            alternative = ALTERNATIVE_REGEX.match(text, alternative.end())
+
+    multi_attack = {'type': 'multi_attack', 'attacks': attack_sets[0]}
+    if len(attack_sets) > 1:
+        multi_attack['alternatives'] = attack_sets[1:]
+    return multi_attack
+
+
+def get_damage_per_round(attacks, multi_attack=None):
+    # attacks are (name, to_hit, expected damage per hit); the multiattack if there is one, otherwise the best attack
+    if not attacks:
+        return 0
+    attack_damage = {name.lower(): damage for name, _, damage in attacks}
+    if multi_attack is not None:
+        return get_multiattack_damage(multi_attack, attack_damage)
+    return max(attack_damage.values())
+
+
+def get_multiattack_damage(multi_attack, attack_damage):
+    # attack_damage maps lowercased attack names to expected damage per hit; takes the best of any alternatives
+    best_attack_damage = max(attack_damage.values(), default=0)
+    best_damage = 0
+    for attacks in [multi_attack['attacks']] + multi_attack.get('alternatives', []):
+        damage = 0
+        for attack in attacks:
+            if attack.get('optional'):
+                continue
+            damage += attack['quantity'] * __find_attack_damage(attack['attack'], attack_damage, best_attack_damage)
+        best_damage = max(best_damage, damage)
+    return best_damage
+
+
+def __find_attack_damage(attack_name, attack_damage, default):
+    attack_name = attack_name.lower()
+    if attack_name in GENERIC_ATTACK_KINDS:
+        return default
+    if attack_name in attack_damage:
+        return attack_damage[attack_name]
+    # 'claws' vs 'Claw', 'bite' vs 'Bite (Wolf Form Only)', 'longsword' vs 'Longsword +1'...
+    singular_name = attack_name[:-1] if attack_name.endswith('s') else attack_name
+    for name, damage in attack_damage.items():
+        if name.startswith(singular_name) or singular_name.startswith(name):
+            return damage
+    return default
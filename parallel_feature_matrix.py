@@ -0,0 +1,179 @@
+import json
+import multiprocessing
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bestiary_stream import stream_monster_records
+from feature_matrix import FEATURE_COUNT, build_feature_matrix
+from feature_store import get_content_hash
+from five_e_tools_json_wrapper import FiveEToolsJSONWrapper
+from pipeline_instrumentation import stage
+
+# build_feature_matrix (and bestiary_stream.stream_monster_records, see build_monster_records_parallel) sharded across a
+# process pool. The monsters are cut into chunks of consecutive indices; each
+# worker runs the ordinary build_feature_matrix over its chunk and sends back three arrays (features, crs, indices)
+# plus its parse failures, so a chunk costs one pickled buffer per array rather than one list per monster. Where
+# processes fork, the workers inherit monster_data and a task is just (start index, monster count); elsewhere each
+# task carries its chunk's json. Chunks are reassembled in monster order, so the result is the same matrix the serial
+# build_feature_matrix produces. Failures never print; they come back as get_parse_failure entries.
+
+CHUNK_SIZE = 512
+
+# Set in the parent just before the pool forks, so the workers see it without any pickling
+worker_state = {}
+
+
+def __extract_chunk(task):
+    start_index, chunk = task
+    if isinstance(chunk, int):
+        chunk_monster_data = worker_state['monster_data'][start_index:start_index + chunk]
+    else:
+        chunk_monster_data = [FiveEToolsJSONWrapper(raw_monster_datum) for raw_monster_datum in chunk]
+    failures = []
+    features, crs, monster_indices = build_feature_matrix(chunk_monster_data, failures=failures)
+    # Chunks are consecutive monsters, so indices into the chunk just need shifting back into monster_data
+    for failure in failures:
+        failure['index'] += start_index
+    return features, crs, monster_indices + start_index, failures
+
+
+def __make_record_chunk(task):
+    start_index, chunk = task
+    if isinstance(chunk, int):
+        chunk_monster_data = worker_state['monster_data'][start_index:start_index + chunk]
+    else:
+        chunk_monster_data = [FiveEToolsJSONWrapper(raw_monster_datum) for raw_monster_datum in chunk]
+    failures = []
+    monster_records = list(stream_monster_records(chunk_monster_data, failures=failures))
+    for failure in failures:
+        failure['index'] += start_index
+    return monster_records, failures
+
+
+def build_monster_records_parallel(monster_data, workers=None, chunk_size=CHUNK_SIZE, failures=None):
+    # Same MonsterRecords as stream_monster_records(monster_data), made across a process pool. A record pickles to a
+    # fraction of its raw json, so sending them back is cheap; unlike streaming, every raw dict is held until the pool
+    # is done. Pass a list as failures to get the parse failures back.
+    if failures is None:
+        failures = []
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = [(start_index, min(chunk_size, len(monster_data) - start_index))
+              for start_index in range(0, len(monster_data), chunk_size)]
+    with stage('make_monster_records_parallel'):
+        chunk_results = __map_chunks(__make_record_chunk, monster_data, chunks, workers)
+    monster_records = []
+    for chunk_records, chunk_failures in chunk_results:
+        monster_records += chunk_records
+        failures += chunk_failures
+    return monster_records
+
+
+def __map_chunks(function, monster_data, chunks, workers):
+    # function over (start index, monster count) chunks of monster_data, in order
+    worker_state['monster_data'] = monster_data
+    try:
+        if workers <= 1 or len(chunks) <= 1:
+            return [function(tuple(chunk)) for chunk in chunks]
+        if 'fork' in multiprocessing.get_all_start_methods():
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+                return list(executor.map(function, [tuple(chunk) for chunk in chunks]))
+        tasks = [(start_index, [monster_datum.json_data
+                                for monster_datum in monster_data[start_index:start_index + monster_count]])
+                 for start_index, monster_count in chunks]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(function, tasks))
+    finally:
+        worker_state.clear()
+
+
+def build_feature_matrix_parallel(monster_data, feature_store=None, workers=None, chunk_size=CHUNK_SIZE,
+                                  failures=None):
+    # Same (features, crs, monster_indices) as build_feature_matrix. workers=1 runs the chunks in this process, which
+    # is handy under a debugger. Pass a list as failures to get the parse failures back.
+    if failures is None:
+        failures = []
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Stored rows never leave this process; only the monsters that actually need extracting are shipped to workers
+    stored_indices = []
+    stored_crs = []
+    stored_features = []
+    pending_indices = []
+    content_hashes = {}
+    with stage('lookup_feature_store'):
+        for index, monster_datum in enumerate(monster_data):
+            if feature_store is not None:
+                try:
+                    challenge_rating = monster_datum.challenge_rating()
+                except Exception:
+                    pending_indices.append(index)  # Let the worker report it like any other failure
+                    continue
+                if challenge_rating <= 0:
+                    continue
+                content_hash = get_content_hash(monster_datum.json_data)
+                if feature_store.has_failed(content_hash):
+                    continue
+                stored_feature_row = feature_store.lookup(content_hash)
+                if stored_feature_row is not None:
+                    stored_indices.append(index)
+                    stored_crs.append(challenge_rating)
+                    stored_features.append(stored_feature_row)
+                    continue
+                content_hashes[index] = content_hash
+            pending_indices.append(index)
+
+    # Chunks of consecutive pending monsters as (start index, monster count); a gap left by a stored monster starts a
+    # new chunk
+    chunks = []
+    for index in pending_indices:
+        if chunks and chunks[-1][0] + chunks[-1][1] == index and chunks[-1][1] < chunk_size:
+            chunks[-1][1] += 1
+        else:
+            chunks.append([index, 1])
+
+    with stage('extract_features_parallel'):
+        chunk_results = __map_chunks(__extract_chunk, monster_data, chunks, workers)
+
+    features_blocks = [np.asarray(stored_features, dtype=np.float32).reshape(-1, FEATURE_COUNT)]
+    crs_blocks = [np.asarray(stored_crs, dtype=np.float32)]
+    indices_blocks = [np.asarray(stored_indices, dtype=np.intp)]
+    for features, crs, monster_indices, chunk_failures in chunk_results:
+        features_blocks.append(features)
+        crs_blocks.append(crs)
+        indices_blocks.append(monster_indices)
+        failures += chunk_failures
+    monster_indices = np.concatenate(indices_blocks)
+    order = np.argsort(monster_indices, kind='stable')
+    features = np.concatenate(features_blocks)[order]
+    crs = np.concatenate(crs_blocks)[order]
+    monster_indices = monster_indices[order]
+    failures.sort(key=lambda failure: failure['index'])
+
+    if feature_store is not None:
+        for row, index in enumerate(monster_indices):
+            if index in content_hashes:
+                feature_store.add(content_hashes[index], features[row])
+        for failure in failures:
+            if failure['index'] in content_hashes:
+                feature_store.add_failure(content_hashes[failure['index']])
+    return features, crs, monster_indices
+
+
+def print_failure_summary(failures, top=10):
+    if not failures:
+        return
+    print(str(len(failures)) + ' monsters failed to parse. Most common reasons:')
+    reasons = Counter(failure['error_type'] + ': ' + failure['message'][:100] for failure in failures)
+    for reason, reason_count in reasons.most_common(top):
+        print('  ' + str(reason_count).rjust(6) + '  ' + reason)
+
+
+def write_failure_report(failures, failure_report_location):
+    with open(failure_report_location, 'w') as failure_report_file:
+        json.dump({'failure_count': len(failures), 'failures': failures}, failure_report_file, indent=2)
+    print('Wrote parse failure report to: ' + str(failure_report_location))
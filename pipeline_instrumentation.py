@@ -0,0 +1,169 @@
+import atexit
+import contextlib
+import cProfile
+import functools
+import os
+import threading
+import time
+
+# Timers and counters around the stages of the training pipeline, e.g:
+#     with stage('build_feature_matrix'):
+#         ...
+#     count('parse_failures')
+# Off unless CR_PROFILE is set (or regression.py is run with --profile); while off, stage() hands back one shared
+# no-op context manager and count() returns straight away, so the hooks can stay in the hot loops.
+# CR_PROFILE=timers prints a per-stage table at exit and writes <output>.folded, one 'outer;inner;stage microseconds'
+# line per stage stack (flamegraph.pl and speedscope read it). CR_PROFILE=cprofile keeps the stage timers but runs
+# cProfile over the whole process in place of the accessor timers, and writes <output>.prof for pstats/snakeviz.
+# The output prefix is CR_PROFILE_OUTPUT, or 'pipeline_profile'.
+
+PROFILE_ENV_VAR = 'CR_PROFILE'
+PROFILE_OUTPUT_ENV_VAR = 'CR_PROFILE_OUTPUT'
+PROFILE_MODES = ('timers', 'cprofile')
+DEFAULT_PROFILE_OUTPUT = 'pipeline_profile'
+
+NULL_STAGE = contextlib.nullcontext()
+
+enabled = False
+profile_mode = None
+profile_output = DEFAULT_PROFILE_OUTPUT
+# name -> [calls, inclusive seconds, self seconds, max seconds]
+stage_timings = {}
+# 'outer;inner' -> self seconds
+folded_stacks = {}
+counters = {}
+instrumented_classes = []
+profiler = None
+stage_stacks = threading.local()
+timings_lock = threading.Lock()
+
+
+class StageTimer:
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+        self.child_seconds = 0.0
+
+    def __enter__(self):
+        stack = get_stage_stack()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        seconds = time.perf_counter() - self.start
+        stack = get_stage_stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_seconds += seconds
+        self_seconds = seconds - self.child_seconds
+        stack_key = ';'.join([timer.name for timer in stack] + [self.name])
+        with timings_lock:
+            timing = stage_timings.get(self.name)
+            if timing is None:
+                timing = stage_timings[self.name] = [0, 0.0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] += self_seconds
+            timing[3] = max(timing[3], seconds)
+            folded_stacks[stack_key] = folded_stacks.get(stack_key, 0.0) + self_seconds
+        return False
+
+
+def get_stage_stack():
+    if not hasattr(stage_stacks, 'stack'):
+        stage_stacks.stack = []
+    return stage_stacks.stack
+
+
+def stage(name):
+    if not enabled:
+        return NULL_STAGE
+    return StageTimer(name)
+
+
+def count(name, amount=1):
+    if not enabled:
+        return
+    with timings_lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def instrument_class(cls, method_names):
+    # Times every call to the named methods as a stage called 'Class.method'. The methods are only swapped out in
+    # timers mode, so an uninstrumented run calls the originals directly; cProfile already times every function and
+    # the wrappers would only add noise to its output.
+    instrumented_classes.append((cls, method_names))
+    if enabled and profile_mode == 'timers':
+        __wrap_methods(cls, method_names)
+    return cls
+
+
+def __wrap_methods(cls, method_names):
+    for method_name in method_names:
+        method = cls.__dict__[method_name]
+        if getattr(method, 'instrumented', False):
+            continue
+        display_name = cls.__name__ + '.' + method_name.replace('_' + cls.__name__, '')
+        setattr(cls, method_name, __timed(method, display_name))
+
+
+def __timed(function, name):
+    @functools.wraps(function)
+    def timed_function(*args, **kwargs):
+        with StageTimer(name):
+            return function(*args, **kwargs)
+    timed_function.instrumented = True
+    return timed_function
+
+
+def enable_instrumentation(mode='timers', output=None):
+    global enabled, profile_mode, profile_output, profiler
+    if mode not in PROFILE_MODES:
+        raise Exception('Unknown profile mode: ' + str(mode) + ' (expected one of ' + ', '.join(PROFILE_MODES) + ')')
+    if enabled:
+        return
+    enabled = True
+    profile_mode = mode
+    profile_output = output or os.environ.get(PROFILE_OUTPUT_ENV_VAR) or DEFAULT_PROFILE_OUTPUT
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        for cls, method_names in instrumented_classes:
+            __wrap_methods(cls, method_names)
+    atexit.register(write_report)
+
+
+def write_report():
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_output + '.prof')
+        print('Wrote cProfile stats to: ' + profile_output + '.prof')
+    with open(profile_output + '.folded', 'w') as folded_file:
+        for stack_key, seconds in sorted(folded_stacks.items()):
+            folded_file.write(stack_key + ' ' + str(int(round(seconds * 1000000))) + '\n')
+    print(format_summary())
+    print('Wrote folded stage stacks to: ' + profile_output + '.folded')
+
+
+def format_summary():
+    lines = ['Stage'.ljust(48) + 'calls'.rjust(10) + 'total s'.rjust(11) + 'self s'.rjust(11) + 'mean ms'.rjust(11)
+             + 'max ms'.rjust(11)]
+    for name, (calls, seconds, self_seconds, max_seconds) in sorted(stage_timings.items(),
+                                                                    key=lambda item: -item[1][1]):
+        lines.append(name[:47].ljust(48) + str(calls).rjust(10) + format(seconds, '11.3f')
+                     + format(self_seconds, '11.3f') + format(seconds / calls * 1000, '11.3f')
+                     + format(max_seconds * 1000, '11.3f'))
+    for name, value in sorted(counters.items()):
+        lines.append(name[:47].ljust(48) + str(value).rjust(10))
+    return '\n'.join(lines)
+
+
+if os.environ.get(PROFILE_ENV_VAR):
+    # A typo in the environment shouldn't stop everything that imports this from running, only the profiling
+    if os.environ[PROFILE_ENV_VAR] in PROFILE_MODES:
+        enable_instrumentation(os.environ[PROFILE_ENV_VAR])
+    else:
+        print('Ignoring ' + PROFILE_ENV_VAR + '=' + os.environ[PROFILE_ENV_VAR] + ' (expected one of '
+              + ', '.join(PROFILE_MODES) + '); profiling is off')
@@ -0,0 +1,174 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from five_e_tools_json_wrapper import FiveEToolsJSONWrapper
+from model_store import load_model_artifact
+from regression import fit_to_data, parse_monster_records_from_file
+
+# Long lived CR prediction service. POST /predict with one 5etools monster (or a list of them) and get back:
+# {"predictions": [{"name": "Test Monster", "cr": 6.8}], "latency_ms": 1.9}
+# Concurrent requests are micro-batched into a single regressor.predict call.
+
+MAX_BATCH_SIZE = 256
+MAX_BATCH_WAIT_SECONDS = 0.002
+
+
+class MicroBatcher:
+    # Collects feature rows from concurrent requests for up to MAX_BATCH_WAIT_SECONDS (or MAX_BATCH_SIZE rows) and
+    # scores them together; predict has a large fixed overhead, so this is much cheaper than one call per request
+    def __init__(self, regressor, max_batch_size=MAX_BATCH_SIZE, max_batch_wait_seconds=MAX_BATCH_WAIT_SECONDS):
+        self.regressor = regressor
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait_seconds = max_batch_wait_seconds
+        self.pending = queue.Queue()
+        self.batches = 0
+        self.rows = 0
+        worker = threading.Thread(target=self.__run, name='micro-batcher', daemon=True)
+        worker.start()
+
+    def predict(self, feature_rows):
+        future = Future()
+        self.pending.put((feature_rows, future))
+        return future.result()
+
+    def __run(self):
+        while True:
+            batch = [self.pending.get()]
+            batch_size = len(batch[0][0])
+            deadline = time.perf_counter() + self.max_batch_wait_seconds
+            while batch_size < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                batch_size += len(request[0])
+            self.__score(batch)
+
+    def __score(self, batch):
+        try:
+            predictions = self.regressor.predict(np.vstack([feature_rows for feature_rows, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(predictions)
+        offset = 0
+        for feature_rows, future in batch:
+            future.set_result(predictions[offset:offset + len(feature_rows)])
+            offset += len(feature_rows)
+
+
+def predict_monsters(micro_batcher, raw_monster_data):
+    predictions = []
+    feature_rows = []
+    scored = []
+    for raw_monster_datum in raw_monster_data:
+        monster_datum = FiveEToolsJSONWrapper(raw_monster_datum)
+        try:
+            feature_rows.append(monster_datum.get_features_array())
+            scored.append(len(predictions))
+            predictions.append({'name': monster_datum.name()})
+        except Exception as e:
+            predictions.append({'name': raw_monster_datum.get('name'), 'error': str(e)})
+    if feature_rows:
+        crs = micro_batcher.predict(np.asarray(feature_rows, dtype=np.float32))
+        for index, cr in zip(scored, crs):
+            predictions[index]['cr'] = float(cr)
+    return predictions
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    micro_batcher = None
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.__send_json(404, {'error': 'Unknown path: ' + self.path})
+            return
+        self.__send_json(200, {'status': 'ok',
+                               'batches': self.micro_batcher.batches,
+                               'rows': self.micro_batcher.rows})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        if self.path != '/predict':
+            self.__send_json(404, {'error': 'Unknown path: ' + self.path})
+            return
+        try:
+            raw_monster_data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self.__send_json(400, {'error': 'Invalid JSON!'})
+            return
+        if not isinstance(raw_monster_data, list):
+            raw_monster_data = [raw_monster_data]
+        # Rejected before anything reaches the micro-batcher, so a bad request never fails anyone else's
+        for index, raw_monster_datum in enumerate(raw_monster_data):
+            if not isinstance(raw_monster_datum, dict):
+                self.__send_json(400, {'error': 'Monster ' + str(index) + ' is not a JSON object'})
+                return
+        try:
+            predictions = predict_monsters(self.micro_batcher, raw_monster_data)
+        except Exception as e:
+            self.__send_json(500, {'error': str(e)})
+            return
+        self.__send_json(200, {'predictions': predictions,
+                               'latency_ms': (time.perf_counter() - start) * 1000.0})
+
+    def __send_json(self, status, body):
+        response = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        # One line per request is far too chatty under load
+        pass
+
+
+class PredictionServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 resets connections as soon as a few dozen clients show up at once
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve(regressor, host, port):
+    PredictionRequestHandler.micro_batcher = MicroBatcher(regressor)
+    server = PredictionServer((host, port), PredictionRequestHandler)
+    print('Serving CR predictions on http://' + host + ':' + str(port) + '/predict')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve CR predictions over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--bestiary', default='5etools_data/beastiary.json',
+                        help='only used to train a model if there is no usable saved one')
+    parser.add_argument('--model', default='model_artifacts/regressor.pkl')
+    args = parser.parse_args()
+
+    # The server trusts a saved model as long as it matches the current feature schema; regression.py is what
+    # retrains it when the bestiary changes
+    model_artifact = load_model_artifact(args.model)
+    if model_artifact is not None:
+        print('Loaded model from: ' + args.model)
+        regressor = model_artifact['regressor']
+    else:
+        regressor = fit_to_data(parse_monster_records_from_file(args.bestiary), args.model)
+    serve(regressor, args.host, args.port)
@@ -1,78 +1,207 @@
+import argparse
 import json
-import sys
+import os
 import time
-import traceback
 
 from sklearn.neural_network import MLPRegressor
+from bestiary_ingest import get_bestiary_signature, load_monster_data_from_directory
+from bestiary_stream import stream_monster_data_from_file, stream_monster_records, stream_monster_records_from_file
+from evaluation_watcher import EvaluationWatcher
+from feature_matrix import build_record_feature_matrix
 from five_e_tools_json_wrapper import FiveEToolsJSONWrapper
+from incremental_training import get_snapshot_key, update_regressor
+from model_store import get_model_key, get_training_fingerprint, load_model_artifact, save_model_artifact
+from parallel_feature_matrix import build_monster_records_parallel, print_failure_summary, write_failure_report
+from pipeline_instrumentation import PROFILE_MODES, enable_instrumentation, stage
+from similar_monsters import format_similar_monsters, get_similar_monster_index, \
+    get_similar_monster_index_location, load_similar_monster_index
 
 
-def fit_to_data(training_monster_data):
+def get_regressor_model_key(monster_data_location):
+    # Checked against the saved model before the bestiary is parsed; see model_store.get_model_key
+    return get_model_key(get_bestiary_signature(monster_data_location), make_regressor().get_params())
+
+
+def fit_to_data(training_monster_records, model_artifact_location=None, training_matrix=None, model_key=None):
     # TODO: Eventually, consider a train test split. X_train, X_test, y_train, y_test = train_test_split(X, y, random_state=1)
-    monster_features = []
-    monster_crs = []
-    for monster_datum in training_monster_data:
-        try:
-            if monster_datum.challenge_rating() > 0:
-                monster_features.append(monster_datum.get_features_array())
-                monster_crs.append(monster_datum.challenge_rating())
-        except Exception as e:
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            print('Failed to parse: ' + str(monster_datum.json_data))
-            print('Reason: ' + str(exc_type) + ', ' + str(e))
-            traceback.print_exc()
-
-    print("Final Training Data Size: " + str(len(monster_features)))
-    regressor = MLPRegressor(max_iter=100000,
-                             alpha=0.01,
-                             random_state=42,
-                             early_stopping=True).fit(monster_features, monster_crs)
-    #regressor = LinearRegression().fit(monster_features, monster_crs)
-    #regressor = RandomForestRegressor().fit(monster_features, monster_crs)
+    # training_monster_records are MonsterRecords (see parse_monster_records_from_file). training_matrix is
+    # build_training_matrix(training_monster_records)'s result, if the caller already has it. The model is saved under
+    # model_key (see get_regressor_model_key).
+    monster_features, monster_crs, _ = training_matrix or build_training_matrix(training_monster_records)
+
+    # The model key changes whenever a bestiary file is touched, even if no monster did; only retrain when the
+    # training data, the feature schema or the hyperparameters changed since the saved model was built
+    if model_artifact_location is not None:
+        with stage('load_model_artifact'):
+            training_fingerprint = get_training_fingerprint(monster_features, monster_crs)
+            model_artifact = load_model_artifact(model_artifact_location)
+        if model_artifact is not None and model_artifact['training_fingerprint'] == training_fingerprint \
+                and model_artifact['regressor'].get_params() == make_regressor().get_params():
+            print('Loaded model from: ' + str(model_artifact_location))
+            if model_key is not None and model_artifact.get('model_key') != model_key:
+                with stage('save_model_artifact'):
+                    save_model_artifact(model_artifact_location, model_artifact['regressor'], training_fingerprint,
+                                        model_artifact['fit_seconds'], len(monster_features), model_key)
+            return model_artifact['regressor']
+
+    start = time.perf_counter()
+    regressor = fit_regressor(monster_features, monster_crs)
+    if model_artifact_location is not None:
+        with stage('save_model_artifact'):
+            save_model_artifact(model_artifact_location, regressor, training_fingerprint,
+                                time.perf_counter() - start, len(monster_features), model_key)
+    return regressor
+
+
+def fit_incrementally_to_data(training_monster_records, model_artifact_location, training_matrix=None, model_key=None):
+    # Like fit_to_data, but when only a few monsters were added, changed or removed since the saved model was trained,
+    # the saved model is updated on just those instead of refit; see incremental_training
+    monster_features, monster_crs, monster_indices = training_matrix or build_training_matrix(training_monster_records)
+    with stage('diff_training_snapshot'):
+        monster_keys = [get_snapshot_key(training_monster_records[index]) for index in monster_indices]
+        content_hashes = [training_monster_records[index].content_hash for index in monster_indices]
+    with stage('update_regressor'):
+        return update_regressor(monster_features, monster_crs, monster_keys, content_hashes, model_artifact_location,
+                                fit_regressor, model_key, make_regressor().get_params())
+
+
+def build_training_matrix(training_monster_records):
+    # Everything was extracted when the records were made, so this is column copies only
+    with stage('build_feature_matrix'):
+        training_matrix = build_record_feature_matrix(training_monster_records)
+    print("Final Training Data Size: " + str(len(training_matrix[0])))
+    return training_matrix
+
+
+def make_regressor():
+    return MLPRegressor(max_iter=100000,
+                        alpha=0.01,
+                        random_state=42,
+                        early_stopping=True)
+    #return LinearRegression()
+    #return RandomForestRegressor()
+
+
+def fit_regressor(monster_features, monster_crs):
+    with stage('MLPRegressor.fit'):
+        regressor = make_regressor().fit(monster_features, monster_crs)
     print("Regressor Score: " + str(regressor.score(monster_features, monster_crs)))
     return regressor
 
 
 def parse_monster_data_from_file(monster_data_location):
+    # monster_data_location is one combined bestiary file, or a directory of upstream bestiary-*.json files (see
+    # bestiary_ingest)
+    print('Loading training data from file: ' + str(monster_data_location))
+    statistics = {}
+    with stage('parse_monster_data_from_file'):
+        if os.path.isdir(monster_data_location):
+            monster_data = load_monster_data_from_directory(monster_data_location, statistics)
+        else:
+            monster_data = list(stream_monster_data_from_file(monster_data_location, statistics))
+    print('Raw Training Data Size: ' + str(statistics['read']))
+    print('Parsed Training Data Size: ' + str(statistics['kept']) + ' (' + str(statistics['copies'])
+          + ' resolved copies, ' + str(statistics['unresolved_copies']) + ' unresolved)')
+    return monster_data
+
+
+def parse_monster_records_from_file(monster_data_location, workers=None, failure_report_location=None):
+    # The monsters of parse_monster_data_from_file as MonsterRecords, which is what training uses. Without workers the
+    # records are made while the bestiary streams in, so the raw dicts never all exist at once; with workers they're
+    # made across a process pool (see parallel_feature_matrix.build_monster_records_parallel) and parse failures are
+    # summarized (and written to failure_report_location) instead of printed one at a time.
+    if workers is not None:
+        monster_data = parse_monster_data_from_file(monster_data_location)
+        failures = []
+        monster_records = build_monster_records_parallel(monster_data, workers, failures=failures)
+        del monster_data
+        print_failure_summary(failures)
+        if failure_report_location is not None:
+            write_failure_report(failures, failure_report_location)
+        print('Monster Records: ' + str(len(monster_records)) + ' (' + str(len(failures)) + ' failed to parse)')
+        return monster_records
+
     print('Loading training data from file: ' + str(monster_data_location))
-    with open(monster_data_location, 'r') as monster_data_file:
-        raw_monster_data = json.load(monster_data_file)
-        print('Raw Training Data Size: ' + str(len(raw_monster_data)))
-
-        monster_data = []
-        for raw_monster_datum in raw_monster_data:
-            monster_datum = FiveEToolsJSONWrapper(raw_monster_datum)
-            # We only want to include monsters with a challenge rating
-            # TODO: Currently we don't (but could) load copies. These are actually the most
-            # TODO: interesting monsters because they have a built-in diff.
-            if monster_datum.has_challenge_rating() and not monster_datum.is_copy():
-                monster_data.append(monster_datum)
-        print('Parsed Training Data Size: ' + str(len(monster_data)))
-        return monster_data
-
-
-def repeatedly_evaluate_data_from_file(regressor, monster_data_to_evaluate_location):
-    monster_data_to_score = ''
-    potential_monster_data_to_score = ''
-    while (True):
-        with open(monster_data_to_evaluate_location, 'r') as monster_data_to_score_file:
+    statistics = {}
+    with stage('parse_monster_data_from_file'):
+        if os.path.isdir(monster_data_location):
+            monster_records = list(stream_monster_records(load_monster_data_from_directory(monster_data_location,
+                                                                                           statistics), statistics))
+        else:
+            monster_records = list(stream_monster_records_from_file(monster_data_location, statistics))
+    print('Raw Training Data Size: ' + str(statistics['read']))
+    print('Parsed Training Data Size: ' + str(statistics['kept']) + ' (' + str(statistics['copies'])
+          + ' resolved copies, ' + str(statistics['unresolved_copies']) + ' unresolved, ' + str(statistics['failed'])
+          + ' failed to parse)')
+    return monster_records
+
+
+def repeatedly_evaluate_data_from_file(regressor, monster_data_to_evaluate_location, similar_monster_index=None):
+    # monster_data_to_evaluate_location can be a single file or a directory of candidate monster files. Each file
+    # holds one monster or a list of them, and is only re-scored when its content changes. With a similar monster
+    # index, each prediction comes with the official monsters most like the candidate and their actual CRs.
+    def evaluate(path, content):
+        try:
+            monster_data_to_score = json.loads(content)
+        except ValueError:
+            print("Invalid JSON! (" + path + ")")
+            return
+        if not isinstance(monster_data_to_score, list):
+            monster_data_to_score = [monster_data_to_score]
+        for monster_datum_to_score in monster_data_to_score:
             try:
-                potential_monster_data_to_score = json.load(monster_data_to_score_file)
-                if potential_monster_data_to_score != monster_data_to_score:
-                    monster_data_to_score = potential_monster_data_to_score
-                    features = FiveEToolsJSONWrapper(monster_data_to_score).get_features_array()
-                    print('Features: ' + str(features))
-                    print('Predicted CR: ' + str(regressor.predict([features])))
-            except:
-                print("Invalid JSON!")
-        time.sleep(2)
+                features = FiveEToolsJSONWrapper(monster_datum_to_score).get_features_array()
+                print('Features: ' + str(features))
+                print('Predicted CR: ' + str(regressor.predict([features])))
+                if similar_monster_index is not None:
+                    print('Similar monsters: ' + format_similar_monsters(similar_monster_index.query(features)))
+            except Exception as e:
+                print('Failed to evaluate ' + path + ': ' + str(e))
+
+    EvaluationWatcher(monster_data_to_evaluate_location, evaluate).watch_forever()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the challenge rating regressor and score evaluate.json')
+    parser.add_argument('--profile', choices=PROFILE_MODES,
+                        help='Time each pipeline stage and print a summary at exit (or set CR_PROFILE)')
+    parser.add_argument('--workers', type=int,
+                        help='Parse the monsters across this many processes instead of one loop')
+    parser.add_argument('--failure-report', default='feature_failures.json',
+                        help='Where --workers writes the monsters that failed to parse')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Update the saved model on just the monsters that changed since it was trained')
+    args = parser.parse_args()
+    if args.profile:
+        enable_instrumentation(args.profile)
+
     monster_data_location = '5etools_data/beastiary.json'
     monster_data_to_evaluate_location = 'evaluate.json'
+    model_artifact_location = 'model_artifacts/regressor.pkl'
+
+    # If neither the bestiary, the feature schema nor the hyperparameters changed since the saved model was fitted, the
+    # bestiary doesn't need to be parsed at all
+    model_key = get_regressor_model_key(monster_data_location)
+    regressor = None
+    similar_monster_index = None
+    if not args.incremental:
+        with stage('load_model_artifact'):
+            model_artifact = load_model_artifact(model_artifact_location, model_key)
+        if model_artifact is not None:
+            print('Loaded model from: ' + str(model_artifact_location))
+            regressor = model_artifact['regressor']
+            similar_monster_index = load_similar_monster_index(
+                get_similar_monster_index_location(model_artifact_location), model_artifact['training_fingerprint'])
 
-    monster_data = parse_monster_data_from_file(monster_data_location)
-    regressor = fit_to_data(monster_data)
+    if similar_monster_index is None:
+        monster_records = parse_monster_records_from_file(monster_data_location, args.workers, args.failure_report)
+        # Built once, for both the regressor and the similar monster index
+        training_matrix = build_training_matrix(monster_records)
+        if args.incremental:
+            regressor = fit_incrementally_to_data(monster_records, model_artifact_location, training_matrix,
+                                                  model_key)
+        elif regressor is None:
+            regressor = fit_to_data(monster_records, model_artifact_location, training_matrix, model_key)
+        similar_monster_index = get_similar_monster_index(monster_records, model_artifact_location, training_matrix)
     #render_data(regressor, monster_data)
-    repeatedly_evaluate_data_from_file(regressor, monster_data_to_evaluate_location)
+    repeatedly_evaluate_data_from_file(regressor, monster_data_to_evaluate_location, similar_monster_index)
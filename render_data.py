@@ -1,86 +1,139 @@
+import argparse
+
+import numpy as np
 from matplotlib import pyplot as plt
-import traceback
-
-# TODO: All of this needs to be updated to use the 5etoolsjsonwrapper
-def render_data(regressor, monster_data):
-    monster_features = []
-    monster_crs = []
-    monster_names = []
-    for monster_datum in monster_data:
-        try:
-            monster_features.append(monster_datum.get_features_array())
-            monster_crs.append(monster_datum.challenge_rating())
-            monster_names.append(monster_datum.name())
-        except Exception as e:
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            print('Failed to parse: ' + str(monster_datum))
-            print('Reason: ' + str(exc_type) + ', ' + str(e))
-            traceback.print_exc()
+from matplotlib.colors import to_rgba_array
+
+from evaluation_report import get_evaluation_report, render_evaluation_report
+from feature_matrix import HP_COLUMN, build_record_feature_matrix
+from model_store import load_model_artifact
+from regression import fit_to_data, parse_monster_records_from_file
+
+# Usage: python render_data.py [--bestiary 5etools_data/beastiary.json] [--model model_artifacts/regressor.pkl]
+#                              [--output plots.png]
+# Every series is one scatter call (one collection, colored per point) and only outliers get a text label, so the
+# full bestiary draws in about a second instead of laying out thousands of annotations. With an output location the
+# plots are saved through the non-interactive Agg backend (.png, .svg, .pdf: whatever the extension says) and no
+# window is opened.
+
+HEADLESS_BACKEND = 'Agg'
+# Close enough, predicted too low, predicted too high
+ACCURACY_COLORS = ('black', 'blue', 'red')
+# Predictions off by more than this fraction of the actual CR are colored (red over, blue under)
+CLOSE_ENOUGH_FACTOR = 0.05
+# Predictions off by more than this fraction of the actual CR get labelled
+OUTLIER_ERROR_FACTOR = 0.5
+# Health/damage more than this many median absolute deviations from the median of its CR gets labelled
+OUTLIER_DEVIATIONS = 4.0
+# Never more labels than this per plot, worst first
+MAX_LABELS = 40
 
+
+def render_data(regressor, monster_records, output_location=None):
+    # Predicts every monster in one call and hands the arrays to render_plots; monster_records are MonsterRecords (see
+    # regression.parse_monster_records_from_file)
+    monster_features, monster_crs, monster_indices = build_record_feature_matrix(monster_records)
+    monster_names = [monster_records[index].name for index in monster_indices]
+    monster_damage = np.asarray([monster_records[index].damage_per_round for index in monster_indices],
+                                dtype=np.float32)
     cr_predictions = regressor.predict(monster_features)
-    monster_crs_errors = cr_predictions - monster_crs
-    score = regressor.score(monster_features, monster_crs)
+    render_plots(monster_names, monster_crs, cr_predictions, monster_features[:, HP_COLUMN], monster_damage,
+                 output_location)
+
+
+def render_plots(monster_names, monster_crs, cr_predictions, monster_health, monster_damage=None,
+                 output_location=None):
+    # All arrays line up with monster_names
+    if output_location is not None:
+        plt.switch_backend(HEADLESS_BACKEND)
+    monster_crs = np.asarray(monster_crs, dtype=np.float32)
+    monster_crs_errors = np.asarray(cr_predictions, dtype=np.float32) - monster_crs
+    residual = np.sum(monster_crs_errors ** 2)
+    total = np.sum((monster_crs - monster_crs.mean()) ** 2) if len(monster_crs) else 0.0
+    score = 1.0 - residual / total if total > 0 else 0.0
 
     # Plot everything useful!
     fig, ax = plt.subplots(nrows=3, ncols=1, figsize=(10, 20))
     render_prediction_accuracy(ax[0], monster_names, monster_crs, monster_crs_errors)
-    render_cr_to_health(ax[1], monster_data)
-    render_cr_to_damage(ax[2], monster_data)
-    plt.title(str(score))
-    plt.show()
+    render_cr_to_health(ax[1], monster_names, monster_crs, monster_health)
+    if monster_damage is not None:
+        render_cr_to_damage(ax[2], monster_names, monster_crs, monster_damage)
+    fig.suptitle('Score: ' + format(score, '.4f'))
+    if output_location is not None:
+        fig.savefig(output_location, dpi=150)
+        plt.close(fig)
+        print('Saved plots to: ' + str(output_location))
+    else:
+        plt.show()
 
 
 def render_prediction_accuracy(ax, monster_names, monster_crs, monster_crs_errors):
-    ax.scatter(monster_crs, monster_crs_errors, s=1, color='black')
-
-    CLOSE_ENOUGH_FACTOR = 0.05
-    for i in range(0, len(monster_names)):
-        error_percent = monster_crs_errors[i] / monster_crs[i] if monster_crs[i] > 0 else monster_crs_errors[i]
-        color = 'black'
-        if error_percent < -CLOSE_ENOUGH_FACTOR:
-            color = 'blue'
-        elif error_percent > CLOSE_ENOUGH_FACTOR:
-            color = 'red'
-        ax.annotate(monster_names[i], (monster_crs[i], monster_crs_errors[i]), color=color, fontsize=6)
+    monster_crs = np.asarray(monster_crs, dtype=np.float32)
+    monster_crs_errors = np.asarray(monster_crs_errors, dtype=np.float32)
+    error_percents = np.where(monster_crs > 0, monster_crs_errors / np.where(monster_crs > 0, monster_crs, 1),
+                              monster_crs_errors)
+    color_indices = np.zeros(len(monster_crs), dtype=np.intp)
+    color_indices[error_percents < -CLOSE_ENOUGH_FACTOR] = 1
+    color_indices[error_percents > CLOSE_ENOUGH_FACTOR] = 2
+    ax.scatter(monster_crs, monster_crs_errors, s=2, c=to_rgba_array(ACCURACY_COLORS)[color_indices], rasterized=True)
+    __label_outliers(ax, monster_names, monster_crs, monster_crs_errors, np.abs(error_percents),
+                     OUTLIER_ERROR_FACTOR, [ACCURACY_COLORS[color_index] for color_index in color_indices])
 
     ax.set_title('Prediction Accuracy')
     ax.set_xlabel('cr actual')
     ax.set_ylabel('cr prediction - cr actual')
 
 
-def render_cr_to_health(ax, monster_data):
-    monster_crs = []
-    monster_health = []
-    monster_names = []
-    for monster_datum in monster_data:
-        monster_crs.append(monster_datum['challenge'])
-        monster_health.append(monster_datum['hit_points'])
-        monster_names.append(monster_datum['name'])
-
-    ax.scatter(monster_crs, monster_health, s=1, color='black')
-    for i in range(0, len(monster_data)):
-        ax.annotate(monster_names[i], (monster_crs[i], monster_health[i]), color='black', fontsize=6)
+def render_cr_to_health(ax, monster_names, monster_crs, monster_health):
+    ax.scatter(monster_crs, monster_health, s=2, color='black', rasterized=True)
+    __label_outliers(ax, monster_names, monster_crs, monster_health,
+                     get_deviations_from_cr_median(monster_crs, monster_health), OUTLIER_DEVIATIONS)
     ax.set_title('CR to Health')
     ax.set_xlabel('cr')
     ax.set_ylabel('health')
 
 
-def render_cr_to_damage(ax, monster_data):
-    monster_crs = []
-    monster_damage = []
-    monster_names = []
-    for monster_datum in monster_data:
-        try:
-            # TODO: Fix this to use get_attack_features
-            monster_damage.append(0)
-            monster_crs.append(monster_datum['challenge'])
-            monster_names.append(monster_datum['name'])
-        except:
-            print('Ignoring ' + monster_datum['name'] + ' because damage could not be got!')
-
-    ax.scatter(monster_crs, monster_damage, s=1, color='black')
-    for i in range(0, len(monster_crs)):
-        ax.annotate(monster_names[i], (monster_crs[i], monster_damage[i]), color='black', fontsize=6)
+def render_cr_to_damage(ax, monster_names, monster_crs, monster_damage):
+    ax.scatter(monster_crs, monster_damage, s=2, color='black', rasterized=True)
+    __label_outliers(ax, monster_names, monster_crs, monster_damage,
+                     get_deviations_from_cr_median(monster_crs, monster_damage), OUTLIER_DEVIATIONS)
     ax.set_title('CR to Damage')
     ax.set_xlabel('cr')
-    ax.set_ylabel('damage')
\ No newline at end of file
+    ax.set_ylabel('damage per round')
+
+
+def get_deviations_from_cr_median(monster_crs, values):
+    # How unusual each value is for its CR: distance from the median of the monsters with the same CR, in median
+    # absolute deviations
+    monster_crs = np.asarray(monster_crs, dtype=np.float32)
+    values = np.asarray(values, dtype=np.float32)
+    deviations = np.zeros(len(values), dtype=np.float32)
+    for cr in np.unique(monster_crs):
+        same_cr = monster_crs == cr
+        median = np.median(values[same_cr])
+        median_absolute_deviation = np.median(np.abs(values[same_cr] - median))
+        deviations[same_cr] = np.abs(values[same_cr] - median) / max(median_absolute_deviation, 1.0)
+    return deviations
+
+
+def __label_outliers(ax, monster_names, xs, ys, outlier_scores, threshold, colors=None):
+    outliers = np.flatnonzero(np.asarray(outlier_scores) > threshold)
+    outliers = outliers[np.argsort(-np.asarray(outlier_scores)[outliers], kind='stable')][:MAX_LABELS]
+    for i in outliers:
+        ax.annotate(monster_names[i], (xs[i], ys[i]), color=colors[i] if colors is not None else 'black', fontsize=6)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot prediction accuracy, health and damage against CR')
+    parser.add_argument('--bestiary', default='5etools_data/beastiary.json')
+    parser.add_argument('--model', default='model_artifacts/regressor.pkl')
+    parser.add_argument('--output', help='save the plots here (.png, .svg, ...) instead of showing them')
+    args = parser.parse_args()
+
+    # A saved model's predictions come from its cached evaluation report; see evaluation_report
+    model_artifact = load_model_artifact(args.model)
+    if model_artifact is not None:
+        render_evaluation_report(get_evaluation_report(model_artifact, args.bestiary), args.output)
+    else:
+        monster_records = parse_monster_records_from_file(args.bestiary)
+        render_data(fit_to_data(monster_records), monster_records, args.output)
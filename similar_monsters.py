@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+from sklearn.neighbors import KDTree
+
+from feature_matrix import FEATURE_COUNT, FEATURE_EXTRACTOR_VERSION, build_record_feature_matrix
+from five_e_tools_json_wrapper import FiveEToolsJSONWrapper
+from model_store import get_training_fingerprint
+
+# Usage: python similar_monsters.py candidate.json [more.json ...] [-k 5] [--bestiary 5etools_data/beastiary.json]
+# "Which official monsters is this homebrew monster most like, and what CR are they?" A KD-tree over the training
+# feature rows, each column scaled to unit variance so hit points don't drown out the saves and traits. It's saved
+# next to the model artifact (<artifact>.similar.pkl) and rebuilt whenever the training matrix changes.
+# Only plain data (the feature rows, CRs, names and sources) is saved and the tree is rebuilt on load, which takes a
+# few milliseconds; a pickled instance would be tied to whichever module (__main__ or similar_monsters) created it.
+
+SIMILAR_MONSTER_INDEX_VERSION = 2
+DEFAULT_NEIGHBOUR_COUNT = 5
+LEAF_SIZE = 16
+
+
+def get_similar_monster_index_location(model_artifact_location):
+    return model_artifact_location + '.similar.pkl'
+
+
+class SimilarMonsterIndex:
+    def __init__(self, monster_features, monster_crs, names, sources):
+        monster_features = np.asarray(monster_features, dtype=np.float32).reshape(-1, FEATURE_COUNT)
+        self.training_fingerprint = get_training_fingerprint(monster_features, monster_crs)
+        self.features = monster_features
+        self.feature_means = monster_features.mean(axis=0) if len(monster_features) else np.zeros(FEATURE_COUNT)
+        self.feature_scales = monster_features.std(axis=0) if len(monster_features) else np.ones(FEATURE_COUNT)
+        self.feature_scales[self.feature_scales == 0] = 1.0
+        self.crs = np.asarray(monster_crs, dtype=np.float32)
+        self.names = list(names)
+        self.sources = list(sources)
+        self.tree = KDTree(self.__scale(monster_features), leaf_size=LEAF_SIZE)
+
+    @classmethod
+    def from_monster_records(cls, monster_records, feature_matrix=None):
+        # feature_matrix is build_record_feature_matrix(monster_records)'s result, if the caller already has it
+        monster_features, monster_crs, monster_indices = feature_matrix or build_record_feature_matrix(monster_records)
+        return cls(monster_features, monster_crs,
+                   [monster_records[index].name for index in monster_indices],
+                   [monster_records[index].source for index in monster_indices])
+
+    def __scale(self, features):
+        return (np.asarray(features, dtype=np.float64).reshape(-1, FEATURE_COUNT) - self.feature_means) \
+            / self.feature_scales
+
+    def query(self, features, k=DEFAULT_NEIGHBOUR_COUNT):
+        # features is one get_features_array row; returns [{'name', 'source', 'cr', 'distance'}, ...], nearest first
+        return self.query_many([features], k)[0]
+
+    def query_many(self, features, k=DEFAULT_NEIGHBOUR_COUNT):
+        # One KD-tree query for a whole batch of rows (a homebrew pack); one result list per row
+        k = min(k, len(self.names))
+        if k == 0:
+            return [[] for _ in range(len(features))]
+        distances, neighbours = self.tree.query(self.__scale(features), k=k)
+        return [[{'name': self.names[neighbour],
+                  'source': self.sources[neighbour],
+                  'cr': float(self.crs[neighbour]),
+                  'distance': float(distance)}
+                 for neighbour, distance in zip(row_neighbours, row_distances)]
+                for row_neighbours, row_distances in zip(neighbours, distances)]
+
+    def save(self, similar_monster_index_location):
+        directory = os.path.dirname(similar_monster_index_location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(similar_monster_index_location + '.tmp', 'wb') as index_file:
+            pickle.dump({'version': SIMILAR_MONSTER_INDEX_VERSION,
+                         'feature_schema_version': FEATURE_EXTRACTOR_VERSION,
+                         'training_fingerprint': self.training_fingerprint,
+                         'features': self.features,
+                         'crs': self.crs,
+                         'names': self.names,
+                         'sources': self.sources}, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(similar_monster_index_location + '.tmp', similar_monster_index_location)
+
+
+def load_similar_monster_index(similar_monster_index_location, training_fingerprint=None):
+    # Returns None if there's no usable index: missing, unreadable, another schema, or (given a training_fingerprint)
+    # built from a different training matrix
+    if not os.path.exists(similar_monster_index_location):
+        return None
+    try:
+        with open(similar_monster_index_location, 'rb') as index_file:
+            saved_index = pickle.load(index_file)
+    except Exception as e:
+        print('Failed to load similar monster index from ' + str(similar_monster_index_location) + ': ' + str(e))
+        return None
+    if saved_index.get('version') != SIMILAR_MONSTER_INDEX_VERSION \
+            or saved_index.get('feature_schema_version') != FEATURE_EXTRACTOR_VERSION:
+        return None
+    if training_fingerprint is not None and saved_index['training_fingerprint'] != training_fingerprint:
+        return None
+    return SimilarMonsterIndex(saved_index['features'], saved_index['crs'], saved_index['names'],
+                               saved_index['sources'])
+
+
+def get_similar_monster_index(monster_records, model_artifact_location, feature_matrix=None):
+    # The saved index if it was built from this exact training matrix, otherwise a freshly built (and saved) one.
+    # feature_matrix is build_record_feature_matrix(monster_records)'s result, if the caller already has it.
+    feature_matrix = feature_matrix or build_record_feature_matrix(monster_records)
+    similar_monster_index_location = get_similar_monster_index_location(model_artifact_location)
+    similar_monster_index = load_similar_monster_index(similar_monster_index_location,
+                                                       get_training_fingerprint(feature_matrix[0], feature_matrix[1]))
+    if similar_monster_index is None:
+        similar_monster_index = SimilarMonsterIndex.from_monster_records(monster_records, feature_matrix)
+        similar_monster_index.save(similar_monster_index_location)
+        print('Saved similar monster index to: ' + similar_monster_index_location)
+    return similar_monster_index
+
+
+def format_similar_monsters(similar_monsters):
+    return ', '.join(similar_monster['name'] + ' (' + str(similar_monster['source']) + ', CR '
+                     + format(similar_monster['cr'], 'g') + ')' for similar_monster in similar_monsters)
+
+
+if __name__ == '__main__':
+    from regression import parse_monster_records_from_file  # regression imports this module
+
+    parser = argparse.ArgumentParser(description='Find the official monsters most like some homebrew ones')
+    parser.add_argument('candidates', nargs='+', help='json files holding a monster or a list of monsters')
+    parser.add_argument('-k', type=int, default=DEFAULT_NEIGHBOUR_COUNT)
+    parser.add_argument('--bestiary', default='5etools_data/beastiary.json')
+    parser.add_argument('--model', default='model_artifacts/regressor.pkl',
+                        help='the index is kept next to this model artifact')
+    args = parser.parse_args()
+
+    similar_monster_index = get_similar_monster_index(parse_monster_records_from_file(args.bestiary), args.model)
+
+    candidate_names = []
+    candidate_features = []
+    for candidate_location in args.candidates:
+        with open(candidate_location, 'r') as candidate_file:
+            candidates = json.load(candidate_file)
+        for candidate in candidates if isinstance(candidates, list) else [candidates]:
+            try:
+                candidate_features.append(FiveEToolsJSONWrapper(candidate).get_features_array())
+                candidate_names.append(candidate.get('name'))
+            except Exception as e:
+                print('Failed to parse ' + str(candidate.get('name')) + ' in ' + candidate_location + ': ' + str(e))
+
+    start = time.perf_counter()
+    results = similar_monster_index.query_many(candidate_features, args.k) if candidate_features else []
+    seconds = time.perf_counter() - start
+    for candidate_name, similar_monsters in zip(candidate_names, results):
+        print(str(candidate_name) + ': ' + format_similar_monsters(similar_monsters))
+    if results:
+        print('Queried ' + str(len(results)) + ' monsters in ' + format(seconds * 1000, '.3f') + 'ms')
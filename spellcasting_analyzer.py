@@ -0,0 +1,71 @@
+import re
+
+# Everything the pipeline wants from a 5etools 'spellcasting' list in one walk over it, e.g:
+# {"name": "Innate Spellcasting", "headerEntries": ["... (spell save {@dc 13}, {@hit 5} to hit with spell attacks)"],
+#  "will": ["{@spell mage hand}"], "daily": {"1e": ["{@spell sleep}"]}}
+# {"name": "Spellcasting", "headerEntries": ["The mage is a 9th-level spellcaster ..."],
+#  "spells": {"0": {"spells": [...]}, "1": {"slots": 4, "spells": [...]}}}
+# Like the old per-feature regex searches, only the first DC/to hit/caster level in each entry's header counts, and a
+# later spellcasting entry overrides an earlier one.
+
+# One scan of each header string picks up all three
+SPELLCASTING_TOKEN_REGEX = re.compile(r'\{@(?:dc (?P<dc>[0-9]+)|hit (?P<to_hit>[0-9]+))\}'
+                                      r'|(?P<caster_level>[0-9]+)(?:st|nd|rd|th)-level spellcaster')
+# Innate uses that are per day or per rest, e.g 'daily': {'3e': [...]} is three times a day, each
+INNATE_USE_KEYS = ('will', 'daily', 'rest', 'weekly', 'monthly', 'yearly', 'charges')
+
+
+def analyze_spellcasting(spellcasting_entries):
+    # Returns {'dc', 'to_hit', 'caster_level', 'slots': {spell level: slots}, 'innate_uses': {use: spell count},
+    # 'spell_count'}; every number is 0 if the monster doesn't state it
+    analysis = {'dc': 0, 'to_hit': 0, 'caster_level': 0, 'slots': {}, 'innate_uses': {}, 'spell_count': 0}
+    for spellcasting in spellcasting_entries or ():
+        header_values = {}
+        # A spellcasting entry without a header has always failed the monster, so this still raises KeyError
+        __scan_header(spellcasting['headerEntries'], header_values)
+        analysis.update(header_values)
+
+        # Anything past the header is best effort: odd shapes are skipped rather than failing the monster
+        for spell_level, spell_level_entry in spellcasting.get('spells', {}).items():
+            if not isinstance(spell_level_entry, dict) or not str(spell_level).isdigit():
+                continue
+            analysis['spell_count'] += len(spell_level_entry.get('spells', ()))
+            if isinstance(spell_level_entry.get('slots'), int):
+                analysis['slots'][int(spell_level)] = \
+                    max(analysis['slots'].get(int(spell_level), 0), spell_level_entry['slots'])
+        for use_key in INNATE_USE_KEYS:
+            if use_key not in spellcasting:
+                continue
+            uses = spellcasting[use_key]
+            if isinstance(uses, dict):
+                for use, spells in uses.items():
+                    __add_innate_uses(analysis, use_key + ':' + use, spells)
+            else:
+                __add_innate_uses(analysis, use_key, uses)
+    return analysis
+
+
+def __add_innate_uses(analysis, use, spells):
+    spell_count = len(spells) if isinstance(spells, list) else 1
+    analysis['innate_uses'][use] = analysis['innate_uses'].get(use, 0) + spell_count
+    analysis['spell_count'] += spell_count
+
+
+def __scan_header(header_entry, header_values):
+    # Walks strings in the same order str(headerEntries) would lay them out
+    if isinstance(header_entry, str):
+        if len(header_values) == 3:
+            return
+        for dc, to_hit, caster_level in SPELLCASTING_TOKEN_REGEX.findall(header_entry):
+            if dc:
+                header_values.setdefault('dc', int(dc))
+            elif to_hit:
+                header_values.setdefault('to_hit', int(to_hit))
+            elif caster_level:
+                header_values.setdefault('caster_level', int(caster_level))
+    elif isinstance(header_entry, dict):
+        for value in header_entry.values():
+            __scan_header(value, header_values)
+    elif isinstance(header_entry, list):
+        for value in header_entry:
+            __scan_header(value, header_values)
@@ -0,0 +1,160 @@
+import argparse
+import copy
+import json
+import os
+import random
+
+# Usage: python synthetic_bestiary.py --count 10000 [--output synthetic_bestiary.json] [--seed 42]
+# Writes a 5etools style bestiary of made up monsters for benchmarking. Every monster starts from the evaluate.json
+# template and gets random stats, saves, armor class entries, traits, attacks (with {@hit}/{@h}/{@damage} tags, 'plus'
+# and 'or' damage clauses and sometimes a multiattack), spellcasting and damage resistances. A few percent are '_copy'
+# variants of earlier monsters, so copy resolution gets exercised too.
+
+# Next to this file, so the generator (and benchmark_pipeline) runs from any working directory
+TEMPLATE_LOCATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evaluate.json')
+ATTRIBUTES = ['str', 'dex', 'con', 'int', 'wis', 'cha']
+CHALLENGE_RATINGS = ['1/8', '1/4', '1/2'] + [str(cr) for cr in range(1, 31)]
+TRAITS = ['Legendary Resistances', 'Magic Resistance', 'Pack Tactics', 'Regeneration', 'Fey Ancestry', 'Amphibious',
+          'Keen Senses', 'Spider Climb']
+DAMAGE_TYPES = ['acid', 'bludgeoning', 'cold', 'fire', 'force', 'lightning', 'necrotic', 'piercing', 'poison',
+                'psychic', 'radiant', 'slashing', 'thunder']
+CONDITIONS = ['blinded', 'charmed', 'frightened', 'paralyzed', 'poisoned', 'prone', 'stunned']
+ATTACK_NAMES = ['Bite', 'Claw', 'Slam', 'Longsword', 'Tail', 'Gore', 'Sting', 'Scimitar', 'Tentacle', 'Greataxe']
+NUMBER_WORDS = ['one', 'two', 'three', 'four']
+DIE_SIZES = [4, 6, 8, 10, 12]
+SOURCES = ['MM', 'VGM', 'MTF', 'SYN']
+COPY_FRACTION = 0.03
+
+
+def load_template(template_location=TEMPLATE_LOCATION):
+    with open(template_location, 'r') as template_file:
+        return json.load(template_file)
+
+
+def generate_monster(template, index, rng):
+    monster = copy.deepcopy(template)
+    monster['name'] = 'Synthetic Monster ' + str(index)
+    monster['source'] = rng.choice(SOURCES)
+    for attribute in ATTRIBUTES:
+        monster[attribute] = rng.randint(1, 30)
+    saves = rng.sample(ATTRIBUTES, rng.randint(0, 3))
+    if saves:
+        monster['save'] = {attribute: '+' + str(rng.randint(0, 12)) for attribute in saves}
+    else:
+        monster.pop('save', None)
+    if rng.random() < 0.5:
+        monster['ac'] = [rng.randint(8, 22)]
+    else:
+        monster['ac'] = [{'ac': rng.randint(8, 22), 'from': ['natural armor']}, rng.randint(8, 22)]
+    monster['hp'] = {'average': rng.randint(1, 500), 'formula': str(rng.randint(1, 30)) + 'd10'}
+    monster['cr'] = rng.choice(CHALLENGE_RATINGS)
+    monster['traitTags'] = rng.sample(TRAITS, rng.randint(0, 3))
+    monster['action'] = generate_actions(rng)
+    if rng.random() < 0.4:
+        monster['spellcasting'] = generate_spellcasting(monster['name'], rng)
+    else:
+        monster.pop('spellcasting', None)
+    if rng.random() < 0.3:
+        monster['resist'] = rng.sample(DAMAGE_TYPES, rng.randint(1, 3))
+    if rng.random() < 0.2:
+        monster['immune'] = rng.sample(DAMAGE_TYPES, rng.randint(1, 2))
+    if rng.random() < 0.2:
+        monster['conditionImmune'] = rng.sample(CONDITIONS, rng.randint(1, 3))
+    return monster
+
+
+def generate_dice(rng):
+    dice = str(rng.randint(1, 6)) + 'd' + str(rng.choice(DIE_SIZES))
+    modifier = rng.randint(0, 8)
+    return dice + ' + ' + str(modifier) if modifier else dice
+
+
+def generate_actions(rng):
+    actions = []
+    attack_names = rng.sample(ATTACK_NAMES, rng.randint(1, 3))
+    for attack_name in attack_names:
+        entry = '{@atk mw} {@hit ' + str(rng.randint(0, 14)) + '} to hit, reach ' + str(rng.choice([5, 10, 15])) \
+                + ' ft., one target. {@h}' + str(rng.randint(1, 40)) + ' ({@damage ' + generate_dice(rng) + '}) ' \
+                + rng.choice(DAMAGE_TYPES) + ' damage'
+        clause = rng.random()
+        if clause < 0.25:
+            entry += ' plus ' + str(rng.randint(1, 20)) + ' ({@damage ' + generate_dice(rng) + '}) ' \
+                     + rng.choice(DAMAGE_TYPES) + ' damage'
+        elif clause < 0.35:
+            entry += ', or ' + str(rng.randint(1, 40)) + ' ({@damage ' + generate_dice(rng) + '}) ' \
+                     + rng.choice(DAMAGE_TYPES) + ' damage if used with two hands'
+        actions.append({'name': attack_name, 'entries': [entry + '.']})
+    if len(attack_names) > 1 and rng.random() < 0.7:
+        clauses = [rng.choice(NUMBER_WORDS[:2]) + ' with its ' + attack_name.lower() for attack_name in attack_names]
+        actions.insert(0, {'name': 'Multiattack', 'entries': [
+            'The monster makes ' + rng.choice(NUMBER_WORDS[1:]) + ' attacks: ' + ', '.join(clauses[:-1]) + ' and '
+            + clauses[-1] + '.']})
+    return actions
+
+
+def generate_spellcasting(name, rng):
+    spellcasting = {
+        'name': 'Spellcasting',
+        'headerEntries': [name + ' is a ' + str(rng.randint(2, 20)) + 'th-level spellcaster (spell save {@dc '
+                          + str(rng.randint(10, 22)) + '}, {@hit ' + str(rng.randint(2, 14))
+                          + '} to hit with spell attacks).'],
+        'spells': {str(level): {'slots': rng.randint(1, 4), 'spells': ['{@spell spell ' + str(level) + '}']}
+                   for level in range(1, rng.randint(2, 9))},
+        'ability': rng.choice(['int', 'wis', 'cha'])
+    }
+    if rng.random() < 0.3:
+        spellcasting['name'] = 'Innate Spellcasting'
+        spellcasting['will'] = ['{@spell mage hand}']
+        spellcasting['daily'] = {'1e': ['{@spell sleep}'], '3': ['{@spell fog cloud}', '{@spell misty step}']}
+    return [spellcasting]
+
+
+def generate_copy(base_monster, index, rng):
+    # A variant of an earlier monster, like the 5etools '_copy' entries
+    return {
+        'name': 'Synthetic Variant ' + str(index),
+        'source': 'SYN',
+        'cr': rng.choice(CHALLENGE_RATINGS),
+        '_copy': {
+            'name': base_monster['name'],
+            'source': base_monster['source'],
+            '_mod': {'*': {'mode': 'replaceTxt', 'replace': 'target', 'with': 'creature'}}
+        },
+        'hp': {'average': rng.randint(1, 500), 'formula': '10d10'}
+    }
+
+
+def generate_bestiary(count, seed=42, template=None):
+    rng = random.Random(seed)
+    template = template if template is not None else load_template()
+    originals = []
+    for index in range(count):
+        if originals and rng.random() < COPY_FRACTION:
+            yield generate_copy(rng.choice(originals), index, rng)
+            continue
+        monster = generate_monster(template, index, rng)
+        if len(originals) < 1000:
+            originals.append(monster)
+        yield monster
+
+
+def write_bestiary(bestiary_location, count, seed=42):
+    # Streams monsters straight to disk, so 100k monsters never have to be in memory at once
+    with open(bestiary_location, 'w', encoding='utf-8') as bestiary_file:
+        bestiary_file.write('[\n')
+        for index, monster in enumerate(generate_bestiary(count, seed)):
+            if index:
+                bestiary_file.write(',\n')
+            bestiary_file.write(json.dumps(monster))
+        bestiary_file.write('\n]\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic 5etools bestiary for benchmarking')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--output', default='synthetic_bestiary.json')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    write_bestiary(args.output, args.count, args.seed)
+    print('Wrote ' + str(args.count) + ' monsters to: ' + args.output)